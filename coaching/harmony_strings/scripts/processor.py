@@ -22,7 +22,6 @@ import subprocess
 from typing import Callable, Any
 from pathlib import Path
 import sys
-import sqlite3
 import json
 from datetime import datetime
 from lollms.utilities import PackageManager, discussion_path_to_url, personality_path_to_url
@@ -32,27 +31,19 @@ if not PackageManager.check_package_installed("plotly"):
 import plotly.graph_objs as go
 from plotly.offline import plot
 import plotly.io as pio  # Import Plotly IO for image saving
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+from zoo_common.sqlite_database import SQLiteDatabase
 
-class GuitarLearningDB:
-    def __init__(self, db_path='guitar_learning.db'):
-        self.db_path = db_path
-        self.create_tables()
-
-    def create_tables(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        # New table CoursePlan
-        cursor.execute('''
+class GuitarLearningDB(SQLiteDatabase):
+    migrations = [
+        '''
             CREATE TABLE IF NOT EXISTS UserProfile (
                 user_id INTEGER PRIMARY KEY AUTOINCREMENT,
                 name TEXT NOT NULL,
                 email TEXT,
                 current_level TEXT NOT NULL,
                 current_step INTEGER
-            )
-        ''')
-
-        cursor.execute('''
+            );
             CREATE TABLE IF NOT EXISTS CoursePlan (
                 step_id INTEGER PRIMARY KEY AUTOINCREMENT,
                 step_title TEXT NOT NULL,
@@ -60,10 +51,7 @@ class GuitarLearningDB:
                 description TEXT NOT NULL,
                 user_id INTEGER,
                 FOREIGN KEY (user_id) REFERENCES UserProfile (user_id)
-            )
-        ''')
-
-        cursor.execute('''
+            );
             CREATE TABLE IF NOT EXISTS ProgressTrack (
                 progress_id INTEGER PRIMARY KEY AUTOINCREMENT,
                 user_id INTEGER NOT NULL,
@@ -75,205 +63,137 @@ class GuitarLearningDB:
                 techniques TEXT,
                 challenge_completed BOOLEAN,
                 FOREIGN KEY (user_id) REFERENCES UserProfile (user_id)
-            )
-        ''')
-        cursor.execute('''
+            );
             CREATE TABLE IF NOT EXISTS AIState (
                 state_id INTEGER PRIMARY KEY AUTOINCREMENT,
                 user_id INTEGER NOT NULL,
                 ai_memory TEXT,
                 FOREIGN KEY (user_id) REFERENCES UserProfile (user_id)
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
+            );
+        ''',
+        # Every query filters by user, the progress history is read by date
+        '''
+            CREATE INDEX IF NOT EXISTS idx_userprofile_name ON UserProfile(name);
+            CREATE INDEX IF NOT EXISTS idx_courseplan_user ON CoursePlan(user_id);
+            CREATE INDEX IF NOT EXISTS idx_progresstrack_user_date ON ProgressTrack(user_id, date);
+            CREATE INDEX IF NOT EXISTS idx_aistate_user ON AIState(user_id, state_id);
+        ''',
+    ]
+
+    def __init__(self, db_path='guitar_learning.db'):
+        super().__init__(db_path)
 
     def add_user_profile(self, name, email, current_level):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
+        return self.write('''
             INSERT INTO UserProfile (name, email, current_level)
             VALUES (?, ?, ?)
         ''', (name, email, current_level))
-        user_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-        return user_id
 
     def get_user_id_by_name(self, name):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
+        result = self.fetchone('''
             SELECT user_id FROM UserProfile
             WHERE name = ?
         ''', (name,))
-        result = cursor.fetchone()
-        conn.close()
         return result[0] if result else None
 
     def list_all_profiles(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
+        return self.fetchall('''
             SELECT user_id, name, email, current_level FROM UserProfile
         ''')
-        results = cursor.fetchall()
-        conn.close()
-        return results
 
     def remove_user_profile(self, user_id):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            DELETE FROM UserProfile WHERE user_id = ?
-        ''', (user_id,))
-        cursor.execute('''
-            DELETE FROM ProgressTrack WHERE user_id = ?
-        ''', (user_id,))
-        cursor.execute('''
-            DELETE FROM AIState WHERE user_id = ?
-        ''', (user_id,))
-        conn.commit()
-        conn.close()
+        with self.transaction() as cursor:
+            cursor.execute('''
+                DELETE FROM UserProfile WHERE user_id = ?
+            ''', (user_id,))
+            cursor.execute('''
+                DELETE FROM ProgressTrack WHERE user_id = ?
+            ''', (user_id,))
+            cursor.execute('''
+                DELETE FROM AIState WHERE user_id = ?
+            ''', (user_id,))
 
     def get_user_profile(self, user_id):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
+        return self.fetchone('''
             SELECT name, email, current_level FROM UserProfile
             WHERE user_id = ?
         ''', (user_id,))
-        result = cursor.fetchone()
-        conn.close()
-        return result
 
     def update_user_profile(self, user_id, name=None, email=None, current_level=None):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
+        self.write('''
             UPDATE UserProfile
             SET name = COALESCE(?, name),
                 email = COALESCE(?, email),
                 current_level = COALESCE(?, current_level)
             WHERE user_id = ?
         ''', (name, email, current_level, user_id))
-        conn.commit()
-        conn.close()
 
     # Method to add a new course step and set it as the current step for a user if no steps are associated
     def add_course_step(self, user_id, step_type, step_title, description):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        # Insert the new step into CoursePlan
-        cursor.execute('''
-            INSERT INTO CoursePlan (step_type, step_title, description, user_id)
-            VALUES (?, ?, ?, ?)
-        ''', (step_type, step_title, description, user_id))
-        step_id = cursor.lastrowid
-
-        # Check if the user has any associated steps
-        cursor.execute('''
-            SELECT current_step FROM UserProfile WHERE user_id = ?
-        ''', (user_id,))
-        result = cursor.fetchone()
+        with self.transaction() as cursor:
+            # Insert the new step into CoursePlan
+            cursor.execute('''
+                INSERT INTO CoursePlan (step_type, step_title, description, user_id)
+                VALUES (?, ?, ?, ?)
+            ''', (step_type, step_title, description, user_id))
+            step_id = cursor.lastrowid
 
-        # If no steps are associated, set the current_step to the new step
-        if result is None or result[0] is None or result[0]==0:
+            # Check if the user has any associated steps
             cursor.execute('''
-                UPDATE UserProfile SET current_step = ? WHERE user_id = ?
-            ''', (step_id, user_id,))
+                SELECT current_step FROM UserProfile WHERE user_id = ?
+            ''', (user_id,))
+            result = cursor.fetchone()
 
-        conn.commit()
-        conn.close()
+            # If no steps are associated, set the current_step to the new step
+            if result is None or result[0] is None or result[0]==0:
+                cursor.execute('''
+                    UPDATE UserProfile SET current_step = ? WHERE user_id = ?
+                ''', (step_id, user_id,))
         return step_id
 
-    def get_current_course_step(self, user_id):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT cp.step_id, cp.step_type, cp.description
-            FROM UserProfile up
-            JOIN CoursePlan cp ON up.current_step = cp.step_id
-            WHERE up.user_id = ?
-        ''', (user_id,))
-        result = cursor.fetchone()
-        conn.close()
-        return {
-            'step_id': result[0],
-            'step_type': result[1],
-            'code': result[2],
-        } if result else None
-
     def update_course_step(self, step_id, step_type=None, code=None):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
+        self.write('''
             UPDATE CoursePlan
             SET step_type = COALESCE(?, step_type),
                 code = COALESCE(?, code)
             WHERE step_id = ?
         ''', (step_type, code, step_id))
-        conn.commit()
-        conn.close()
 
     def set_user_current_step(self, user_id, step_id):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
+        self.write('''
             UPDATE UserProfile
             SET current_step = ?
             WHERE user_id = ?
         ''', (step_id, user_id))
-        conn.commit()
-        conn.close()
-
 
     def log_progress(self, user_id, level, chords, scales, songs, techniques, challenge_completed):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
+        self.write('''
             INSERT INTO ProgressTrack (user_id, level, chords, scales, songs, techniques, challenge_completed)
             VALUES (?, ?, ?, ?, ?, ?, ?)
         ''', (user_id, level, chords, scales, songs, techniques, challenge_completed))
-        conn.commit()
-        conn.close()
 
     def get_last_ai_state(self, user_id):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
+        result = self.fetchone('''
             SELECT ai_memory FROM AIState
             WHERE user_id = ?
             ORDER BY state_id DESC
             LIMIT 1
         ''', (user_id,))
-        result = cursor.fetchone()
-        conn.close()
         return result[0] if result else None
 
     def set_ai_state(self, user_id, ai_memory):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
+        self.write('''
             INSERT INTO AIState (user_id, ai_memory)
             VALUES (?, ?)
         ''', (user_id, ai_memory))
-        conn.commit()
-        conn.close()
 
     def get_user_overall_progress(self, user_id):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
+        result = self.fetchone('''
             SELECT level, chords, scales, songs, techniques, challenge_completed FROM ProgressTrack
             WHERE user_id = ?
             ORDER BY progress_id DESC
             LIMIT 1
         ''', (user_id,))
-        result = cursor.fetchone()
-        conn.close()
         return {
             'level': result[0],
             'chords': result[1],
@@ -285,99 +205,73 @@ class GuitarLearningDB:
 
     # New method to clear the course for a user
     def clear_course_for_user(self, user_id):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            UPDATE UserProfile
-            SET current_step = 0
-            WHERE user_id = ?
-        ''', (user_id,))
-        conn.commit()
-
-        # New method to remove all course steps for a user
-        cursor.execute('''
-            DELETE FROM CoursePlan
-            WHERE step_id IN (
-                SELECT current_step FROM UserProfile WHERE user_id = ?
-            )
-        ''', (user_id,))
-        conn.commit()
-        conn.close()
+        with self.transaction() as cursor:
+            cursor.execute('''
+                UPDATE UserProfile
+                SET current_step = 0
+                WHERE user_id = ?
+            ''', (user_id,))
+            # New method to remove all course steps for a user
+            cursor.execute('''
+                DELETE FROM CoursePlan
+                WHERE step_id IN (
+                    SELECT current_step FROM UserProfile WHERE user_id = ?
+                )
+            ''', (user_id,))
 
     # Method to get all course steps for a user
     def get_course_steps(self, user_id):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
+        return self.fetchall('''
             SELECT step_id, step_title, step_type, description
             FROM CoursePlan
             WHERE user_id = ?
         ''', (user_id,))
-        # Fetch all results
-        course_steps = cursor.fetchall()
-        conn.close()
-        return course_steps
 
-    
     # Method to get the current course step for a user
     def get_current_course_step(self, user_id):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
+        current_step = self.fetchone('''
             SELECT CP.step_id, CP.step_type, CP.description
             FROM UserProfile UP
             JOIN CoursePlan CP ON UP.current_step = CP.step_id
             WHERE UP.user_id = ?
         ''', (user_id,))
-        # Fetch the result
-        current_step = cursor.fetchone()
-        conn.close()
         return current_step if current_step else None
 
     # Method to advance to the next course step for a user
     def next_step(self, user_id):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Get the current step for the user
-        cursor.execute('''
-            SELECT current_step FROM UserProfile WHERE user_id = ?
-        ''', (user_id,))
-        result = cursor.fetchone()
-        if result:
-            current_step = result[0]
-            # Check if there is a next step available
+        with self.transaction() as cursor:
+            # Get the current step for the user
             cursor.execute('''
-                SELECT EXISTS(SELECT 1 FROM CoursePlan WHERE step_id = ? + 1)
-            ''', (current_step,))
-            has_next_step = cursor.fetchone()[0]
-            
-            if has_next_step:
-                # Update the current step to the next step
+                SELECT current_step FROM UserProfile WHERE user_id = ?
+            ''', (user_id,))
+            result = cursor.fetchone()
+            if result:
+                current_step = result[0]
+                # Check if there is a next step available
                 cursor.execute('''
-                    UPDATE UserProfile SET current_step = current_step + 1 WHERE user_id = ?
-                ''', (user_id,))
-                conn.commit()
-                message = "User has been advanced to the next step."
+                    SELECT EXISTS(SELECT 1 FROM CoursePlan WHERE step_id = ? + 1)
+                ''', (current_step,))
+                has_next_step = cursor.fetchone()[0]
+
+                if has_next_step:
+                    # Update the current step to the next step
+                    cursor.execute('''
+                        UPDATE UserProfile SET current_step = current_step + 1 WHERE user_id = ?
+                    ''', (user_id,))
+                    message = "User has been advanced to the next step."
+                else:
+                    message = "No more steps available. Course completed."
             else:
-                message = "No more steps available. Course completed."
-        else:
-            message = "User ID does not exist."
-
-        conn.close()
+                message = "User ID does not exist."
         return message
 
 
     def plot_user_progress(self, user_id, image_path, html_path):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
+        results = self.fetchall('''
             SELECT date, level, chords, scales, songs, techniques FROM ProgressTrack
             WHERE user_id = ?
             ORDER BY date
         ''', (user_id,))
-        results = cursor.fetchall()
-        conn.close()
 
         if not results:
             print("No progress data to plot.")
@@ -19,7 +19,8 @@ import subprocess
 from typing import Callable, Any
 from functools import partial
 
-import sqlite3
+from pathlib import Path
+import sys
 import json
 from datetime import datetime
 from lollms.utilities import PackageManager, discussion_path_to_url
@@ -42,6 +43,8 @@ import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 import pandas as pd
 import kaleido
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+from zoo_common.sqlite_database import SQLiteDatabase
 
 def create_and_save_happiness_index_plot(data, html_file_path, png_file_path):
     """
@@ -75,26 +78,14 @@ def create_and_save_happiness_index_plot(data, html_file_path, png_file_path):
 
     return html_file_path, png_file_path
 
-class GratitudeDB():
-    def __init__(self, db_path):
-        self.db_path = db_path
-        self.create_tables()
-
-    def _connect(self):
-        """Create a new database connection."""
-        return sqlite3.connect(self.db_path)
-
-    def create_tables(self):
-        """Create the tables needed for the gratitude database with AI enhanced notes and happiness index."""
-        conn = self._connect()
-        cursor = conn.cursor()
-        cursor.execute('''
+class GratitudeDB(SQLiteDatabase):
+    migrations = [
+        # Tables of the gratitude database with AI enhanced notes and happiness index
+        '''
             CREATE TABLE IF NOT EXISTS users (
                 id INTEGER PRIMARY KEY,
                 name TEXT NOT NULL
-            )
-        ''')
-        cursor.execute('''
+            );
             CREATE TABLE IF NOT EXISTS notes (
                 id INTEGER PRIMARY KEY,
                 user_id INTEGER NOT NULL,
@@ -102,138 +93,118 @@ class GratitudeDB():
                 enhanced_content TEXT DEFAULT '',
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY(user_id) REFERENCES users(id)
-            )
-        ''')
-        cursor.execute('''
+            );
             CREATE TABLE IF NOT EXISTS happiness_index (
                 id INTEGER PRIMARY KEY,
                 user_id INTEGER NOT NULL,
                 index_value REAL,
                 recorded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY(user_id) REFERENCES users(id)
-            )
-        ''')
-        conn.commit()
-        conn.close()
+            );
+        ''',
+        # Every query filters by user and sorts by date
+        '''
+            CREATE INDEX IF NOT EXISTS idx_users_name ON users(name);
+            CREATE INDEX IF NOT EXISTS idx_notes_user_created ON notes(user_id, created_at);
+            CREATE INDEX IF NOT EXISTS idx_happiness_user_recorded ON happiness_index(user_id, recorded_at);
+        ''',
+    ]
 
     def add_user_profile(self, name):
-        """Add a new user profile to the database."""
-        conn = self._connect()
-        cursor = conn.cursor()
-        cursor.execute('INSERT INTO users (name) VALUES (?)', (name,))
-        conn.commit()
-        conn.close()
+        """Add a new user profile to the database and return its ID."""
+        return self.write('INSERT INTO users (name) VALUES (?)', (name,))
 
     def get_user_id_by_name(self, name):
         """Get a user's ID by their name."""
-        conn = self._connect()
-        cursor = conn.cursor()
-        cursor.execute('SELECT id FROM users WHERE name = ?', (name,))
-        user_id = cursor.fetchone()
-        conn.close()
+        user_id = self.fetchone('SELECT id FROM users WHERE name = ?', (name,))
         return user_id[0] if user_id else None
 
     def list_all_profiles(self):
         """List all user profiles."""
-        conn = self._connect()
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM users')
-        profiles = cursor.fetchall()
-        conn.close()
-        return profiles
+        return self.fetchall('SELECT * FROM users')
 
     def remove_user_profile(self, user_id):
         """Remove a user profile by ID."""
-        conn = self._connect()
-        cursor = conn.cursor()
-        cursor.execute('DELETE FROM users WHERE id = ?', (user_id,))
-        conn.commit()
-        conn.close()
+        self.write('DELETE FROM users WHERE id = ?', (user_id,))
 
     def add_note(self, user_id, raw_content, enhanced_content=''):
         """Add a gratitude note for a user with an optional AI enhanced note."""
-        conn = self._connect()
-        cursor = conn.cursor()
-        cursor.execute('''
+        return self.write('''
             INSERT INTO notes (user_id, raw_content, enhanced_content)
             VALUES (?, ?, ?)
         ''', (user_id, raw_content, enhanced_content))
-        conn.commit()
-        conn.close()
-
-    def view_notes(self, user_id):
-        """View all notes for a user."""
-        conn = self._connect()
-        cursor = conn.cursor()
-        cursor.execute('''
+
+    def count_notes(self, user_id):
+        """Count the notes of a user."""
+        return self.fetchone('SELECT COUNT(*) FROM notes WHERE user_id = ?', (user_id,))[0]
+
+    def view_notes(self, user_id, limit=None, offset=0):
+        """View the notes of a user, newest first, optionally one page at a time."""
+        return self.fetchall('''
             SELECT raw_content, enhanced_content, created_at
             FROM notes
             WHERE user_id = ?
-            ORDER BY created_at DESC
-        ''', (user_id,))
-        notes = cursor.fetchall()
-        conn.close()
-        return notes
+            ORDER BY created_at DESC, id DESC
+            LIMIT ? OFFSET ?
+        ''', (user_id, -1 if limit is None else limit, offset))
+
+    def iter_notes(self, user_id, batch_size=100):
+        """Stream the notes of a user, newest first, without loading them all in memory."""
+        return self.iter_rows('''
+            SELECT raw_content, enhanced_content, created_at
+            FROM notes
+            WHERE user_id = ?
+            ORDER BY created_at DESC, id DESC
+        ''', (user_id,), batch_size)
 
     def view_last_note(self, user_id):
         """View the last note for a user."""
-        conn = self._connect()
-        cursor = conn.cursor()
-        cursor.execute('''
+        last_note = self.fetchone('''
             SELECT raw_content, enhanced_content
             FROM notes
             WHERE user_id = ?
             ORDER BY created_at DESC
             LIMIT 1
         ''', (user_id,))
-        last_note = cursor.fetchone()
-        conn.close()
         return last_note if last_note else (None, None)
 
     def remove_note(self, note_id):
         """Remove a note by ID."""
-        conn = self._connect()
-        cursor = conn.cursor()
-        cursor.execute('DELETE FROM notes WHERE id = ?', (note_id,))
-        conn.commit()
-        conn.close()
+        self.write('DELETE FROM notes WHERE id = ?', (note_id,))
 
     def enhance_note(self, note_id, enhanced_content):
         """Update a note with AI enhanced content."""
-        conn = self._connect()
-        cursor = conn.cursor()
-        cursor.execute('''
+        self.write('''
             UPDATE notes
             SET enhanced_content = ?
             WHERE id = ?
         ''', (enhanced_content, note_id))
-        conn.commit()
-        conn.close()
 
     def add_happiness_index(self, user_id, index_value):
         """Add a happiness index entry for a user."""
-        conn = self._connect()
-        cursor = conn.cursor()
-        cursor.execute('''
+        return self.write('''
             INSERT INTO happiness_index (user_id, index_value)
             VALUES (?, ?)
         ''', (user_id, index_value))
-        conn.commit()
-        conn.close()
-
-    def view_happiness_index(self, user_id):
-        """View happiness index history for a user."""
-        conn = self._connect()
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT index_value, recorded_at
-            FROM happiness_index
-            WHERE user_id = ?
-            ORDER BY recorded_at ASC
-        ''', (user_id,))
-        index_history = cursor.fetchall()
-        conn.close()
-        return index_history
+
+    def view_happiness_index(self, user_id, last=None):
+        """View happiness index history for a user, optionally only its last entries."""
+        if last is None:
+            return self.fetchall('''
+                SELECT index_value, recorded_at
+                FROM happiness_index
+                WHERE user_id = ?
+                ORDER BY recorded_at ASC
+            ''', (user_id,))
+        return self.fetchall('''
+            SELECT index_value, recorded_at FROM (
+                SELECT id, index_value, recorded_at
+                FROM happiness_index
+                WHERE user_id = ?
+                ORDER BY recorded_at DESC, id DESC
+                LIMIT ?
+            ) ORDER BY recorded_at ASC, id ASC
+        ''', (user_id, last))
 
 class Processor(APScript):
     """
@@ -271,6 +242,8 @@ class Processor(APScript):
                 # String configuration with options
                 {"name":"user_profile_name", "type":"string", "value":"", "help":"The profile name of the user. Used to store progress data."},
                 {"name":"happiness_level", "type":"int", "value":0, "help":"Your initial happiness level styarting from 0 to 100."},
+                {"name":"notes_page_size", "type":"int", "value":20, "help":"Number of notes shown by each page of the notes listing."},
+                {"name":"happiness_history_in_context", "type":"int", "value":30, "help":"Number of the last happiness index entries given to the AI on each turn."},
                 
                 # Integer configuration example
                 #{"name":"max_attempts", "type":"int", "value":3, "help":"Maximum number of attempts for retryable operations."},
@@ -346,7 +319,7 @@ class Processor(APScript):
             return None, "", 0
         self.personality.info("Generating")
         memory_data = self.user_profile_db.view_last_note(user_id)
-        happiness_index = self.user_profile_db.view_happiness_index(user_id)
+        happiness_index = self.user_profile_db.view_happiness_index(user_id, last=self.personality_config.happiness_history_in_context)
 
         return user_id, memory_data[1], happiness_index
     
@@ -415,9 +388,15 @@ class Processor(APScript):
         last_note = self.user_profile_db.view_last_note(user_id)
         return f"# User note:\n{last_note[0]}\n# Ai enhanced note:\n{last_note[1]}"
 
-    def view_all_notes(self, user_id):
-        all_notes = self.user_profile_db.view_notes(user_id)
-        return "\n".join([f"# User note created at {last_note[2]}:\n{last_note[0]}\n# Ai enhanced note:\n{last_note[1]}" for last_note in all_notes])
+    def view_all_notes(self, user_id, page:int=1):
+        page_size = max(1, self.personality_config.notes_page_size)
+        nb_pages = max(1, -(-self.user_profile_db.count_notes(user_id) // page_size))
+        page = min(max(1, int(page)), nb_pages)
+        notes = self.user_profile_db.view_notes(user_id, limit=page_size, offset=(page-1)*page_size)
+        output = "\n".join([f"# User note created at {last_note[2]}:\n{last_note[0]}\n# Ai enhanced note:\n{last_note[1]}" for last_note in notes])
+        if nb_pages>1:
+            output += f"\n\nPage {page}/{nb_pages}"
+        return output
     
 
     def add_happiness_index(self, happiness_index:int, user_id):
@@ -526,8 +505,8 @@ class Processor(APScript):
             {
                 "function_name": "view_all_notes",
                 "function":  partial(self.view_all_notes,user_id=user_id),
-                "function_description": "Views all notes from the database.",
-                "function_parameters": []                
+                "function_description": "Views the notes from the database, newest first, one page at a time.",
+                "function_parameters": [{"name": "page", "type": "int"}]                
             },
             {
                 "function_name": "add_happiness_index",
@@ -15,28 +15,10 @@ from lollms.prompting import LollmsContextDetails
 from pathlib import Path
 from typing import Callable, Any
 import subprocess
-import ast
+import sys
 
-class FunctionAndMethodExtractor(ast.NodeVisitor):
-    def __init__(self, tokens):
-        self.tokens = tokens
-        self.definitions = []
-        self.current_index = 0
-
-    def visit_FunctionDef(self, node):
-        definition_tokens = self.tokens[self.current_index:node.end_lineno]
-        self.definitions.append(('Function', node.name, definition_tokens))
-        self.current_index = node.end_lineno
-        self.generic_visit(node)
-
-    def visit_ClassDef(self, node):
-        for item in node.body:
-            if isinstance(item, ast.FunctionDef):
-                method_name = f'{node.name}.{item.name}'
-                definition_tokens = self.tokens[self.current_index:item.end_lineno]
-                self.definitions.append(('Method', method_name, definition_tokens))
-                self.current_index = item.end_lineno
-        self.generic_visit(node)
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+from zoo_common.code_chunking import CodeChunker
 
 def parse_query(query):
     """
@@ -142,7 +124,7 @@ class Processor(APScript):
                             docs_folder_path:Path, 
                             max_nb_tokens_in_file:int, 
                             tokenize:Callable, 
-                            detokenize:Callable,
+                            chunker:CodeChunker,
                             accepted_file_types:list
                         ):
          
@@ -153,7 +135,7 @@ class Processor(APScript):
                 if self.personality_config.process_subfolders:
                     docs_subfolder = docs_folder_path/file.stem
                     docs_subfolder.mkdir(exist_ok=True, parents=True)
-                    self.process_folder(file, docs_subfolder, max_nb_tokens_in_file, tokenize, detokenize, accepted_file_types)
+                    self.process_folder(file, docs_subfolder, max_nb_tokens_in_file, tokenize, chunker, accepted_file_types)
             else:
                 if file.suffix.lower() in accepted_file_types:
                     output_documentation_file_path = docs_folder_path/f"{file.stem}.md"
@@ -170,41 +152,16 @@ class Processor(APScript):
                                 with open(output_documentation_file_path,"w", encoding="utf-8") as df:
                                     df.write(analysis)
                             else:
-                                tokens = tokenize(code)
-                                extractor = FunctionAndMethodExtractor(tokens)
-                                tree = ast.parse(code)
-                                extractor.visit(tree)
-
-                                chunk = []
-                                nb_processed = 0
-                                for definition_type, definition_name, definition_tokens in extractor.definitions:
-                                    if len(chunk) + len(definition_tokens) <= max_nb_tokens_in_file:
-                                        chunk.extend(definition_tokens)
-                                    else:
-                                        # Process the current chunk
-                                        definition_code = detokenize(chunk)
-                                        if nb_processed==0:
-                                            analysis = self.build_documentation_report(definition_code, file.name)
-                                            with open(output_documentation_file_path,"a", encoding="utf-8") as df:
-                                                df.write(analysis)
-                                        else:
-                                            analysis = self.continue_documentation_report(definition_code)
-                                            with open(output_documentation_file_path,"a", encoding="utf-8") as df:
-                                                df.write("\n"+analysis)
-                                        nb_processed +=1
-                                        chunk = definition_tokens  # Start a new chunk with the current definition
-
-                                # Process the last chunk if there are any tokens left
-                                if chunk:
-                                    definition_code = detokenize(chunk)
-                                    if nb_processed>0:
-                                        analysis = self.continue_documentation_report(definition_code)
-                                        with open(output_documentation_file_path,"a", encoding="utf-8") as df:
-                                            df.write(analysis)
-                                    else:
-                                        analysis = self.build_documentation_report(definition_code, file)
+                                chunks = chunker.chunk(code, file.name, max_nb_tokens_in_file)
+                                for i, chunk in enumerate(chunks):
+                                    if i==0:
+                                        analysis = self.build_documentation_report(chunk.text, file.name)
                                         with open(output_documentation_file_path,"w", encoding="utf-8") as df:
                                             df.write(analysis)
+                                    else:
+                                        analysis = self.continue_documentation_report(chunk.text)
+                                        with open(output_documentation_file_path,"a", encoding="utf-8") as df:
+                                            df.write("\n"+analysis)
 
                             self.step_end(f"Processing file {file}")
 
@@ -215,10 +172,10 @@ class Processor(APScript):
         code_folder_path = Path(self.personality_config.code_folder_path)
         docs_folder_path = Path(self.personality_config.docs_folder_path)
         tokenize = self.personality.model.tokenize
-        detokenize = self.personality.model.detokenize
+        chunker = CodeChunker(tokenize)
         max_nb_tokens_in_file = 3*self.personality.config.ctx_size/4
         accepted_file_types = ["." + extension.strip() if not extension.startswith(".") else extension.strip() for extension in self.personality_config.files_to_parse.split(",")] 
-        self.process_folder(code_folder_path, docs_folder_path, max_nb_tokens_in_file, tokenize, detokenize, accepted_file_types)
+        self.process_folder(code_folder_path, docs_folder_path, max_nb_tokens_in_file, tokenize, chunker, accepted_file_types)
 
     def add_file(self, path, client, callback=None):
         """
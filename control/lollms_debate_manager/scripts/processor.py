@@ -22,6 +22,10 @@ import subprocess
 from typing import Callable, Any, List
 from functools import partial
 from ascii_colors import trace_exception
+from pathlib import Path
+import sys
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+from zoo_common.routing_index import get_personality_routing_index
 
 
 class Processor(APScript):
@@ -61,6 +65,7 @@ class Processor(APScript):
                 
                 # Integer configuration example
                 #{"name":"max_attempts", "type":"int", "value":3, "help":"Maximum number of attempts for retryable operations."},
+                {"name":"nb_debaters", "type":"int", "value":6, "help":"Number of mounted personalities whose description best matches the debate subject that are invited. 0 invites all the mounted personalities."},
                 
                 # List configuration example
                 #{"name":"favorite_topics", "type":"list", "value":["AI", "Robotics", "Space"], "help":"List of favorite topics for personalized responses."}
@@ -161,6 +166,14 @@ class Processor(APScript):
         self.set_message_content(self.personality.help)
 
 
+    def select_debaters(self, subject, personalities:List[AIPersonality]):
+        """Returns the personalities whose description best matches the debate subject."""
+        candidates = [p for p in personalities if p.name!=self.personality.name]
+        if self.personality_config.nb_debaters<=0 or len(candidates)<=self.personality_config.nb_debaters:
+            return candidates
+        routing_index = get_personality_routing_index(self.personality, self.personality.personality_output_folder.parent/"routing_index")
+        return [candidates[i] for i, _ in routing_index.shortlist(subject, candidates, self.personality_config.nb_debaters)]
+
     def run_workflow(self,  context_details:LollmsContextDetails=None, client:Client=None,  callback: Callable[[str | list | None, MSG_OPERATION_TYPE, str, AIPersonality| None], bool]=None):
         """
         This function generates code based on the given parameters.
@@ -197,7 +210,7 @@ class Processor(APScript):
             take_a_photo_function(self, client),
             select_image_file_function(self, client)
         ]
-        members:List[AIPersonality] = [p.name for p in self.personality.app.mounted_personalities]
+        members:List[str] = [p.name for p in self.select_debaters(prompt, self.personality.app.mounted_personalities)]
         self.callback = callback
         # self.process_state(prompt, previous_discussion_text, callback, context_details, client)
 
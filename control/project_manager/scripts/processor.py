@@ -10,7 +10,10 @@ from pathlib import Path
 from typing import List
 import json
 import subprocess
+import sys
 from ascii_colors import trace_exception
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+from zoo_common.routing_index import get_personality_routing_index
 # Helper functions
 class Processor(APScript):
     """
@@ -33,6 +36,7 @@ class Processor(APScript):
         personality_config_template = ConfigTemplate(
             [
                 {"name":"nb_attempts","type":"int","value":5, "help":"Maximum number of attempts to summon a member"},
+                {"name":"nb_candidate_members","type":"int","value":8, "help":"Number of members whose description best matches the request that are proposed for the plan. 0 proposes all the mounted members."},
             ]
             )
         personality_config_vals = BaseConfig.from_template(personality_config_template)
@@ -79,6 +83,14 @@ class Processor(APScript):
     def help(self, prompt="", full_context=""):
         self.set_message_content(self.personality.help)
     
+    def shortlist_members(self, prompt, members:List[AIPersonality]):
+        """Returns the ids of the members whose description best matches the request, best first."""
+        ids = [i for i, member in enumerate(members) if member.name!=self.personality.name]
+        if self.personality_config.nb_candidate_members<=0 or len(ids)<=self.personality_config.nb_candidate_members:
+            return ids
+        routing_index = get_personality_routing_index(self.personality, self.personality.personality_output_folder.parent/"routing_index")
+        return [ids[i] for i, _ in routing_index.shortlist(prompt, [members[i] for i in ids], self.personality_config.nb_candidate_members)]
+
     def add_file(self, path, client, callback=None):
         """
         Here we implement the file reception handling
@@ -114,6 +126,7 @@ class Processor(APScript):
         self.callback = callback
         self.personality.info("Generating")
         members:List[AIPersonality] = self.personality.app.mounted_personalities
+        candidate_ids = self.shortlist_members(prompt, members)
         output = ""
         
         self.step_start("Making plan")
@@ -126,11 +139,11 @@ class Processor(APScript):
                 "Team members:\n"
             ]) 
             collective_infos = ""
-            for i,drone in enumerate(members):
-                if drone.name!=self.personality.name:
-                    collective_infos +=  f"member id: {i}\n"
-                    collective_infos +=  f"member name: {drone.name}\n"
-                    collective_infos +=  f"member description: {drone.personality_description[:126]}...\n"
+            for i in candidate_ids:
+                drone = members[i]
+                collective_infos +=  f"member id: {i}\n"
+                collective_infos +=  f"member name: {drone.name}\n"
+                collective_infos +=  f"member description: {drone.personality_description[:126]}...\n"
             q_prompt += collective_infos
             answer = ""
             q_prompt += "\n".join([
@@ -9,6 +9,9 @@ from lollms.prompting import LollmsContextDetails
 
 from pathlib import Path
 from typing import List
+import sys
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+from zoo_common.routing_index import get_personality_routing_index
 if PackageManager.check_package_installed("pygame"):
     import pygame
 else:
@@ -41,6 +44,8 @@ class Processor(APScript):
             [
                 
                 {"name":"nb_attempts","type":"int","value":5, "help":"Maximum number of attempts to summon a drone"},
+                {"name":"nb_candidate_drones","type":"int","value":5, "help":"Number of drones whose description best matches the request that are proposed to the queen. 0 proposes all the mounted drones."},
+                {"name":"drone_description_size","type":"int","value":1000, "help":"Number of characters of each candidate drone description shown to the queen"},
             ]
             )
         personality_config_vals = BaseConfig.from_template(personality_config_template)
@@ -91,6 +96,14 @@ class Processor(APScript):
     def help(self, prompt="", full_context=""):
         self.set_message_content(self.personality.help)
     
+    def shortlist_drones(self, prompt, collective:List[AIPersonality]):
+        """Returns the drones whose description best matches the request, best first."""
+        drones = [drone for drone in collective if drone.name!=self.personality.name]
+        if self.personality_config.nb_candidate_drones<=0 or len(drones)<=self.personality_config.nb_candidate_drones:
+            return drones
+        routing_index = get_personality_routing_index(self.personality, self.personality.personality_output_folder.parent/"routing_index")
+        return [drones[i] for i, _ in routing_index.shortlist(prompt, drones, self.personality_config.nb_candidate_drones)]
+
     def add_file(self, path, client, callback=None):
         """
         Here we implement the file reception handling
@@ -125,7 +138,10 @@ class Processor(APScript):
 
         self.callback = callback
         ASCIIColors.info("Generating")
-        collective:List[AIPersonality] = self.personality.app.mounted_personalities
+        collective:List[AIPersonality] = self.shortlist_drones(prompt, self.personality.app.mounted_personalities)
+        if len(collective)==0:
+            self.set_message_content("No drone is mounted. Mount some personalities to build the collective.")
+            return ""
 
 
         answer = ""
@@ -139,7 +155,10 @@ class Processor(APScript):
         self.step_start("Summoning collective")
         while attempts<self.personality_config.nb_attempts:
             try:
-                selection = self.multichoice_question('which drone is the best to fulfill the user request?',[f"{drone.name} : {drone.personality_description[:4000]}" for drone in collective],q_prompt)
+                if len(collective)==1:
+                    selection = 0
+                else:
+                    selection = self.multichoice_question('which drone is the best to fulfill the user request?',[f"{drone.name} : {drone.personality_description[:self.personality_config.drone_description_size]}" for drone in collective],q_prompt)
                 q_prompt += f"{selection}\n"
                 self.step_end("Summoning collective")
                 self.step(f"Selected drone {collective[selection]}")
@@ -15,28 +15,13 @@ from lollms.prompting import LollmsContextDetails
 from pathlib import Path
 from typing import Callable, Any
 import subprocess
-import ast
+import hashlib
+import json
+import sys
 
-class FunctionAndMethodExtractor(ast.NodeVisitor):
-    def __init__(self, tokens):
-        self.tokens = tokens
-        self.definitions = []
-        self.current_index = 0
-
-    def visit_FunctionDef(self, node):
-        definition_tokens = self.tokens[self.current_index:node.end_lineno]
-        self.definitions.append(('Function', node.name, definition_tokens))
-        self.current_index = node.end_lineno
-        self.generic_visit(node)
-
-    def visit_ClassDef(self, node):
-        for item in node.body:
-            if isinstance(item, ast.FunctionDef):
-                method_name = f'{node.name}.{item.name}'
-                definition_tokens = self.tokens[self.current_index:item.end_lineno]
-                self.definitions.append(('Method', method_name, definition_tokens))
-                self.current_index = item.end_lineno
-        self.generic_visit(node)
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+sys.path.append(str(Path(__file__).parent))
+from scanner import CodeScanner, ScanManifest, collect_files
 
 def parse_query(query):
     """
@@ -93,6 +78,8 @@ class Processor(APScript):
                 {"name":"files_to_parse","type":"str","value":".py", "help":"File types to be scanned comma separated"},
                 {"name":"process_subfolders","type":"bool","value":True, "help":"If true then process files from the subdirectories"},
                 {"name":"output_format","type":"str","value":"markdown", "options":["markdown","html","latex"], "help":"Output format"},
+                {"name":"scan_workers","type":"int","value":4, "help":"Number of files scanned at the same time"},
+                {"name":"max_in_flight","type":"int","value":4, "help":"Number of generations sent to the model at the same time"},
             ]
         )
         personality_config_vals = BaseConfig.from_template(personality_config_template)
@@ -126,17 +113,31 @@ class Processor(APScript):
     def help(self, prompt="", full_context=""):
         self.set_message_content(self.personality.help)
 
+    def build_vulenerabilities_report_prompt(self, code, fn):
+        return f"{self.config.start_header_id_template}{self.config.system_message_template}{self.config.end_header_id_template}Analyze this code and try to detect any security vulenerabilities.\nCreate a report about any detected vulenerability.\nPoint out the vulenerabilities by showing code snippets. Give the report a title and split it into sections. Show the vulenerabilities potential flaws and especially propose fixes to the code using some code tags. The output format is {self.personality_config.output_format}.{self.config.start_header_id_template}file name:{fn}{self.config.start_header_id_template}code:\n```python\n{code}\n```{self.config.separator_template}{self.config.start_header_id_template}additional context:{self.personality_config.context}{self.config.separator_template}{self.config.start_header_id_template}report:\n"
+
+    def continue_vulenerabilities_report_prompt(self, code):
+        return f"{self.config.start_header_id_template}{self.config.system_message_template}{self.config.end_header_id_template}Analyze this code chunk and try to detect any security vulenerabilities.\nCreate a report about any detected vulenerability.\nPoint out the vulenerabilities by showing code snippets. This is the continuation of a report started earlyer and we are analysing another chunk if the code. Show the vulenerabilities potential flaws and especially propose fixes to the code using some code tags. The output format is {self.personality_config.output_format}.{self.config.start_header_id_template}code:\n```python\n{code}\n```{self.config.separator_template}{self.config.start_header_id_template}additional context:{self.personality_config.context}{self.config.separator_template}{self.config.start_header_id_template}report:\n"
+
     def build_vulenerabilities_report(self, code, fn):
-        analysis = self.fast_gen(f"{self.config.start_header_id_template}{self.config.system_message_template}{self.config.end_header_id_template}Analyze this code and try to detect any security vulenerabilities.\nCreate a report about any detected vulenerability.\nPoint out the vulenerabilities by showing code snippets. Give the report a title and split it into sections. Show the vulenerabilities potential flaws and especially propose fixes to the code using some code tags. The output format is {self.personality_config.output_format}.{self.config.start_header_id_template}file name:{fn}{self.config.start_header_id_template}code:\n```python\n{code}\n```{self.config.separator_template}{self.config.start_header_id_template}additional context:{self.personality_config.context}{self.config.separator_template}{self.config.start_header_id_template}report:\n")
+        analysis = self.fast_gen(self.build_vulenerabilities_report_prompt(code, fn))
         self.set_message_content(analysis)
         return analysis
 
     def continue_vulenerabilities_report(self, code):
-        analysis = self.fast_gen(f"{self.config.start_header_id_template}{self.config.system_message_template}{self.config.end_header_id_template}Analyze this code chunk and try to detect any security vulenerabilities.\nCreate a report about any detected vulenerability.\nPoint out the vulenerabilities by showing code snippets. This is the continuation of a report started earlyer and we are analysing another chunk if the code. Show the vulenerabilities potential flaws and especially propose fixes to the code using some code tags. The output format is {self.personality_config.output_format}.{self.config.start_header_id_template}code:\n```python\n{code}\n```{self.config.separator_template}{self.config.start_header_id_template}additional context:{self.personality_config.context}{self.config.separator_template}{self.config.start_header_id_template}report:\n")
+        analysis = self.fast_gen(self.continue_vulenerabilities_report_prompt(code))
         self.set_message_content(analysis)
         return analysis
 
-
+    def scan_settings(self, max_nb_tokens_in_file):
+        """Hash of everything a report depends on besides the code, changing it rescans all the files."""
+        settings = {
+            "model": self.config.model_name,
+            "output_format": self.personality_config.output_format,
+            "context": self.personality_config.context,
+            "max_nb_tokens_in_file": int(max_nb_tokens_in_file),
+        }
+        return hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf8")).hexdigest()[:16]
 
     def process_folder(
                             self, 
@@ -144,85 +145,55 @@ class Processor(APScript):
                             docs_folder_path:Path, 
                             max_nb_tokens_in_file:int, 
                             tokenize:Callable, 
-                            detokenize:Callable,
                             accepted_file_types:list
                         ):
-         
-        for file in code_folder_path.iterdir():
-            if file.name.startswith(".") or str(file)==self.personality_config.docs_folder_path:
-                continue
-            if file.is_dir():
-                if self.personality_config.process_subfolders:
-                    docs_subfolder = docs_folder_path/file.stem
-                    docs_subfolder.mkdir(exist_ok=True, parents=True)
-                    self.process_folder(file, docs_subfolder, max_nb_tokens_in_file, tokenize, detokenize, accepted_file_types)
-            else:
-                if file.suffix.lower() in accepted_file_types:
-                    output_documentation_file_path = docs_folder_path/f"{file.stem}.md"
-                    if self.personality_config.reprocess_processed_files or not output_documentation_file_path.exists():
-                        self.new_message("")
-                        self.add_chunk_to_message_content("")
-                        self.step_start(f"Processing file {file}")
-                        with open(file, "r", encoding="utf-8") as f:
-                            code = f.read()
-                            tk = self.personality.model.tokenize(code)
-                            nb_tk = len(tk)
-                            if nb_tk<max_nb_tokens_in_file:
-                                analysis = self.build_vulenerabilities_report(code, file.name)
-                                with open(output_documentation_file_path,"w", encoding="utf-8") as df:
-                                    df.write(analysis)
-                            else:
-                                tokens = tokenize(code)
-                                extractor = FunctionAndMethodExtractor(tokens)
-                                tree = ast.parse(code)
-                                extractor.visit(tree)
-
-                                chunk = []
-                                nb_processed = 0
-                                for definition_type, definition_name, definition_tokens in extractor.definitions:
-                                    if len(chunk) + len(definition_tokens) <= max_nb_tokens_in_file:
-                                        chunk.extend(definition_tokens)
-                                    else:
-                                        # Process the current chunk
-                                        definition_code = detokenize(chunk)
-                                        if nb_processed==0:
-                                            analysis = self.build_vulenerabilities_report(definition_code, file.name)
-                                            with open(output_documentation_file_path,"a", encoding="utf-8") as df:
-                                                df.write(analysis)
-                                        else:
-                                            analysis = self.continue_vulenerabilities_report(definition_code)
-                                            with open(output_documentation_file_path,"a", encoding="utf-8") as df:
-                                                df.write("\n"+analysis)
-                                        nb_processed +=1
-                                        chunk = definition_tokens  # Start a new chunk with the current definition
-
-                                # Process the last chunk if there are any tokens left
-                                if chunk:
-                                    definition_code = detokenize(chunk)
-                                    if nb_processed>0:
-                                        analysis = self.continue_vulenerabilities_report(definition_code)
-                                        with open(output_documentation_file_path,"a", encoding="utf-8") as df:
-                                            df.write(analysis)
-                                    else:
-                                        analysis = self.build_vulenerabilities_report(definition_code, file)
-                                        with open(output_documentation_file_path,"w", encoding="utf-8") as df:
-                                            df.write(analysis)
+        """
+        Scans the files of the code folder that changed since their last scan and writes
+        one report per file in the docs folder, mirroring the code folder tree.
 
-                            self.step_end(f"Processing file {file}")
+        Returns:
+            The statistics of the run.
+        """
+        files = collect_files(code_folder_path, accepted_file_types, self.personality_config.process_subfolders, [docs_folder_path])
+        entries = []
+        for file in files:
+            relative = file.relative_to(code_folder_path)
+            entries.append((file, relative.as_posix(), docs_folder_path/relative.parent/f"{file.stem}.md"))
+
+        docs_folder_path.mkdir(exist_ok=True, parents=True)
+        manifest = ScanManifest(docs_folder_path/".codeguard_manifest.db")
+        scanner = CodeScanner(
+            lambda code, fn: self.fast_gen(self.build_vulenerabilities_report_prompt(code, fn), callback=self.sink),
+            lambda code: self.fast_gen(self.continue_vulenerabilities_report_prompt(code), callback=self.sink),
+            tokenize,
+            max_nb_tokens_in_file,
+            manifest,
+            self.scan_settings(max_nb_tokens_in_file),
+            self.personality_config.scan_workers,
+            self.personality_config.max_in_flight,
+            on_progress=self.step
+        )
+        self.step_start(f"Scanning {len(entries)} files")
+        try:
+            stats = scanner.scan(entries, force=self.personality_config.reprocess_processed_files)
+        finally:
+            manifest.close()
+        self.step_end(f"Scanning {len(entries)} files")
+        return stats
 
     def start_detection(self, prompt="", full_context="", client:Client=None):
         if show_yes_no_dialog("File processing request","Hi! I just received a request to start reading and documenting files on your PC.If this operation was not triggered by you, please press No and investigate your security.\nIf this is requested by you then pres yes to start.\nDo you want to continue?"):
             if self.personality_config.code_folder_path=="" or self.personality_config.docs_folder_path=="":
                 self.set_message_content("Please setup a code folder path, a docs folder path and optionally a tests folder path before trying to use this functionality")
-        
+                return
             code_folder_path = Path(self.personality_config.code_folder_path)
             tests_folder_path = Path(self.personality_config.tests_folder_path)
             docs_folder_path = Path(self.personality_config.docs_folder_path)
             tokenize = self.personality.model.tokenize
-            detokenize = self.personality.model.detokenize
             max_nb_tokens_in_file = 3*self.personality.config.ctx_size/4
-            accepted_file_types = ["." + extension.strip() if not extension.startswith(".") else extension.strip() for extension in self.personality_config.files_to_parse.split(",")] 
-            self.process_folder(code_folder_path, docs_folder_path, max_nb_tokens_in_file, tokenize, detokenize, accepted_file_types)
+            accepted_file_types = [("." + extension.strip() if not extension.strip().startswith(".") else extension.strip()).lower() for extension in self.personality_config.files_to_parse.split(",")] 
+            stats = self.process_folder(code_folder_path, docs_folder_path, max_nb_tokens_in_file, tokenize, accepted_file_types)
+            self.set_message_content(stats.summary())
 
     def add_file(self, path, client, callback=None):
         """
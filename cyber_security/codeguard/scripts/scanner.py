@@ -0,0 +1,158 @@
+"""
+Incremental and concurrent vulnerability scanning of a code folder.
+
+A manifest stores the content hash of every scanned file along with the hash of
+the scan settings, so a run only sends to the model the files that changed
+since their report was written. Each file is read and tokenized once; when it
+is too large for the context, it is cut on its definitions by the shared code
+chunker, with piece sizes estimated from that single count.
+
+Files are handled by a small pool of threads and their generations (one per
+file or per chunk) go through a shared pool bounded to max_in_flight, so the
+model is kept busy without queueing a whole monorepo in memory.
+"""
+import os
+import time
+import hashlib
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+from zoo_common.code_chunking import CodeChunker
+from zoo_common.sqlite_database import SQLiteDatabase
+
+
+def file_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def collect_files(root: Path, accepted_file_types: List[str], recursive: bool = True, excluded: Optional[List[Path]] = None) -> List[Path]:
+    """The files to scan, in a stable order. Hidden files and folders are ignored."""
+    root = Path(root)
+    excluded = {Path(path).resolve() for path in (excluded or [])}
+    files = []
+    for folder, dirs, names in os.walk(root):
+        dirs[:] = sorted(d for d in dirs if not d.startswith(".") and (Path(folder) / d).resolve() not in excluded) if recursive else []
+        for name in sorted(names):
+            if not name.startswith(".") and Path(name).suffix.lower() in accepted_file_types:
+                files.append(Path(folder) / name)
+    return files
+
+
+class ScanManifest(SQLiteDatabase):
+    """Content hash, settings hash and report of every scanned file, keyed by its path relative to the scanned folder."""
+    migrations = [
+        '''
+            CREATE TABLE IF NOT EXISTS scans (
+                path TEXT PRIMARY KEY,
+                hash TEXT NOT NULL,
+                settings TEXT NOT NULL,
+                report TEXT NOT NULL,
+                nb_tokens INTEGER NOT NULL,
+                scanned_at REAL NOT NULL
+            );
+        ''',
+    ]
+
+    def is_current(self, path: str, digest: str, settings: str) -> bool:
+        row = self.fetchone("SELECT hash, settings, report FROM scans WHERE path = ?", (path,))
+        return row is not None and row[0] == digest and row[1] == settings and Path(row[2]).exists()
+
+    def record(self, path: str, digest: str, settings: str, report: Path, nb_tokens: int) -> None:
+        self.write('''
+            INSERT OR REPLACE INTO scans (path, hash, settings, report, nb_tokens, scanned_at) VALUES (?, ?, ?, ?, ?, ?)
+        ''', (path, digest, settings, str(report), nb_tokens, time.time()))
+
+
+class ScanStats:
+    def __init__(self) -> None:
+        self.files = 0
+        self.skipped = 0
+        self.failed = 0
+        self.nb_tokens = 0
+        self.start = time.perf_counter()
+        self.seconds = 0.0
+
+    def summary(self) -> str:
+        seconds = max(self.seconds, 1e-6)
+        return (
+            f"Scanned {self.files} files ({self.skipped} unchanged, {self.failed} failed) in {self.seconds:.1f}s\n"
+            f"{self.files / seconds:.2f} files/s, {self.nb_tokens / seconds:.0f} tokens/s"
+        )
+
+
+class CodeScanner:
+    """
+    Args:
+        build_report: Generates the report of a code (the whole file or its first chunk) given the file name.
+        continue_report: Generates the report of another chunk of the same file.
+        tokenize: Tokenizer of the model, called once per scanned file.
+        max_tokens: Size in tokens above which a file is chunked.
+        manifest: Record of the scanned files.
+        settings: Hash of the settings the reports depend on, changing it rescans everything.
+        workers: Number of files handled at the same time.
+        max_in_flight: Number of generations running at the same time.
+        on_progress: Called with a message when a file is done.
+    """
+    def __init__(self, build_report: Callable[[str, str], str], continue_report: Callable[[str], str], tokenize: Callable[[str], list],
+                 max_tokens: int, manifest: ScanManifest, settings: str, workers: int = 4, max_in_flight: int = 4,
+                 on_progress: Optional[Callable[[str], None]] = None) -> None:
+        self.build_report = build_report
+        self.continue_report = continue_report
+        self.tokenize = tokenize
+        self.chunker = CodeChunker(tokenize)
+        self.max_tokens = max(1, int(max_tokens))
+        self.manifest = manifest
+        self.settings = settings
+        self.workers = max(1, workers)
+        self.max_in_flight = max(1, max_in_flight)
+        self.on_progress = on_progress or (lambda text: None)
+        self.lock = threading.Lock()
+
+    def scan_file(self, file: Path, key: str, report_path: Path, generator: ThreadPoolExecutor, force: bool, stats: ScanStats) -> None:
+        data = file.read_bytes()
+        digest = file_hash(data)
+        if not force and self.manifest.is_current(key, digest, self.settings):
+            with self.lock:
+                stats.skipped += 1
+            return
+        code = data.decode("utf-8", errors="replace")
+        nb_tokens = len(self.tokenize(code))
+        if nb_tokens < self.max_tokens:
+            futures = [generator.submit(self.build_report, code, file.name)]
+        else:
+            chunks = [chunk.text for chunk in self.chunker.chunk(code, file.name, self.max_tokens, nb_tokens)]
+            futures = [generator.submit(self.build_report, chunks[0], file.name)]
+            futures += [generator.submit(self.continue_report, chunk) for chunk in chunks[1:]]
+        report = "\n".join(future.result() for future in futures)
+        report_path.parent.mkdir(parents=True, exist_ok=True)
+        report_path.write_text(report, encoding="utf-8")
+        self.manifest.record(key, digest, self.settings, report_path, nb_tokens)
+        with self.lock:
+            stats.files += 1
+            stats.nb_tokens += nb_tokens
+
+    def scan(self, files: List[Tuple[Path, str, Path]], force: bool = False) -> ScanStats:
+        """
+        Scans (file, manifest key, report path) entries, keeping at most twice workers files queued.
+        """
+        stats = ScanStats()
+        with ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="codeguard_gen") as generator, \
+             ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="codeguard_file") as executor:
+            futures = {}
+            next_file = 0
+            for i in range(len(files)):
+                while next_file < len(files) and next_file < i + 2 * self.workers:
+                    file, key, report_path = files[next_file]
+                    futures[next_file] = executor.submit(self.scan_file, file, key, report_path, generator, force, stats)
+                    next_file += 1
+                try:
+                    futures.pop(i).result()
+                    self.on_progress(f"[{i + 1}/{len(files)}] {files[i][1]}")
+                except Exception as ex:
+                    with self.lock:
+                        stats.failed += 1
+                    self.on_progress(f"[{i + 1}/{len(files)}] {files[i][1]} failed: {ex}")
+        stats.seconds = time.perf_counter() - stats.start
+        return stats
@@ -0,0 +1,63 @@
+"""
+Ingests documents one at a time into an IncrementalVectorIndex and reports the latency of each upload.
+
+The uploads go through the same path as the personality (has_file then add_document), with the
+hashing embedder and a word counter standing in for the model, so the latency of an upload should
+not grow with the number of documents uploaded before it.
+
+Usage:
+    python benchmark_vector_index.py [--documents 200] [--sentences 80]
+"""
+import sys
+import time
+import random
+import argparse
+import tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+sys.path.append(str(Path(__file__).parent))
+from vector_index import IncrementalVectorIndex, file_hash
+from zoo_common.embeddings import HashingEmbedder
+
+WORDS = "model index vector chunk document search query answer token context memory file upload embedding matrix".split()
+
+
+def make_document(rng: random.Random, nb_sentences: int) -> str:
+    return " ".join(" ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 20))).capitalize() + "." for _ in range(nb_sentences))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--documents", type=int, default=200)
+    parser.add_argument("--sentences", type=int, default=80)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as folder:
+        folder = Path(folder)
+        index = IncrementalVectorIndex(folder / "index", HashingEmbedder(), "tfidf_vectorizer", lambda text: len(text.split()))
+        latencies = []
+        for i in range(args.documents):
+            path = folder / f"document_{i}.txt"
+            path.write_text(make_document(rng, args.sentences), encoding="utf8")
+            start = time.perf_counter()
+            digest = file_hash(path)
+            if not index.has_file(path, 128, 1, digest):
+                index.add_document(path, path.read_text(encoding="utf8"), 128, 1, digest)
+            latencies.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        index.has_file(folder / "document_0.txt", 128, 1)
+        unchanged = time.perf_counter() - start
+
+        tenth = max(1, len(latencies) // 10)
+        print(f"{len(latencies)} uploads, {len(index.chunks)} chunks")
+        for i in range(0, len(latencies), tenth):
+            window = latencies[i:i + tenth]
+            print(f"uploads {i + 1:4d}-{i + len(window):4d}: {1000 * sum(window) / len(window):7.2f} ms per upload")
+        print(f"first upload {1000 * latencies[0]:.2f} ms, last upload {1000 * latencies[-1]:.2f} ms")
+        print(f"check of an unchanged file: {1000 * unchanged:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
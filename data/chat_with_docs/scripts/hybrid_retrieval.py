@@ -0,0 +1,169 @@
+"""
+Hybrid lexical + vector retrieval for chat with docs.
+
+A BM25 inverted index is kept in sync with the chunks of the vector index. Both
+rankings are merged with weighted reciprocal rank fusion and the fused results
+are memoized per normalized query until the index changes. The share of query
+words that exist in the documents tells the caller whether rewriting the prompt
+into keywords is worth an extra generation.
+"""
+import re
+import math
+import numpy as np
+from collections import Counter, OrderedDict
+from typing import Dict, List, Tuple
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+STOP_WORDS = {
+    "a", "an", "the", "and", "or", "of", "to", "in", "on", "for", "with", "is", "are", "was", "were",
+    "be", "by", "it", "this", "that", "as", "at", "from", "what", "which", "who", "how", "why", "when",
+    "where", "do", "does", "did", "can", "could", "should", "would", "i", "you", "me", "my", "your",
+    "about", "please", "tell", "give", "le", "la", "les", "de", "des", "du", "un", "une", "et", "est",
+}
+
+
+def tokenize_words(text: str) -> List[str]:
+    return [w for w in _WORD_RE.findall(text.lower()) if w not in STOP_WORDS]
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(_WORD_RE.findall(query.lower()))
+
+
+class BM25Index:
+    """Okapi BM25 over an append-only list of chunks."""
+    def __init__(self, k1: float = 1.5, b: float = 0.75) -> None:
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[int, int]] = {}
+        self.lengths: List[int] = []
+        self.total_length = 0
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    def add(self, text: str) -> None:
+        row = len(self.lengths)
+        words = tokenize_words(text)
+        for word, count in Counter(words).items():
+            self.postings.setdefault(word, {})[row] = count
+        self.lengths.append(len(words))
+        self.total_length += len(words)
+
+    def sync(self, chunks: List[dict]) -> None:
+        """Indexes the chunks appended since the last call."""
+        for chunk in chunks[len(self.lengths):]:
+            self.add(chunk["text"])
+
+    def coverage(self, query: str) -> float:
+        """Share of the query words that appear in at least one chunk."""
+        words = set(tokenize_words(query))
+        if not words:
+            return 0.0
+        return sum(1 for w in words if w in self.postings) / len(words)
+
+    def search(self, query: str, top_k: int, alive: np.ndarray) -> List[Tuple[int, float]]:
+        if not self.lengths:
+            return []
+        nb_docs = len(self.lengths)
+        avgdl = self.total_length / nb_docs if nb_docs else 0
+        scores: Dict[int, float] = {}
+        for word in set(tokenize_words(query)):
+            postings = self.postings.get(word)
+            if not postings:
+                continue
+            idf = math.log(1 + (nb_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for row, tf in postings.items():
+                if not alive[row]:
+                    continue
+                norm = tf + self.k1 * (1 - self.b + self.b * self.lengths[row] / (avgdl or 1))
+                scores[row] = scores.get(row, 0.0) + idf * tf * (self.k1 + 1) / norm
+        return sorted(scores.items(), key=lambda x: -x[1])[:top_k]
+
+
+class HybridRetriever:
+    """
+    Fuses BM25 and vector search results on top of an IncrementalVectorIndex.
+
+    Args:
+        vector_index: The index holding the chunks and their embeddings.
+        lexical_weight: Weight of the BM25 ranking in the fusion (the vector ranking gets 1 - lexical_weight).
+        cache_size: Number of query results kept in the LRU memo.
+        rrf_k: Reciprocal rank fusion constant.
+    """
+    def __init__(self, vector_index, lexical_weight: float = 0.5, cache_size: int = 256, rrf_k: int = 60) -> None:
+        self.vector_index = vector_index
+        self.lexical_weight = min(max(lexical_weight, 0.0), 1.0)
+        self.cache_size = cache_size
+        self.rrf_k = rrf_k
+        self.bm25 = BM25Index()
+        self.cache: "OrderedDict[Tuple[str, int], tuple]" = OrderedDict()
+        self.cache_version = None
+        self.layout_version = None
+
+    def _sync(self) -> None:
+        if self.layout_version != self.vector_index.layout_version:
+            # The vector index was cleared or compacted, row numbers changed
+            self.bm25 = BM25Index()
+            self.layout_version = self.vector_index.layout_version
+        self.bm25.sync(self.vector_index.chunks)
+        if self.cache_version != self.vector_index.version:
+            self.cache.clear()
+            self.cache_version = self.vector_index.version
+
+    def lexical_coverage(self, query: str) -> float:
+        self._sync()
+        return self.bm25.coverage(query)
+
+    def _fuse(self, lexical: List[Tuple[int, float]], semantic: List[Tuple[int, float]], top_k: int) -> List[Tuple[int, float]]:
+        scores: Dict[int, float] = {}
+        for rank, (row, _) in enumerate(lexical):
+            scores[row] = scores.get(row, 0.0) + self.lexical_weight / (self.rrf_k + rank + 1)
+        for rank, (row, _) in enumerate(semantic):
+            scores[row] = scores.get(row, 0.0) + (1 - self.lexical_weight) / (self.rrf_k + rank + 1)
+        return sorted(scores.items(), key=lambda x: -x[1])[:top_k]
+
+    def recover_chunks(self, queries: List[str], top_k: int = 3) -> List[List[Tuple[dict, float]]]:
+        """
+        Hybrid search of several queries.
+        Queries seen before are answered from the memo and the others share one similarity product.
+
+        Returns:
+            For each query, the list of (chunk, fused score) pairs. Chunks carry their text,
+            chunk_id, path and nb_tokens.
+        """
+        self._sync()
+        results = [None] * len(queries)
+        keys = [(normalize_query(q), top_k) for q in queries]
+        missing = []
+        for i, key in enumerate(keys):
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                results[i] = self.cache[key]
+            else:
+                missing.append(i)
+        if missing:
+            # Wider candidate lists give the fusion something to re-rank
+            depth = top_k * 3
+            alive = self.vector_index.alive
+            vectors = np.stack([self.vector_index.embed_query(queries[i]) for i in missing])
+            semantic = self.vector_index.search_vectors(vectors, depth)
+            for i, vector_hits in zip(missing, semantic):
+                lexical = self.bm25.search(queries[i], depth, alive)
+                chunks = self.vector_index.chunks
+                results[i] = [(chunks[row], score) for row, score in self._fuse(lexical, vector_hits, top_k)]
+                self.cache[keys[i]] = results[i]
+                if len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        return results
+
+    def recover_texts(self, queries: List[str], top_k: int = 3) -> List[tuple]:
+        """Same result contract as IncrementalVectorIndex.recover_texts."""
+        return [
+            ([c["text"] for c, _ in hits], [(c["chunk_id"], score) for c, score in hits], [c["path"] for c, _ in hits])
+            for hits in self.recover_chunks(queries, top_k)
+        ]
+
+    def recover_text(self, query: str, top_k: int = 3) -> tuple:
+        return self.recover_texts([query], top_k)[0]
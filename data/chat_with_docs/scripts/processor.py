@@ -3,10 +3,11 @@ from lollms.types import MSG_OPERATION_TYPE
 from lollms.personality import APScript, AIPersonality
 from lollms.paths import LollmsPaths
 from lollms.types import MSG_OPERATION_TYPE
+from lollms.prompting import LollmsContextDetails
 from typing import Callable, Any
 
 from ascii_colors import ASCIIColors, trace_exception
-from safe_store import TextVectorizer, VectorizationMethod, GenericDataLoader
+from safe_store import GenericDataLoader
 
 import numpy as np
 import json
@@ -15,6 +16,14 @@ import numpy as np
 import json
 import subprocess
 from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
+import sys
+sys.path.append(str(Path(__file__).parent))
+from vector_index import IncrementalVectorIndex, file_hash
+from hybrid_retrieval import HybridRetriever
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+from zoo_common.context_packing import ContextItem, ContextPacker, TokenCounter, available_budget
+from zoo_common.embeddings import HashingEmbedder
 
 class Processor(APScript):
     """
@@ -36,11 +45,16 @@ class Processor(APScript):
                 {"name":"use_batch_mode","type":"bool","value":False, "help":"if selected, the chatwith docs will takes a list of questions out of a text file and answers them all then writes a final report about the questions"},
                 {"name":"batch_mode_questions_file","type":"str","value":"", "help":"A path to a text file containing the list of questions"},
                 {"name":"batch_mode_report_file","type":"str","value":"", "help":"A path to a markdown file to be created."},
+                {"name":"batch_mode_concurrency","type":"int","value":4, "min":1, "max":64, "help":"Number of generation requests sent to the binding at the same time in batch mode. Use 1 for bindings that can only serve one request at a time"},
                 {"name":"custom_discussion_db_name","type":"str","value":"", "help":"if not empty, you can change this to the path of the database you want to create or use"},
-                {"name":"build_keywords","type":"bool","value":True, "help":"If true, the model will first generate keywords before searching"},
+                {"name":"build_keywords","type":"bool","value":True, "help":"If true, the model rewrites the prompt into keywords before searching when too few of its words are found in the documents"},
+                {"name":"keywords_recall_threshold","type":"float","value":0.5, "min":0.0, "max":1.0, "help":"Share of the prompt words that must be found in the documents to search with the raw prompt instead of generating keywords"},
+                {"name":"hybrid_search","type":"bool","value":True, "help":"If true, a keyword (BM25) search is fused with the vector search"},
+                {"name":"lexical_weight","type":"float","value":0.5, "min":0.0, "max":1.0, "help":"Weight of the keyword search in the hybrid search (the vector search gets the rest)"},
+                {"name":"query_cache_size","type":"int","value":256, "min":0, "help":"Number of search results kept in memory for repeated queries"},
                 {"name":"load_db","type":"bool","value":False, "help":"If true, the vectorized database will be loaded at startup"},
-                {"name":"save_db","type":"bool","value":False, "help":"If true, the vectorized database will be saved for future use"},
-                {"name":"vectorization_method","type":"str","value":f"model_embedding", "options":["model_embedding", "tfidf_vectorizer"], "help":"Vectoriazation method to be used (changing this should reset database)"},
+                {"name":"save_db","type":"bool","value":True, "help":"If true, the vectorized database is kept for future use, otherwise it is emptied when the personality starts"},
+                {"name":"vectorization_method","type":"str","value":f"model_embedding", "options":["model_embedding", "tfidf_vectorizer"], "help":"Vectoriazation method to be used (changing this resets the database)"},
                 {"name":"show_interactive_form","type":"bool","value":False, "help":"If true, a window wil be shown with the data plot in an interactive form"},
                 
                 {"name":"nb_chunks","type":"int","value":2, "min":1, "max":50,"help":"Number of data chunks to use for its vector (at most nb_chunks*max_chunk_size must not exeed two thirds the context size)"},
@@ -87,6 +101,10 @@ class Processor(APScript):
         self.personality = personality
         self.callback = None
         self.vector_store = None
+        self.vector_store_model = None
+        self.retriever = None
+        self.token_counter = None
+        self.packer = None
 
 
     def install(self):
@@ -103,64 +121,103 @@ class Processor(APScript):
     def help(self, prompt, full_context):
         self.set_message_content(self.personality.help, callback=self.callback)
         
+    def build_keywords_query(self, question):
+        query = self.personality.fast_gen(f"{self.config.start_header_id_template}prompt:"+question+f"{self.config.separator_template}{self.config.start_header_id_template}instruction: Convert the prompt to a web search query."+f"\nDo not answer the prompt. Do not add explanations. Use comma separated syntax to make a list of keywords in the same line.\nThe keywords should reflect the ideas written in the prompt so that a seach engine can process them efficiently.{self.config.separator_template}{self.config.start_header_id_template}query: ", max_generation_size=256, show_progress=False).strip()
+        return query if query!="" else question
+
+    def format_references(self, sorted_similarities):
+        docs_sources=[]
+        for entry in sorted_similarities:
+            e = "_".join(entry[0].replace("\\","/").split("/")[-1].split('_')[:-2])
+            ci = "_".join(entry[0].replace("\\","/").split("/")[-1].split('_')[-2:])
+            name = "/uploads/" + self.personality.personality_folder_name + "/" + e
+            path = e + f" chunk id : {ci}"
+            docs_sources.append([path, name])
+        return "\n".join([f'[{v[0]}]({quote(v[1])})\n' for v in docs_sources])
+
+    def needs_keywords(self, prompt):
+        """
+        Tells if the prompt should be rewritten into keywords before searching, which is only
+        worth a generation when the documents don't contain enough of its words.
+        """
+        if not self.personality_config.build_keywords:
+            return False
+        return self.retriever.lexical_coverage(prompt) < self.personality_config.keywords_recall_threshold
+
+    def build_documentation(self, hits, full_context):
+        """
+        Packs the retrieved chunks into the room left by the discussion and the answer.
+        Chunk sizes come from the index, so only the discussion may need to be tokenized.
+
+        Returns:
+            The documentation text and the (chunk id, score) pairs of the chunks that were kept.
+        """
+        items = [ContextItem(chunk["text"], score, chunk.get("nb_tokens"), chunk["chunk_id"]) for chunk, score in hits]
+        budget = available_budget(self.personality.config.ctx_size, int(self.personality_config["max_answer_size"]), self.token_counter(full_context))
+        packed = self.packer.pack(items, budget, max_items=int(self.personality_config.nb_chunks))
+        ASCIIColors.info(f"Documentation size in tokens : {packed.nb_tokens} ({len(packed.items)} chunks, {len(packed.dropped)} left out)")
+        docs = packed.join(lambda item: f"{self.config.start_header_id_template}document chunk {item.source}:\n{item.text}")
+        return docs, [(item.source, item.score) for item in packed.items]
+
     def process_batch(self, prompt, full_context):
-        output = ""
+        """
+        Answers all the questions of the batch file.
+
+        Keyword queries and answers are generated with batch_mode_concurrency requests in flight,
+        the documentation of all the questions is retrieved with a single similarity product and
+        each answer is appended to the report as soon as it and all the previous ones are ready.
+        """
         if self.personality_config.batch_mode_questions_file=="":
             self.new_message("Please set a questions list file to my configuration to start batch qna")
             return
+        if not self.vector_store or not self.vector_store.ready:
+            self.new_message("Vector store is not ready. Please send me a document to use.")
+            return
         self.new_message("")
         questions = GenericDataLoader.read_file(self.personality_config.batch_mode_questions_file)
-        questions = questions.split("\n")
-        for i, question in enumerate(questions):
-            if len(question)>5:
-                output += "## Question:\n"+question+"\n"
-                self.set_message_content(output)
-                self.step_start(f"Analyzing request {i+1}/{len(questions)}")
-                if self.personality_config.build_keywords:
-                    query = self.personality.fast_gen("{self.config.start_header_id_template}prompt:"+question+"{self.config.separator_template}{self.config.start_header_id_template}instruction: Convert the prompt to a web search query."+"\nDo not answer the prompt. Do not add explanations. Use comma separated syntax to make a list of keywords in the same line.\nThe keywords should reflect the ideas written in the prompt so that a seach engine can process them efficiently.{self.config.separator_template}{self.config.start_header_id_template}query: ", max_generation_size=256, show_progress=True)
-                    preprocessed_prompt = self.fast_gen(query, int(self.personality_config["max_answer_size"]),show_progress=True).strip()
-                    output += "### Query:\n"+preprocessed_prompt+"\n"
-                    self.set_message_content(output)
-                else:
-                    preprocessed_prompt = question
-                if preprocessed_prompt=="":
-                    preprocessed_prompt = prompt
-                docs, sorted_similarities, document_ids = self.vector_store.recover_text(preprocessed_prompt, top_k=int(self.personality_config.nb_chunks))
-                docs = '\n'.join([f"{self.config.start_header_id_template}document {s[0]}:\n{v}" for i,(v,s) in enumerate(zip(docs,sorted_similarities))])
-                full_text =f"""{docs}
+        questions = [q for q in questions.split("\n") if len(q)>5]
+        nb_questions = len(questions)
+        concurrency = max(1, int(self.personality_config.batch_mode_concurrency))
+        report = open(self.personality_config.batch_mode_report_file, "w", encoding="utf8") if self.personality_config.batch_mode_report_file!="" else None
+        try:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                queries = list(questions)
+                to_rewrite = [i for i, question in enumerate(questions) if self.needs_keywords(question)]
+                if to_rewrite:
+                    self.step_start(f"Building search queries for {len(to_rewrite)} questions")
+                    for i, query in zip(to_rewrite, executor.map(self.build_keywords_query, [questions[i] for i in to_rewrite])):
+                        queries[i] = query
+                    self.step_end(f"Building search queries for {len(to_rewrite)} questions")
+
+                self.step_start("Retrieving documentation")
+                # Extra candidates replace the chunks removed as duplicates or that don't fit
+                retrieved = [self.build_documentation(hits, full_context) for hits in self.retriever.recover_chunks(queries, top_k=2*int(self.personality_config.nb_chunks))]
+                self.step_end("Retrieving documentation")
+
+                futures = []
+                for docs, _ in retrieved:
+                    full_text =f"""{docs}
 {full_context}"""
-
-                tk = self.personality.model.tokenize(full_text)
-                # print(f"total: {len(tk)}")           
-                ASCIIColors.blue("-------------- Documentation -----------------------")
-                ASCIIColors.blue(full_text)
-                ASCIIColors.blue(f"Number of tokens :{len(tk)}")
-                ASCIIColors.blue("----------------------------------------------------")
-                tk = self.personality.model.tokenize(full_text)
-                ASCIIColors.info(f"Documentation size in tokens : {len(tk)}")
-                if self.personality.config.debug:
-                    ASCIIColors.yellow(full_text)
-                answer = self.fast_gen(full_text, self.personality_config["max_answer_size"],show_progress=True).strip()
-                output += "## Answer:\n"+answer+"\n"
-                self.set_message_content(output)
-                docs_sources=[]
-                for entry in sorted_similarities:
-                    e = "_".join(entry[0].replace("\\","/").split("/")[-1].split('_')[:-2])
-                    ci = "_".join(entry[0].replace("\\","/").split("/")[-1].split('_')[-2:])
-                    name = "/uploads/" + self.personality.personality_folder_name + "/" + e
-                    path = e + f" chunk id : {ci}"
-                    docs_sources.append([path, name])
-
-                output += "\n### Used References:\n" + "\n".join([f'[{v[0]}]({quote(v[1])})\n' for v in docs_sources])
-                ASCIIColors.yellow(output)
-
-                self.step_end(f"Analyzing request {i+1}/{len(questions)}")
-                self.set_message_content(output)                
-        self.step_start("Saving report")
-        if self.personality_config.batch_mode_report_file!="":
-            with open(self.personality_config.batch_mode_report_file, "w") as f:
-                f.write(output)
-        self.step_end("Saving report")
+                    if self.personality.config.debug:
+                        ASCIIColors.yellow(full_text)
+                    futures.append(executor.submit(self.fast_gen, full_text, self.personality_config["max_answer_size"], show_progress=False))
+
+                for i, (question, query, future, (_, sorted_similarities)) in enumerate(zip(questions, queries, futures, retrieved)):
+                    self.step_start(f"Answering request {i+1}/{nb_questions}")
+                    answer = future.result().strip()
+                    section = "## Question:\n"+question+"\n"
+                    if query!=question:
+                        section += "### Query:\n"+query+"\n"
+                    section += "## Answer:\n"+answer+"\n"
+                    section += "\n### Used References:\n" + self.format_references(sorted_similarities)
+                    self.add_chunk_to_message_content(section)
+                    if report:
+                        report.write(section)
+                        report.flush()
+                    self.step_end(f"Answering request {i+1}/{nb_questions}")
+        finally:
+            if report:
+                report.close()
 
     def show_database(self, prompt, full_context):
         import random
@@ -193,7 +250,7 @@ class Processor(APScript):
             if prompt == "":
                 self.exception("Please send a prompt to process")
             self.step_start("Analyzing request", callback=self.callback)
-            if self.personality_config.build_keywords:
+            if self.needs_keywords(prompt):
                 full_text =f"""{self.config.start_header_id_template}instructor:Extract keywords from this prompt. The keywords output format is comma separated values.
 {self.config.start_header_id_template}prompt: {prompt}
 {self.config.start_header_id_template}assistant: The keywords are """
@@ -205,36 +262,18 @@ class Processor(APScript):
                 preprocessed_prompt = prompt
             self.set_message_content(f"Query : {preprocessed_prompt}")
 
-            docs, sorted_similarities, document_ids = self.vector_store.recover_text(preprocessed_prompt, top_k=int(self.personality_config.nb_chunks))
-            # for doc in docs:
-            #     tk = self.personality.model.tokenize(doc)
-            #     print(len(tk))
-            docs = '\n'.join([f"{self.config.start_header_id_template}document chunk {s[0]}:\n{v}" for i,(v,s) in enumerate(zip(docs,sorted_similarities))])
+            # Extra candidates replace the chunks removed as duplicates or that don't fit
+            hits = self.retriever.recover_chunks([preprocessed_prompt], top_k=2*int(self.personality_config.nb_chunks))[0]
+            docs, sorted_similarities = self.build_documentation(hits, full_context)
             full_text =f"""{docs}
 {full_context}
 {self.config.start_header_id_template}chat_with_docs:"""
 
-            tk = self.personality.model.tokenize(full_text)
-            # print(f"total: {len(tk)}")           
-            ASCIIColors.blue("-------------- Documentation -----------------------")
-            ASCIIColors.blue(full_text)
-            ASCIIColors.blue(f"Number of tokens :{len(tk)}")
-            ASCIIColors.blue("----------------------------------------------------")
             ASCIIColors.blue("Thinking")
-            tk = self.personality.model.tokenize(full_text)
-            ASCIIColors.info(f"Documentation size in tokens : {len(tk)}")
             if self.personality.config.debug:
                 ASCIIColors.yellow(full_text)
             output = self.generate(full_text, self.personality_config["max_answer_size"]).strip()
-            docs_sources=[]
-            for entry in sorted_similarities:
-                e = "_".join(entry[0].replace("\\","/").split("/")[-1].split('_')[:-2])
-                ci = "_".join(entry[0].replace("\\","/").split("/")[-1].split('_')[-2:])
-                name = "/uploads/" + self.personality.personality_folder_name + "/" + e
-                path = e + f" chunk id : {ci}"
-                docs_sources.append([path, name])
-
-            output += "\n## Used References:\n" + "\n".join([f'[{v[0]}]({quote(v[1])})\n' for v in docs_sources])
+            output += "\n## Used References:\n" + self.format_references(sorted_similarities)
 
             ASCIIColors.yellow(output)
 
@@ -243,53 +282,42 @@ class Processor(APScript):
         else:
             self.set_message_content("Vector store is not ready. Please send me a document to use. Use Send file command form your chatbox menu to trigger this.", callback=self.callback)
 
-    def build_db(self):
-        if self.vector_store is None:
-            root_db_folder = self.personality.lollms_paths.self.personal_discussions_path/self.personality.personality_folder_name
-            root_db_folder.mkdir(exist_ok=True, parents=True)
-            self.vector_store = TextVectorizer(                     
-                    self.personality_config.vectorization_method, # supported "model_embedding" or "tfidf_vectorizer"
-                    model=self.personality.model, #needed in case of using model_embedding
-                    database_path=root_db_folder/"db.json" if self.personality_config.custom_discussion_db_name=="" else self.personality_config.custom_discussion_db_name,
-                    save_db=self.personality_config.save_db,
-                    visualize_data_at_startup=self.personality_config.visualize_data_at_startup,
-                    visualize_data_at_add_file=self.personality_config.visualize_data_at_add_file,
-                    visualize_data_at_generate=self.personality_config.visualize_data_at_generate
-                    )        
-        if len(self.vector_store.chunks)>0:
-            self.ready = True
+    def build_db(self, files=None):
+        """
+        Adds files to the vector index. Files that are already indexed with the same
+        content and chunking parameters are skipped without being read.
+
+        Args:
+            files: The files to index. Defaults to all the files sent to the personality.
+        """
+        self.prepare()
+        try:
+            chunk_size=int(self.personality_config["max_chunk_size"])
+        except:
+            ASCIIColors.warning(f"Couldn't read chunk size. Verify your configuration file")
+            chunk_size=512
+        try:
+            overlap_size=int(self.personality_config["chunk_overlap_sentences"])
+        except:
+            ASCIIColors.warning(f"Couldn't read chunk size. Verify your configuration file")
+            overlap_size=1
 
         ASCIIColors.info("-> Vectorizing the database")
-        for file in self.personality.text_files:
+        for file in (self.personality.text_files if files is None else files):
             try:
+                digest = file_hash(file)
+                if self.vector_store.has_file(file, chunk_size, overlap_size, digest):
+                    continue
                 text =  GenericDataLoader.read_file(file)
-                try:
-                    chunk_size=int(self.personality_config["max_chunk_size"])
-                except:
-                    ASCIIColors.warning(f"Couldn't read chunk size. Verify your configuration file")
-                    chunk_size=512
-                try:
-                    overlap_size=int(self.personality_config["chunk_overlap_sentences"])
-                except:
-                    ASCIIColors.warning(f"Couldn't read chunk size. Verify your configuration file")
-                    overlap_size=50
-
-                self.vector_store.add_document(file, text, chunk_size=chunk_size, overlap_size=overlap_size)
-                
-                ASCIIColors.success(f"File {file} added successfully")
+                nb_chunks = self.vector_store.add_document(file, text, chunk_size=chunk_size, overlap_size=overlap_size, digest=digest)
+                ASCIIColors.success(f"File {file} added successfully ({nb_chunks} chunks)")
             except Exception as ex:
                 ASCIIColors.error(f"Couldn't add {file}: The vectorizer threw this exception:{ex}")
                 trace_exception(ex)
                 return False
-        try:
-            self.vector_store.index()
-            self.ready = True
-            ASCIIColors.success(f"Database indexed successfully")
-            return True
-        except Exception as ex:
-            ASCIIColors.error(f"Couldn't vectorize database The vectorizer threw this exception:{ex}")
-            trace_exception(ex)
-            return False
+        self.ready = self.vector_store.ready
+        ASCIIColors.success(f"Database indexed successfully")
+        return True
             
     def add_file(self, path, client, callback=None):
         if callback is None and self.callback is not None:
@@ -299,10 +327,12 @@ class Processor(APScript):
         try:
             self.new_message("",MSG_OPERATION_TYPE.MSG_OPERATION_TYPE_SET_CONTENT_INVISIBLE_TO_AI)
             self.step_start("Vectorizing database", callback = callback)
-            if not self.build_db():
+            if not self.build_db([Path(path)]):
                 self.step_end("Vectorizing database",status=False, callback = callback)
             else:
                 self.step_end("Vectorizing database",status=True, callback = callback)
+                if self.personality_config.visualize_data_at_add_file:
+                    self.show_database("", "")
             self.ready = True
             self.finished_message("File imported successfully")
             return True
@@ -313,25 +343,40 @@ class Processor(APScript):
             return False        
 
     def prepare(self):
-        if self.vector_store is None:
+        # The chunk sizes and the model embeddings depend on the mounted model
+        if self.vector_store is None or self.vector_store_model is not self.personality.model:
+            model_switched = self.vector_store is not None
+            self.vector_store_model = self.personality.model
             root_db_folder = self.personality.lollms_paths.personal_discussions_path/self.personality.personality_folder_name
             root_db_folder.mkdir(exist_ok=True, parents=True)
-            self.vector_store = TextVectorizer(                     
-                    self.personality_config.vectorization_method, # supported "model_embedding" or "tfidf_vectorizer"
-                    model=self.personality.model, #needed in case of using model_embedding
-                    database_path=root_db_folder/"db.json" if self.personality_config.custom_discussion_db_name=="" else self.personality_config.custom_discussion_db_name,
-                    save_db=self.personality_config.save_db
-            )        
-
-
-        if self.vector_store and self.personality_config.vectorization_method==VectorizationMethod.TFIDF_VECTORIZER:
-            from safe_store.tf_idf_vectorizer import TfidfVectorizer
-            data = list(self.vector_store.texts.values())
-            if len(data)>0:
-                self.vectorizer = TfidfVectorizer()
-                self.vectorizer.fit(data)
-
-        if len(self.vector_store.chunks)>0:
+            self.token_counter = TokenCounter(self.personality.model.tokenize)
+            # Leaves room for the header written before each chunk
+            self.packer = ContextPacker(self.token_counter, item_overhead=16)
+            if self.personality_config.vectorization_method=="model_embedding":
+                embed = self.personality.model.embed
+                embedder_name = f"model_embedding:{self.personality.config.binding_name}::{self.personality.config.model_name}"
+            else:
+                embed = HashingEmbedder()
+                embedder_name = self.personality_config.vectorization_method
+            self.vector_store = IncrementalVectorIndex(
+                    root_db_folder/"vector_index" if self.personality_config.custom_discussion_db_name=="" else Path(self.personality_config.custom_discussion_db_name),
+                    embed,
+                    self.personality_config.vectorization_method,
+                    self.token_counter,
+                    embedder_name
+            )
+            if not self.personality_config.save_db:
+                self.vector_store.clear_database()
+            self.retriever = HybridRetriever(
+                    self.vector_store,
+                    lexical_weight=self.personality_config.lexical_weight if self.personality_config.hybrid_search else 0.0,
+                    cache_size=self.personality_config.query_cache_size
+            )
+            if model_switched and not self.vector_store.ready and self.personality.text_files:
+                # The index of the previous model was emptied, the documents are embedded again
+                self.build_db()
+
+        if self.vector_store.ready:
             self.ready = True
 
     from lollms.client_session import Client
@@ -0,0 +1,314 @@
+"""
+Incremental, disk backed vector index for chat with docs.
+
+Every file is identified by the hash of its bytes. Adding a file whose hash and
+chunking parameters are already in the manifest costs nothing, and adding a new
+file only chunks and embeds that file. Embeddings are L2 normalized float32 rows
+appended to a raw matrix file that is memory mapped for search, chunk texts are
+appended to a jsonl file and the bookkeeping lives in manifest.json.
+
+The manifest is written last and is the commit point of an addition: rows and
+chunks written after the last range it records come from an interrupted
+addition and are dropped when the index is loaded. It also records the embedder
+and the size of its vectors, an index built by another embedder is emptied as
+its vectors are not comparable with the new ones.
+"""
+import re
+import json
+import shutil
+import hashlib
+import numpy as np
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+|\n{2,}")
+
+
+def file_hash(path: Path) -> str:
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def chunk_text(text: str, chunk_size: int, overlap_sentences: int, count_tokens: Callable[[str], int]) -> List[Tuple[str, int]]:
+    """
+    Splits a text into chunks of at most chunk_size tokens made of whole sentences.
+    Consecutive chunks share overlap_sentences sentences.
+
+    Returns:
+        A list of (chunk text, number of tokens) tuples.
+    """
+    sentences = [s.strip() for s in _SENTENCE_RE.split(text) if s and s.strip()]
+    sizes = [count_tokens(s) for s in sentences]
+    chunks = []
+    start = 0
+    while start < len(sentences):
+        end = start
+        total = 0
+        while end < len(sentences) and (end == start or total + sizes[end] <= chunk_size):
+            total += sizes[end]
+            end += 1
+        chunks.append((" ".join(sentences[start:end]), total))
+        if end >= len(sentences):
+            break
+        start = max(start + 1, end - overlap_sentences)
+    return chunks
+
+
+class IncrementalVectorIndex:
+    """
+    Args:
+        folder: Where the index is stored.
+        embed: Text embedding function.
+        method: The vectorization method.
+        count_tokens: Token counter used to size the chunks.
+        embedder_name: Identifies embed (the binding and model for model embeddings), defaults to method.
+    """
+    def __init__(self, folder: Path, embed: Callable[[str], np.ndarray], method: str, count_tokens: Callable[[str], int], embedder_name: Optional[str] = None) -> None:
+        self.folder = Path(folder)
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.embed = embed
+        self.method = method
+        self.embedder_name = embedder_name or method
+        self.count_tokens = count_tokens
+        self.manifest_path = self.folder / "manifest.json"
+        self.matrix_path = self.folder / "embeddings.f32"
+        self.chunks_path = self.folder / "chunks.jsonl"
+        self.manifest = self._empty_manifest()
+        self.chunks: List[dict] = []
+        self._matrix = None
+        self._alive = None
+        # version changes on every modification, layout_version when rows are renumbered
+        self.version = 0
+        self.layout_version = 0
+        self.load()
+
+    @property
+    def ready(self) -> bool:
+        return len(self.chunks) > 0 and bool(self.alive.any())
+
+    def _empty_manifest(self) -> dict:
+        return {"method": self.method, "embedder": self.embedder_name, "dim": 0, "files": {}}
+
+    def load(self) -> None:
+        if not self.manifest_path.exists():
+            return
+        manifest = json.loads(self.manifest_path.read_text(encoding="utf8"))
+        if manifest.get("method") != self.method or manifest.get("embedder") != self.embedder_name \
+                or (manifest["dim"] and len(self.embed_query("dimension")) != manifest["dim"]):
+            # Vectors of another embedder are not comparable with ours
+            self.clear_database()
+            return
+        self.manifest = manifest
+        committed = max((entry["end"] for entry in manifest["files"].values()), default=0)
+        self.chunks = []
+        nb_lines = 0
+        if self.chunks_path.exists():
+            with open(self.chunks_path, "r", encoding="utf8") as f:
+                for line in f:
+                    nb_lines += 1
+                    if len(self.chunks) < committed:
+                        self.chunks.append(json.loads(line))
+        if nb_lines != len(self.chunks):
+            self._rewrite_chunks()
+        size = committed * manifest["dim"] * 4
+        if self.matrix_path.exists() and self.matrix_path.stat().st_size > size:
+            with open(self.matrix_path, "r+b") as f:
+                f.truncate(size)
+
+    def _save_manifest(self) -> None:
+        tmp = self.manifest_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.manifest, indent=4), encoding="utf8")
+        tmp.replace(self.manifest_path)
+
+    def clear_database(self) -> None:
+        for path in (self.manifest_path, self.matrix_path, self.chunks_path):
+            if path.exists():
+                path.unlink()
+        self.manifest = self._empty_manifest()
+        self.chunks = []
+        self._matrix = None
+        self._alive = None
+        self.version += 1
+        self.layout_version += 1
+
+    def has_file(self, path: Path, chunk_size: int, overlap_size: int, digest: Optional[str] = None) -> bool:
+        entry = self.manifest["files"].get(str(path))
+        if entry is None or entry["chunk_size"] != chunk_size or entry["overlap_size"] != overlap_size:
+            return False
+        return entry["hash"] == (digest or file_hash(path))
+
+    def add_document(self, path: Path, text: str, chunk_size: int, overlap_size: int, digest: Optional[str] = None) -> int:
+        """
+        Chunks and embeds a document, replacing a previous version of the same file.
+
+        Returns:
+            The number of chunks added.
+        """
+        key = str(path)
+        digest = digest or file_hash(path)
+        previous = self.manifest["files"].get(key)
+        if previous is not None:
+            for row in range(previous["start"], previous["end"]):
+                self.chunks[row]["deleted"] = True
+            self._alive = None
+
+        pieces = chunk_text(text, chunk_size, overlap_size, self.count_tokens)
+        vectors = []
+        for text_piece, _ in pieces:
+            vector = np.asarray(self.embed(text_piece), dtype=np.float32).ravel()
+            norm = np.linalg.norm(vector)
+            vectors.append(vector / norm if norm > 0 else vector)
+        if vectors and self.manifest["dim"] == 0:
+            self.manifest["dim"] = int(vectors[0].shape[0])
+        if any(vector.shape[0] != self.manifest["dim"] for vector in vectors):
+            raise ValueError(f"The embeddings of {key} don't have the dimension of the index ({self.manifest['dim']})")
+
+        start = len(self.chunks)
+        new_chunks = [
+            {"chunk_id": f"{Path(path).name}_chunk_{i}", "path": key, "text": text_piece, "nb_tokens": nb_tokens}
+            for i, (text_piece, nb_tokens) in enumerate(pieces)
+        ]
+        # Release the mapping before growing the file it maps
+        self._matrix = None
+        # Appending keeps the cost of an upload independent of the size of the index
+        if vectors:
+            with open(self.matrix_path, "ab") as f:
+                f.write(np.stack(vectors).astype(np.float32).tobytes())
+        self.chunks.extend(new_chunks)
+        if previous is not None:
+            # Tombstones are persisted by rewriting the chunk list, the matrix is left untouched
+            self._rewrite_chunks()
+        else:
+            with open(self.chunks_path, "a", encoding="utf8") as f:
+                for chunk in new_chunks:
+                    f.write(json.dumps(chunk) + "\n")
+        self.manifest["files"][key] = {
+            "hash": digest,
+            "chunk_size": chunk_size,
+            "overlap_size": overlap_size,
+            "start": start,
+            "end": start + len(new_chunks),
+        }
+        self._save_manifest()
+        self._alive = None
+        self.version += 1
+        return len(new_chunks)
+
+    def _rewrite_chunks(self) -> None:
+        with open(self.chunks_path, "w", encoding="utf8") as f:
+            for chunk in self.chunks:
+                f.write(json.dumps(chunk) + "\n")
+
+    @property
+    def matrix(self) -> np.ndarray:
+        if self._matrix is None:
+            dim = self.manifest["dim"]
+            if dim == 0 or not self.matrix_path.exists() or not self.chunks:
+                self._matrix = np.zeros((0, max(dim, 1)), dtype=np.float32)
+            else:
+                self._matrix = np.memmap(self.matrix_path, dtype=np.float32, mode="r", shape=(len(self.chunks), dim))
+        return self._matrix
+
+    @property
+    def alive(self) -> np.ndarray:
+        if self._alive is None:
+            self._alive = np.array([not c.get("deleted") for c in self.chunks], dtype=bool)
+        return self._alive
+
+    def embed_query(self, query: str) -> np.ndarray:
+        vector = np.asarray(self.embed(query), dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def search_vectors(self, queries: np.ndarray, top_k: int) -> List[List[Tuple[int, float]]]:
+        """Returns, for each query vector, the top_k (row, cosine similarity) pairs."""
+        if len(self.chunks) == 0:
+            return [[] for _ in range(len(queries))]
+        scores = np.asarray(queries, dtype=np.float32) @ self.matrix.T
+        scores[:, ~self.alive] = -np.inf
+        top_k = min(top_k, int(self.alive.sum()))
+        results = []
+        for row in scores:
+            if top_k <= 0:
+                results.append([])
+                continue
+            best = np.argpartition(-row, top_k - 1)[:top_k]
+            best = best[np.argsort(-row[best])]
+            results.append([(int(i), float(row[i])) for i in best])
+        return results
+
+    def recover_text(self, query: str, top_k: int = 3):
+        """
+        Same contract as safe_store's TextVectorizer.recover_text.
+
+        Returns:
+            The chunk texts, the sorted (chunk id, similarity) pairs and the document paths.
+        """
+        hits = self.search_vectors(self.embed_query(query)[None, :], top_k)[0]
+        texts = [self.chunks[i]["text"] for i, _ in hits]
+        similarities = [(self.chunks[i]["chunk_id"], score) for i, score in hits]
+        documents = [self.chunks[i]["path"] for i, _ in hits]
+        return texts, similarities, documents
+
+    def recover_texts(self, queries: List[str], top_k: int = 3):
+        """
+        Batched recover_text: all the queries are scored with a single matrix product.
+
+        Returns:
+            A list holding the recover_text result of each query.
+        """
+        if not queries:
+            return []
+        vectors = np.stack([self.embed_query(q) for q in queries])
+        results = []
+        for hits in self.search_vectors(vectors, top_k):
+            results.append((
+                [self.chunks[i]["text"] for i, _ in hits],
+                [(self.chunks[i]["chunk_id"], score) for i, score in hits],
+                [self.chunks[i]["path"] for i, _ in hits],
+            ))
+        return results
+
+    def compact(self) -> None:
+        """Drops the rows of replaced documents from the matrix file."""
+        keep = np.flatnonzero(self.alive)
+        if len(keep) == len(self.chunks):
+            return
+        tmp = self.matrix_path.with_suffix(".tmp")
+        np.asarray(self.matrix[keep]).astype(np.float32).tofile(tmp)
+        self._matrix = None
+        shutil.move(str(tmp), str(self.matrix_path))
+        old_to_new = {int(old): new for new, old in enumerate(keep)}
+        self.chunks = [self.chunks[i] for i in keep]
+        for entry in self.manifest["files"].values():
+            rows = [old_to_new[r] for r in range(entry["start"], entry["end"]) if r in old_to_new]
+            entry["start"], entry["end"] = (rows[0], rows[-1] + 1) if rows else (0, 0)
+        self._rewrite_chunks()
+        self._save_manifest()
+        self._alive = None
+        self.version += 1
+        self.layout_version += 1
+
+    def show_document(self, save_fig_path: Path, show_interactive_form: bool = False) -> None:
+        """Plots a 2D PCA projection of the chunk embeddings."""
+        import matplotlib.pyplot as plt
+        keep = np.flatnonzero(self.alive)
+        data = np.asarray(self.matrix[keep])
+        if len(data) < 2:
+            return
+        centered = data - data.mean(axis=0)
+        _, _, vt = np.linalg.svd(centered, full_matrices=False)
+        points = centered @ vt[:2].T
+        paths = [self.chunks[i]["path"] for i in keep]
+        names = sorted(set(paths))
+        colors = [names.index(p) for p in paths]
+        plt.figure(figsize=(10, 8))
+        plt.scatter(points[:, 0], points[:, 1], c=colors, cmap="tab20")
+        plt.title("Chunks embeddings (PCA)")
+        plt.savefig(save_fig_path)
+        if show_interactive_form:
+            plt.show()
+        plt.close()
@@ -0,0 +1,236 @@
+"""
+Streaming chunking and on-disk storage of paragraphs.
+
+Text exports of several hundred megabytes used to be split in memory, then the
+whole paragraph list was dumped as one json blob after each file. Here the
+lines of a file are read one by one and chunks are yielded as soon as they are
+full, and every chunk is appended to a JSONL file as an [index, text] record.
+
+A side index file holds (paragraph index, byte offset) pairs, so a paragraph is
+read with a single seek and opening a store doesn't parse the data file.
+Replacing a paragraph appends a new record and a new index entry, the last
+entry of an index wins; nothing is ever rewritten in place. A lost index file
+is rebuilt from the records.
+"""
+import io
+import json
+import time
+import struct
+import threading
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, List, Optional, Union
+
+_ENTRY = struct.Struct("<QQ")
+
+
+class ProgressThrottle:
+    """Calls report(message) at most once every interval seconds."""
+    def __init__(self, report: Callable[[str], None], interval: float = 0.5) -> None:
+        self.report = report
+        self.interval = interval
+        self.last = 0.0
+
+    def __call__(self, message: Union[str, Callable[[], str]], force: bool = False) -> None:
+        now = time.monotonic()
+        if force or now - self.last >= self.interval:
+            self.last = now
+            self.report(message() if callable(message) else message)
+
+
+def iter_lines(source: Union[str, Path, Iterable[str]]) -> Iterator[str]:
+    """The lines of a path (read lazily), of a text, or of an iterable of lines, without their line break."""
+    if isinstance(source, Path):
+        with open(source, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                yield line[:-1] if line.endswith("\n") else line
+        return
+    if isinstance(source, str):
+        source = io.StringIO(source)
+    for line in source:
+        yield line[:-1] if line.endswith("\n") else line
+
+
+def iter_chunks(lines: Iterable[str], max_chunk_size: Optional[int] = None, on_line: Optional[Callable[[int], None]] = None) -> Iterator[str]:
+    """
+    Joins consecutive lines into chunks of at most max_chunk_size characters, a longer line being a chunk of its own.
+
+    Args:
+        max_chunk_size: None yields every line as a chunk.
+        on_line: Called with the number of lines read so far.
+    """
+    current: List[str] = []
+    size = 0
+    for i, line in enumerate(lines):
+        if on_line is not None:
+            on_line(i + 1)
+        if max_chunk_size is None:
+            yield line
+            continue
+        if current and size + len(line) > max_chunk_size:
+            yield "\n".join(current)
+            current, size = [], 0
+        current.append(line)
+        size += len(line)
+    if current:
+        yield "\n".join(current)
+
+
+class ParagraphStore:
+    """
+    Append-only paragraph list stored in path (JSONL) and path + ".idx" (offsets).
+
+    Args:
+        path: The JSONL data file.
+    """
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self.index_path = self.path.with_name(self.path.name + ".idx")
+        self.lock = threading.RLock()
+        self.offsets: List[int] = []
+        self._writer = None
+        self._index_writer = None
+        self._reader = None
+        self._size = 0
+        self._load()
+
+    def _load(self) -> None:
+        self.offsets = []
+        self._size = self.path.stat().st_size if self.path.exists() else 0
+        if self._size:
+            self._drop_partial_record()
+        if not self.index_path.exists():
+            if self._size:
+                self._rebuild_index()
+            return
+        data = self.index_path.read_bytes()
+        valid = len(data) - len(data) % _ENTRY.size
+        for index, offset in _ENTRY.iter_unpack(data[:valid]):
+            if offset >= self._size:
+                # Entry written after its record was lost, the index is only trusted up to the data
+                continue
+            if index == len(self.offsets):
+                self.offsets.append(offset)
+            elif index < len(self.offsets):
+                self.offsets[index] = offset
+        if valid != len(data):
+            with open(self.index_path, "r+b") as f:
+                f.truncate(valid)
+
+    def _drop_partial_record(self) -> None:
+        """Truncates a record left unfinished by an interrupted write, so the next records start on their own line."""
+        with open(self.path, "r+b") as f:
+            position = self._size
+            while position > 0:
+                start = max(0, position - 4096)
+                f.seek(start)
+                block = f.read(position - start)
+                newline = block.rfind(b"\n")
+                if newline >= 0:
+                    position = start + newline + 1
+                    break
+                position = start
+            if position != self._size:
+                f.truncate(position)
+                self._size = position
+
+    def _rebuild_index(self) -> None:
+        """Indexes the data file from scratch, when the index is missing."""
+        entries = bytearray()
+        with open(self.path, "rb") as f:
+            offset = 0
+            for line in f:
+                if line.endswith(b"\n"):
+                    index = json.loads(line)[0]
+                    entries += _ENTRY.pack(index, offset)
+                    if index == len(self.offsets):
+                        self.offsets.append(offset)
+                    elif index < len(self.offsets):
+                        self.offsets[index] = offset
+                offset += len(line)
+        self.index_path.write_bytes(bytes(entries))
+
+    def _write(self, records: List[tuple]) -> None:
+        """Appends (index, text) records."""
+        if self._writer is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._writer = open(self.path, "ab")
+            self._index_writer = open(self.index_path, "ab")
+        data = bytearray()
+        entries = bytearray()
+        for index, text in records:
+            offset = self._size + len(data)
+            data += json.dumps([index, text], ensure_ascii=False).encode("utf-8") + b"\n"
+            entries += _ENTRY.pack(index, offset)
+            if index == len(self.offsets):
+                self.offsets.append(offset)
+            else:
+                self.offsets[index] = offset
+        # The data goes first, an index entry never points past the data
+        self._writer.write(data)
+        self._writer.flush()
+        self._index_writer.write(entries)
+        self._index_writer.flush()
+        self._size += len(data)
+
+    def append(self, text: str) -> int:
+        with self.lock:
+            self._write([(len(self.offsets), text)])
+            return len(self.offsets) - 1
+
+    def extend(self, texts: Iterable[str], batch_size: int = 256) -> int:
+        """Appends the texts in batches and returns the number of texts appended."""
+        count = 0
+        batch: List[str] = []
+        for text in texts:
+            batch.append(text)
+            if len(batch) >= batch_size:
+                with self.lock:
+                    self._write([(len(self.offsets) + i, t) for i, t in enumerate(batch)])
+                count += len(batch)
+                batch = []
+        if batch:
+            with self.lock:
+                self._write([(len(self.offsets) + i, t) for i, t in enumerate(batch)])
+            count += len(batch)
+        return count
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def __getitem__(self, index: int) -> str:
+        with self.lock:
+            offset = self.offsets[index]
+            if self._reader is None:
+                self._reader = open(self.path, "rb")
+            self._reader.seek(offset)
+            return json.loads(self._reader.readline())[1]
+
+    def __setitem__(self, index: int, text: str) -> None:
+        with self.lock:
+            if not -len(self.offsets) <= index < len(self.offsets):
+                raise IndexError(index)
+            self._write([(index % len(self.offsets), text)])
+
+    def __iter__(self) -> Iterator[str]:
+        """The paragraphs in order, new paragraphs appended while iterating are not listed."""
+        for i in range(len(self)):
+            yield self[i]
+
+    def close(self) -> None:
+        with self.lock:
+            for handle in (self._writer, self._index_writer, self._reader):
+                if handle is not None:
+                    handle.close()
+            self._writer = self._index_writer = self._reader = None
+
+    def clear(self) -> bool:
+        """Deletes the store files, returns False when there was nothing to delete."""
+        with self.lock:
+            self.close()
+            existed = self.path.exists()
+            for path in (self.path, self.index_path):
+                if path.exists():
+                    path.unlink()
+            self.offsets = []
+            self._size = 0
+            return existed
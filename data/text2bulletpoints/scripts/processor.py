@@ -6,51 +6,56 @@ from lollms.helpers import ASCIIColors
 from lollms.prompting import LollmsContextDetails
 
 import json
+import sys
 from pathlib import Path
 from typing import Callable, Any
 
+sys.path.append(str(Path(__file__).parent))
+from paragraph_store import ParagraphStore, ProgressThrottle, iter_chunks, iter_lines
+
 class Text2Paragraphs:
+    """
+    Paragraphs of the added documents, stored next to database_path as a JSONL file.
+
+    A legacy json database ({"paragraphs": [...]}) found at database_path is imported once.
+    """
     def __init__(self, database_path=None, max_chunk_size=2000):
-        self.paragraphs = []
-        self.database_path = database_path
+        self.database_path = Path(database_path) if database_path is not None else None
         self.max_chunk_size = max_chunk_size
-        if database_path is not None:
-            if Path(database_path).exists():
-                self.load_from_json()
+        self.paragraphs = ParagraphStore(self.database_path.with_suffix(".jsonl")) if database_path is not None else []
+        if self.database_path is not None and len(self.paragraphs) == 0 and self.database_path.suffix == ".json" and self.database_path.exists():
+            self.load_from_json()
 
     def chunk_text(self, text):
-        paragraphs = text.split("\n")  # Split text by double newlines to separate paragraphs
-        if self.max_chunk_size is not None:
-            current_chunk = []
-            current_chunk_size = 0
-            for i,paragraph in enumerate(paragraphs):
-                ASCIIColors.yellow(f"Processing paragraph:{i}/{len(paragraphs)}",end="\r")
-                if current_chunk_size + len(paragraph) <= self.max_chunk_size:
-                    current_chunk.append(paragraph)
-                    current_chunk_size += len(paragraph)
-                else:
-                    self.paragraphs.append("\n".join(current_chunk))
-                    current_chunk = [paragraph]
-                    current_chunk_size = len(paragraph)
-            if current_chunk:
-                self.paragraphs.append("\n".join(current_chunk))
-        else:
-            self.paragraphs.extend(paragraphs)  # Add new paragraphs to the existing ones
+        """Chunks a text, a file path or an iterable of lines, reading the lines lazily."""
+        progress = ProgressThrottle(lambda message: ASCIIColors.yellow(message, end="\r"))
+        chunks = iter_chunks(iter_lines(text), self.max_chunk_size, lambda nb_lines: progress(lambda: f"Processing paragraph:{nb_lines}"))
+        self.paragraphs.extend(chunks)
 
     def load_from_json(self, filename=None):
         if filename is None:
             filename = self.database_path
         with open(filename, "r") as file:
             data = json.load(file)
-            self.paragraphs = data["paragraphs"]
+            self.paragraphs.extend(data["paragraphs"])
 
     def save_to_json(self, filename=None):
         if filename is None:
             filename = self.database_path
-        data = {"paragraphs": self.paragraphs}
+        data = {"paragraphs": list(self.paragraphs)}
         with open(filename, "w") as file:
             json.dump(data, file)
 
+    def clear(self):
+        """Deletes the database files, returns False when there was nothing to delete."""
+        existed = False
+        if isinstance(self.paragraphs, ParagraphStore):
+            existed = self.paragraphs.clear()
+        if self.database_path is not None and self.database_path.exists():
+            self.database_path.unlink()
+            existed = True
+        return existed
+
 
 class Processor(APScript):
     """
@@ -170,10 +175,12 @@ class Processor(APScript):
                 elif Path(file).suffix==".html":
                     text =  Processor.read_html_file(file)
                 else:
-                    text =  Processor.read_text_file(file)
-                    
-                self.text_store.chunk_text(text)       
-                self.text_store.save_to_json()         
+                    # Plain text files are streamed line by line
+                    text = Path(file)
+
+                if not isinstance(text, (str, Path)):
+                    text = json.dumps(text, indent=4)
+                self.text_store.chunk_text(text)
                 print(ASCIIColors.color_reset)
                 ASCIIColors.success(f"File {file} vectorized successfully")
             except Exception as ex:
@@ -243,9 +250,7 @@ class Processor(APScript):
             
             self.state = 0
         elif prompt.strip().lower()=="clear_database":
-            database_fill_path:Path = self.personality.lollms_paths.personal_data_path/self.personality_config["database_path"]
-            if database_fill_path.exists():
-                database_fill_path.unlink()
+            if self.text_store.clear():
                 self.personality_config.database_path = prompt
                 self.personality_config.save()
                 self.text_store = Text2Paragraphs(
@@ -289,7 +294,7 @@ class Processor(APScript):
                     callback(output, MSG_OPERATION_TYPE.MSG_OPERATION_TYPE_ADD_CHUNK)
                     
         elif prompt.strip().lower()=="clear_database":
-            (self.personality.lollms_paths.personal_data_path/self.personality_config["database_path"]).unlink()
+            self.text_store.clear()
             self.text_store = Text2Paragraphs(
                             self.personality.lollms_paths.personal_data_path/self.personality_config.database_path,
                             max_chunk_size=self.personality_config.max_chunk_size
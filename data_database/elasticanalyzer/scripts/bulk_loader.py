@@ -0,0 +1,200 @@
+"""
+Streaming bulk ingestion for Elasticsearch.
+
+The input file is read line by line and cut into batches bounded both in number
+of documents and in bytes. Each batch is sent to the _bulk endpoint by a pool
+of workers; at most two batches per worker are in flight, so memory stays flat
+whatever the size of the file. Batches rejected as a whole (429, 5xx,
+connection errors) and documents rejected with a 429 inside a successful bulk
+response are retried with exponential backoff.
+
+Only plain HTTP is used (requests), which keeps the loader testable against
+any endpoint that speaks the _bulk protocol.
+"""
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+RETRYABLE_STATUS = {429, 502, 503, 504}
+
+
+def iter_actions(file_path, index_name: str) -> Iterator[Tuple[dict, dict]]:
+    """
+    Streams (action metadata, document) pairs from a jsonl file.
+
+    Supported lines:
+        - dump entries: {"_index": ..., "_id": ..., "_source": {...}} (the "index" key
+          of older dumps is accepted in place of "_index")
+        - bulk files: an {"index": {"_id": ...}} line followed by the document line
+        - plain documents: any other json object
+    """
+    pending_meta = None
+    with open(file_path, "r", encoding="utf8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            doc = json.loads(line)
+            if pending_meta is not None:
+                yield pending_meta, doc
+                pending_meta = None
+                continue
+            if "_source" in doc:
+                meta = {"_index": index_name}
+                if "_id" in doc:
+                    meta["_id"] = doc["_id"]
+                yield meta, doc["_source"]
+            elif len(doc) == 1 and isinstance(doc.get("index", doc.get("create")), dict):
+                action = doc.get("index", doc.get("create"))
+                pending_meta = {"_index": index_name}
+                if "_id" in action:
+                    pending_meta["_id"] = action["_id"]
+            else:
+                yield {"_index": index_name}, doc
+
+
+class BulkStats:
+    def __init__(self) -> None:
+        self.indexed = 0
+        self.failed = 0
+        self.retries = 0
+        self.batches = 0
+        self.seconds = 0.0
+        self.errors: List[str] = []
+
+    @property
+    def docs_per_sec(self) -> float:
+        return self.indexed / self.seconds if self.seconds > 0 else 0.0
+
+    def __str__(self) -> str:
+        return f"{self.indexed} documents indexed, {self.failed} failed, {self.retries} retries in {self.seconds:.1f}s ({self.docs_per_sec:.0f} docs/s)"
+
+
+class BulkLoader:
+    """
+    Args:
+        host: Elasticsearch url.
+        auth: Optional (user, password) tuple.
+        batch_size: Maximum number of documents per _bulk request.
+        max_batch_bytes: Maximum size of a _bulk request body.
+        workers: Number of concurrent _bulk requests.
+        max_retries: Attempts left to a batch or a document after its first failure.
+        backoff: Initial retry delay in seconds, doubled on each attempt.
+    """
+    def __init__(self, host: str, auth: Optional[tuple] = None, batch_size: int = 1000, max_batch_bytes: int = 10 * 1024 * 1024,
+                 workers: int = 4, max_retries: int = 5, backoff: float = 0.5, timeout: float = 60, verify: bool = True) -> None:
+        self.url = host.rstrip("/") + "/_bulk"
+        self.batch_size = max(1, batch_size)
+        self.max_batch_bytes = max_batch_bytes
+        self.workers = max(1, workers)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.auth = auth
+        self.session.verify = verify
+        self.session.headers["Content-Type"] = "application/x-ndjson"
+
+    def _batches(self, actions: Iterator[Tuple[dict, dict]]) -> Iterator[List[bytes]]:
+        batch: List[bytes] = []
+        size = 0
+        for meta, doc in actions:
+            entry = (json.dumps({"index": meta}) + "\n" + json.dumps(doc) + "\n").encode("utf8")
+            if batch and (len(batch) >= self.batch_size or size + len(entry) > self.max_batch_bytes):
+                yield batch
+                batch, size = [], 0
+            batch.append(entry)
+            size += len(entry)
+        if batch:
+            yield batch
+
+    def send(self, batch: List[bytes]) -> Tuple[int, int, int, List[str]]:
+        """
+        Sends one batch, retrying what can be retried.
+
+        Returns:
+            The number of indexed and failed documents, the number of retries and a sample of errors.
+        """
+        indexed = failed = retries = 0
+        errors: List[str] = []
+        attempt = 0
+        while batch:
+            retry: List[bytes] = []
+            try:
+                response = self.session.post(self.url, data=b"".join(batch), timeout=self.timeout)
+                status = response.status_code
+            except requests.RequestException as ex:
+                response, status = None, None
+                error = str(ex)
+            if response is not None and status == 200:
+                items = response.json().get("items", [])
+                for entry, item in zip(batch, items):
+                    result = next(iter(item.values()))
+                    if result.get("status", 500) < 300:
+                        indexed += 1
+                    elif result.get("status") == 429:
+                        retry.append(entry)
+                    else:
+                        failed += 1
+                        if len(errors) < 5:
+                            errors.append(json.dumps(result.get("error")))
+            elif status is None or status in RETRYABLE_STATUS:
+                retry = batch
+                if status is not None:
+                    error = f"HTTP {status}"
+            else:
+                failed += len(batch)
+                errors.append(f"HTTP {status}: {response.text[:200]}")
+            if retry and attempt >= self.max_retries:
+                failed += len(retry)
+                if status != 200:
+                    errors.append(error)
+                retry = []
+            if retry:
+                time.sleep(self.backoff * (2 ** attempt))
+                attempt += 1
+                retries += 1
+            batch = retry
+        return indexed, failed, retries, errors
+
+    def load(self, actions: Iterator[Tuple[dict, dict]], progress: Optional[Callable[[BulkStats], None]] = None) -> BulkStats:
+        """Indexes all the actions and returns the statistics of the run."""
+        stats = BulkStats()
+        lock = threading.Lock()
+        # Bounds the batches read ahead of the workers
+        slots = threading.BoundedSemaphore(self.workers * 2)
+        start = time.perf_counter()
+
+        def done(future, nb_docs):
+            try:
+                indexed, failed, retries, errors = future.result()
+            except Exception as ex:
+                indexed, failed, retries, errors = 0, nb_docs, 0, [str(ex)]
+            with lock:
+                stats.indexed += indexed
+                stats.failed += failed
+                stats.retries += retries
+                stats.batches += 1
+                stats.errors.extend(errors[:max(0, 20 - len(stats.errors))])
+                stats.seconds = time.perf_counter() - start
+                if progress:
+                    progress(stats)
+            slots.release()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for batch in self._batches(actions):
+                slots.acquire()
+                executor.submit(self.send, batch).add_done_callback(lambda future, n=len(batch): done(future, n))
+        stats.seconds = time.perf_counter() - start
+        return stats
+
+    def load_file(self, file_path, index_name: str, progress: Optional[Callable[[BulkStats], None]] = None) -> BulkStats:
+        return self.load(iter_actions(file_path, index_name), progress)
@@ -43,6 +43,9 @@ def parse_query(query):
         return None, None, 0
 
 from elasticsearch import Elasticsearch
+import sys
+sys.path.append(str(Path(__file__).resolve().parent))
+from bulk_loader import BulkLoader, BulkStats
 
 class ElasticSearchConnector:
     def __init__(self, host='http://localhost:9200', username=None, password=None):
@@ -70,21 +73,26 @@ class ElasticSearchConnector:
     def add_entry(self, index, body):
         return self.es.index(index=index, body=body)
 
-    def index_data(self, file_path, index_name):
+    def create_index(self, index_name):
+        if not self.es.indices.exists(index=index_name):
+            self.es.indices.create(index=index_name)
+
+    def index_data(self, file_path, index_name, batch_size=1000, workers=4, max_retries=5, progress=None) -> BulkStats:
+        """
+        Streams a jsonl file (elasticsearch dumps or plain documents) into an index through the _bulk api.
+        Refreshes are suspended during the load and the index is refreshed once at the end.
+        """
+        self.create_index(index_name)
+        auth = (self.username, self.password) if self.username and self.password else None
+        loader = BulkLoader(self.host, auth, batch_size=batch_size, workers=workers, max_retries=max_retries, verify=auth is None)
+        self.es.indices.put_settings(index=index_name, body={"index": {"refresh_interval": "-1"}})
         try:
-            self.create_index(index_name)
-            with open(file_path, 'r') as file:
-                for line in file:
-                    doc = json.loads(line)
-                    if 'index' in doc:
-                        self.es.index(index=index_name, body=doc['_source'], id=doc['_id'])
-                    else:
-                        self.es.index(index=index_name, body=doc)
-            return True
-        except Exception as e:
-            print(f"Error indexing data: {e}")
-            return False
-        
+            stats = loader.load_file(file_path, index_name, progress)
+        finally:
+            self.es.indices.put_settings(index=index_name, body={"index": {"refresh_interval": None}})
+            self.es.indices.refresh(index=index_name)
+        return stats
+
 
     def ping(self):
         # Ping the Elasticsearch server
@@ -128,6 +136,9 @@ class Processor(APScript):
                 {"name":"output_folder_path","type":"str","value":"", "help":"Folder to put the output"},
                 {"name":"output_format","type":"str","value":"markdown", "options":["markdown","html","latex"], "help":"Output format"},
                 {"name":"max_nb_failures","type":"int","value":3, "help":"Maximum number of failures"},
+                {"name":"bulk_batch_size","type":"int","value":1000, "help":"Number of documents sent in each bulk request when indexing an uploaded jsonl file"},
+                {"name":"bulk_workers","type":"int","value":4, "help":"Number of bulk requests sent in parallel when indexing an uploaded jsonl file"},
+                {"name":"bulk_max_retries","type":"int","value":5, "help":"Number of retries of a rejected bulk request or document"},
                 {"name":"debug_mode","type":"bool","value":False, "help":"Shows all the process details (useful for debugging)"},
             ]
             )
@@ -164,8 +175,34 @@ class Processor(APScript):
     def add_file(self, path, client, callback=None):
         """
         Here we implement the file reception handling
+        jsonl files are indexed into the configured index
         """
-        super().add_file(path, client, callback)
+        path = Path(path)
+        if path.suffix.lower() not in [".jsonl", ".ndjson"] or self.personality_config.index_name=="":
+            return super().add_file(path, client, callback)
+        self.callback = callback
+        es = ElasticSearchConnector(self.personality_config.server, self.personality_config.user, self.personality_config.password)
+        self.step_start(f"Indexing {path.name} into {self.personality_config.index_name}")
+        try:
+            stats = es.index_data(
+                path,
+                self.personality_config.index_name,
+                batch_size=self.personality_config.bulk_batch_size,
+                workers=self.personality_config.bulk_workers,
+                max_retries=self.personality_config.bulk_max_retries,
+                progress=lambda stats: self.set_message_content(f"Indexing {path.name}: {stats}")
+            )
+        except Exception as ex:
+            ASCIIColors.error(f"Error indexing data: {ex}")
+            self.step_end(f"Indexing {path.name} into {self.personality_config.index_name}", False)
+            self.set_message_content(f"Error indexing data: {ex}")
+            return False
+        self.step_end(f"Indexing {path.name} into {self.personality_config.index_name}", stats.failed==0)
+        report = f"{path.name}: {stats}"
+        if stats.errors:
+            report += "\n\nFirst errors:\n" + "\n".join(f"- {error}" for error in stats.errors[:5])
+        self.set_message_content(report)
+        return stats.failed==0
 
     from lollms.client_session import Client
     def run_workflow(self,  context_details:LollmsContextDetails=None, client:Client=None,  callback: Callable[[str | list | None, MSG_OPERATION_TYPE, str, AIPersonality| None], bool]=None):
@@ -0,0 +1,163 @@
+"""
+Map-reduce summarization of document collections.
+
+The chunks of a document are summarized concurrently (map), then the chunk
+summaries are fused by groups that fit the context, level after level, until a
+single summary remains (reduce). Each fusion prompt stays under the chunk size
+whatever the length of the document or the number of documents, and every
+level runs its groups concurrently.
+
+Documents are read in a process pool, parsing pdf, docx or pptx files is CPU
+bound and would otherwise hold the GIL while the models wait. Summaries are
+stored by hash of the file and of the summary settings, so a folder is only
+summarized again for the files that changed.
+"""
+import json
+import hashlib
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Callable, Iterator, List, Optional, Tuple
+
+
+def read_document(path: str) -> str:
+    """Runs in a reader process."""
+    from safe_store import GenericDataLoader
+    return GenericDataLoader.read_file(Path(path))
+
+
+def file_hash(path: Path) -> str:
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def settings_hash(settings: dict) -> str:
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf8")).hexdigest()[:16]
+
+
+def read_documents(paths: List[Path], workers: int = 2) -> Iterator[Tuple[Path, Optional[str], Optional[Exception]]]:
+    """
+    Reads documents ahead in a process pool, with at most 2*workers documents read ahead so
+    that the texts don't pile up in memory while the caller summarizes them one by one.
+
+    Yields:
+        (path, text, error) in the order of paths. Text is None when reading failed.
+    """
+    if not paths:
+        return
+    if workers <= 0:
+        for path in paths:
+            try:
+                yield path, read_document(str(path)), None
+            except Exception as ex:
+                yield path, None, ex
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        next_path = 0
+        for i, path in enumerate(paths):
+            while next_path < len(paths) and next_path < i + 2 * workers:
+                futures[next_path] = pool.submit(read_document, str(paths[next_path]))
+                next_path += 1
+            try:
+                yield path, futures.pop(i).result(), None
+            except Exception as ex:
+                yield path, None, ex
+
+
+class SummaryStore:
+    """Per document summaries stored as json files named by file and settings hash."""
+    def __init__(self, folder: Path, settings: dict) -> None:
+        self.folder = Path(folder)
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.settings = settings_hash(settings)
+
+    def _path(self, digest: str) -> Path:
+        return self.folder / digest[:2] / f"{digest}_{self.settings}.json"
+
+    def get(self, digest: str) -> Optional[str]:
+        path = self._path(digest)
+        if not path.exists():
+            return None
+        try:
+            return json.loads(path.read_text(encoding="utf8"))["summary"]
+        except (json.JSONDecodeError, KeyError, OSError):
+            return None
+
+    def set(self, digest: str, file_name: str, summary: str) -> None:
+        path = self._path(digest)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"file": file_name, "summary": summary}, indent=4), encoding="utf8")
+        tmp.replace(path)
+
+
+class MapReduceSummarizer:
+    """
+    Args:
+        map_chunk: Summarizes one chunk of a document.
+        reduce_group: Fuses a list of summaries into one.
+        count_tokens: Token counter.
+        split: Cuts a text into chunks of at most chunk_size tokens.
+        chunk_size: Maximum size in tokens of a chunk or of a group of summaries to fuse.
+        target_size: Size in tokens under which a text needs no more summarization.
+        max_in_flight: Number of generations running at the same time.
+        max_depth: Maximum number of reduce levels.
+    """
+    def __init__(self, map_chunk: Callable[[str], str], reduce_group: Callable[[List[str]], str], count_tokens: Callable[[str], int],
+                 split: Callable[[str, int], List[str]], chunk_size: int, target_size: int, max_in_flight: int = 4, max_depth: int = 6,
+                 on_progress: Optional[Callable[[str], None]] = None) -> None:
+        self.map_chunk = map_chunk
+        self.reduce_group = reduce_group
+        self.count_tokens = count_tokens
+        self.split = split
+        self.chunk_size = chunk_size
+        self.target_size = target_size
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_depth = max_depth
+        self.on_progress = on_progress or (lambda text: None)
+
+    def _run(self, function: Callable, jobs: list) -> list:
+        if self.max_in_flight == 1 or len(jobs) <= 1:
+            return [function(job) for job in jobs]
+        with ThreadPoolExecutor(max_workers=min(self.max_in_flight, len(jobs))) as executor:
+            return list(executor.map(function, jobs))
+
+    def group(self, parts: List[str]) -> List[List[str]]:
+        """Consecutive groups of at least two parts fitting chunk_size when possible."""
+        groups: List[List[str]] = []
+        current: List[str] = []
+        size = 0
+        for part in parts:
+            nb_tokens = self.count_tokens(part)
+            if len(current) >= 2 and size + nb_tokens > self.chunk_size:
+                groups.append(current)
+                current, size = [], 0
+            current.append(part)
+            size += nb_tokens
+        if current:
+            # A lone trailing part is fused with the previous group rather than copied to the next level
+            if len(current) == 1 and groups:
+                groups[-1].extend(current)
+            else:
+                groups.append(current)
+        return groups
+
+    def reduce(self, parts: List[str]) -> str:
+        for depth in range(self.max_depth):
+            if len(parts) == 1 and self.count_tokens(parts[0]) <= self.target_size:
+                break
+            groups = self.group(parts) if len(parts) > 1 else [parts]
+            self.on_progress(f"Fusing {len(parts)} summaries into {len(groups)} [depth {depth}]")
+            parts = self._run(self.reduce_group, groups)
+        return "\n".join(parts)
+
+    def summarize(self, text: str) -> str:
+        if self.count_tokens(text) <= self.target_size:
+            return text
+        chunks = self.split(text, self.chunk_size)
+        self.on_progress(f"Summarizing {len(chunks)} chunks")
+        parts = self._run(self.map_chunk, chunks)
+        return self.reduce(parts)
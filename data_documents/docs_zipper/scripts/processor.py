@@ -2,11 +2,20 @@ from lollms.helpers import ASCIIColors
 from lollms.config import TypedConfig, BaseConfig, ConfigTemplate
 from lollms.personality import APScript, AIPersonality
 from lollms.types import MSG_OPERATION_TYPE
+from lollms.prompting import LollmsContextDetails
 from typing import Callable, Any
 import subprocess
 from pathlib import Path
 from lollms.client_session import Client
 from lollms.types import SUMMARY_MODE
+from safe_store import GenericDataLoader
+from safe_store.document_decomposer import DocumentDecomposer
+import sys
+
+sys.path.append(str(Path(__file__).parent))
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+from zoo_common.context_packing import TokenCounter
+from map_reduce import MapReduceSummarizer, SummaryStore, read_documents, file_hash
 # Helper functions
 class Processor(APScript):
     """
@@ -28,7 +37,10 @@ class Processor(APScript):
         # options can be added using : "options":["option1","option2"...]        
         personality_config_template = ConfigTemplate(
             [
-                {"name":"zip_mode","type":"str","value":"sequencial","options":["sequencial", "hierarchical"], "help":"algorithm"},
+                {"name":"zip_mode","type":"str","value":"map_reduce","options":["map_reduce", "sequencial", "hierarchical"], "help":"algorithm. map_reduce summarizes the chunks concurrently then fuses the summaries by groups that fit the context until one remains"},
+                {"name":"max_in_flight","type":"int","value":4, "help":"map_reduce mode: the number of chunks or groups summarized at the same time. Set to 1 if your binding can't serve concurrent requests"},
+                {"name":"reader_processes","type":"int","value":2, "help":"The number of processes reading documents ahead of the summarization. 0 reads them in the main process"},
+                {"name":"reuse_summaries","type":"bool","value":True, "help":"Keep the summary of each document and reuse it while the file and the summary settings don't change"},
                 {"name":"zip_size","type":"int","value":1024, "help":"the maximum size of the summary in tokens"},
                 {"name":"data_folder","type":"str","value":"", "help":"The path to a folder where to get the input files."},
                 {"name":"output_path","type":"str","value":"", "help":"The path to a folder where to put the summary file."},
@@ -69,6 +81,8 @@ class Processor(APScript):
                         )
         self.cv = None
         self.position = None
+        self.token_counter = None
+        self.token_counter_model = None
 
     def install(self):
         super().install()
@@ -91,24 +105,22 @@ class Processor(APScript):
         with open(path,"w", encoding="utf8") as f:
             f.write(text)
 
-    def zip_text(
-                    self, 
-                    document_text:str, 
-                    instruction=f"summarize the document chunk in a detailed comprehensive manner.", 
-                    add_summary_formatting=True,
-                    contextual_zipping_text="",
-                    summary_formatting_text="",
-                    translate_to=""
-                    ):
+    def count_tokens(self, text:str):
+        # The counts depend on the tokenizer, the counter is rebuilt when the model changes
+        if self.token_counter is None or self.token_counter_model is not self.personality.model:
+            self.token_counter_model = self.personality.model
+            self.token_counter = TokenCounter(self.personality.model.tokenize)
+        return self.token_counter(text)
+
+    def split_text(self, text:str, chunk_size:int):
+        return DocumentDecomposer.decompose_document(text, chunk_size, 0, self.personality.model.tokenize, self.personality.model.detokenize, True)
+
+    def build_zip_prompt(self, instruction, contextual_zipping_text="", translate_to=""):
         start_header_id_template    = self.config.start_header_id_template
         end_header_id_template      = self.config.end_header_id_template
         system_message_template     = self.config.system_message_template
         separator_template          = self.config.separator_template
 
-
-        start_ai_header_id_template     = self.config.start_ai_header_id_template
-        end_ai_header_id_template       = self.config.end_ai_header_id_template
-
         zip_prompt = f"{start_header_id_template}{system_message_template}{end_header_id_template}{separator_template}"
         zip_prompt+= instruction + f"{separator_template}"
         zip_prompt+=f"Do not provide opinions nor extra information that is not in the document chunk{separator_template}"
@@ -120,58 +132,138 @@ class Processor(APScript):
         zip_prompt+=f"Eliminate any useless information and make the summary as short as possible.{separator_template}" if self.personality_config.maximum_compression else ''
         zip_prompt+=f"Important information:{contextual_zipping_text}."+"{separator_template}" if contextual_zipping_text!='' else ''
         zip_prompt+=f"The summary should be written in "+ translate_to +"{separator_template}" if translate_to!='' else ''
+        return zip_prompt
+
+    def get_summarizer(
+                        self,
+                        instruction:str,
+                        fuse_instruction:str,
+                        contextual_zipping_text="",
+                        translate_to=""
+                    ):
+        """Map-reduce summarizer whose map step follows instruction and reduce step follows fuse_instruction."""
+        start_header_id_template    = self.config.start_header_id_template
+        end_header_id_template      = self.config.end_header_id_template
+        separator_template          = self.config.separator_template
+        start_ai_header_id_template     = self.config.start_ai_header_id_template
+        end_ai_header_id_template       = self.config.end_ai_header_id_template
+        ai_header = f"{start_ai_header_id_template}assistant{end_ai_header_id_template}"
+
+        map_prompt = self.build_zip_prompt(instruction, contextual_zipping_text, translate_to)
+        reduce_prompt = self.build_zip_prompt(fuse_instruction, contextual_zipping_text, translate_to)
+
+        def map_chunk(chunk):
+            prompt = f"{map_prompt}{start_header_id_template}Document chunk{end_header_id_template}{separator_template}{chunk}{separator_template}{ai_header}"
+            return self.fast_gen(prompt, self.personality_config.zip_size, callback=self.sink).strip()
+
+        def reduce_group(summaries):
+            prompt = reduce_prompt
+            for i, summary in enumerate(summaries):
+                prompt += f"{start_header_id_template}Summary {i+1}{end_header_id_template}{separator_template}{summary}{separator_template}"
+            prompt += ai_header
+            return self.fast_gen(prompt, self.personality_config.zip_size, callback=self.sink).strip()
+
+        return MapReduceSummarizer(
+            map_chunk,
+            reduce_group,
+            self.count_tokens,
+            self.split_text,
+            int(self.personality.config.ctx_size*0.6),
+            int(self.personality_config.zip_size),
+            self.personality_config.max_in_flight,
+            on_progress=self.step
+        )
+
+    def format_summary(self, document_text:str, summary_formatting_text="", translate_to=""):
+        start_header_id_template    = self.config.start_header_id_template
+        end_header_id_template      = self.config.end_header_id_template
+        system_message_template     = self.config.system_message_template
+        separator_template          = self.config.separator_template
+        start_ai_header_id_template     = self.config.start_ai_header_id_template
+        end_ai_header_id_template       = self.config.end_ai_header_id_template
+
+        formatting_prompt  = f"{start_header_id_template}Text to format{end_header_id_template}{separator_template}"
+        formatting_prompt += f"{document_text}{separator_template}"
+        formatting_prompt += f"{start_header_id_template}{system_message_template}{end_header_id_template}{separator_template}"
         
-        if self.config.dubug:
-            self.print_prompt(zip_prompt,"zip_prompt")
-        tk = self.personality.model.tokenize(document_text)
-        if len(tk)>int(self.personality_config.zip_size):
-            depth=0
-            while len(tk)>int(self.personality_config.zip_size):
-                if self.personality_config.zip_mode!="sequencial":
-                    self.step_start(f"Comprerssing.. [depth {depth}]")
-                chunk_size = int(self.personality.config.ctx_size*0.6)
-                document_chunks = DocumentDecomposer.decompose_document(document_text, chunk_size, 0, self.personality.model.tokenize, self.personality.model.detokenize, True)
-                document_text = self.summarize_chunks(document_chunks, 
-                    zip_prompt,
-                    "Document chunk",
-                    summary_mode=SUMMARY_MODE.SUMMARY_MODE_SEQUENCIAL if self.personality_config.zip_mode=="sequencial" else SUMMARY_MODE.SUMMARY_MODE_HIERARCHICAL,
-                    callback=self.sink
-                    )
-                tk = self.personality.model.tokenize(document_text)
-                depth += 1
-                if self.personality_config.zip_mode!="sequencial":
-                    self.step_end(f"Comprerssing.. [depth {depth}]")
-                else:
-                    break
-        if add_summary_formatting:
-            formatting_prompt  = f"{start_header_id_template}Text to format{end_header_id_template}{separator_template}"
-            formatting_prompt += f"{document_text}{separator_template}"
-            formatting_prompt += f"{start_header_id_template}{system_message_template}{end_header_id_template}{separator_template}"
-            
-            formatting_prompt += f"Do not provide opinions nor extra information that is not in the document chunk{separator_template}"
-            formatting_prompt += f"Keep the same language." if self.personality_config.keep_same_language else ''
-            formatting_prompt += f"Preserve the title of this document if provided.{separator_template}" if self.personality_config.preserve_document_title else ''
-            formatting_prompt += f"Preserve author names of this document if provided.{separator_template}" if self.personality_config.preserve_authors_name else ''
-            formatting_prompt += f"Preserve results if presented in the chunk and provide the numerical values if present.{separator_template}" if self.personality_config.preserve_results else ''
-            formatting_prompt += f"Eliminate any useless information and make the summary as short as possible.{separator_template}" if self.personality_config.maximum_compression else ''
-            formatting_prompt += f"Eliminate any useless information and make the summary as short as possible.{separator_template}" if self.personality_config.maximum_compression else ''
-            formatting_prompt += f"Important information:{summary_formatting_text}.{separator_template}" if summary_formatting_text!='' else ''
-            formatting_prompt += "The output text should be written in "+translate_to +f"{separator_template}" if translate_to!='' else ''
-            formatting_prompt += "Answer directly with the new enhanced document text with no extra comments.{separator_template}"
-            formatting_prompt += f"{start_ai_header_id_template}assistant{end_ai_header_id_template}"
-            if self.config.dubug:
-                self.print_prompt(formatting_prompt,"formatting_prompt")
+        formatting_prompt += f"Do not provide opinions nor extra information that is not in the document chunk{separator_template}"
+        formatting_prompt += f"Keep the same language." if self.personality_config.keep_same_language else ''
+        formatting_prompt += f"Preserve the title of this document if provided.{separator_template}" if self.personality_config.preserve_document_title else ''
+        formatting_prompt += f"Preserve author names of this document if provided.{separator_template}" if self.personality_config.preserve_authors_name else ''
+        formatting_prompt += f"Preserve results if presented in the chunk and provide the numerical values if present.{separator_template}" if self.personality_config.preserve_results else ''
+        formatting_prompt += f"Eliminate any useless information and make the summary as short as possible.{separator_template}" if self.personality_config.maximum_compression else ''
+        formatting_prompt += f"Eliminate any useless information and make the summary as short as possible.{separator_template}" if self.personality_config.maximum_compression else ''
+        formatting_prompt += f"Important information:{summary_formatting_text}.{separator_template}" if summary_formatting_text!='' else ''
+        formatting_prompt += "The output text should be written in "+translate_to +f"{separator_template}" if translate_to!='' else ''
+        formatting_prompt += "Answer directly with the new enhanced document text with no extra comments.{separator_template}"
+        formatting_prompt += f"{start_ai_header_id_template}assistant{end_ai_header_id_template}"
+        if self.personality.config.debug:
+            self.print_prompt(formatting_prompt,"formatting_prompt")
 
-            self.step_start(f"Formatting")
-            document_text = self.fast_gen(formatting_prompt, self.personality_config.zip_size,
-                callback=self.sink
-            )
+        self.step_start(f"Formatting")
+        document_text = self.fast_gen(formatting_prompt, self.personality_config.zip_size,
+            callback=self.sink
+        )
+        self.step_end(f"Formatting")
+        return document_text
 
-            self.step_end(f"Formatting")
+    def zip_text(
+                    self, 
+                    document_text:str, 
+                    instruction=f"summarize the document chunk in a detailed comprehensive manner.", 
+                    add_summary_formatting=True,
+                    contextual_zipping_text="",
+                    summary_formatting_text="",
+                    translate_to=""
+                    ):
+        if self.personality_config.zip_mode=="map_reduce":
+            summarizer = self.get_summarizer(
+                instruction,
+                "Fuse the following summaries of consecutive parts of the same document into a single comprehensive summary.",
+                contextual_zipping_text,
+                translate_to
+            )
+            document_text = summarizer.summarize(document_text)
+        else:
+            zip_prompt = self.build_zip_prompt(instruction, contextual_zipping_text, translate_to)
+            if self.personality.config.debug:
+                self.print_prompt(zip_prompt,"zip_prompt")
+            tk = self.personality.model.tokenize(document_text)
+            if len(tk)>int(self.personality_config.zip_size):
+                depth=0
+                while len(tk)>int(self.personality_config.zip_size):
+                    if self.personality_config.zip_mode!="sequencial":
+                        self.step_start(f"Comprerssing.. [depth {depth}]")
+                    chunk_size = int(self.personality.config.ctx_size*0.6)
+                    document_chunks = self.split_text(document_text, chunk_size)
+                    document_text = self.summarize_chunks(document_chunks, 
+                        zip_prompt,
+                        "Document chunk",
+                        summary_mode=SUMMARY_MODE.SUMMARY_MODE_SEQUENCIAL if self.personality_config.zip_mode=="sequencial" else SUMMARY_MODE.SUMMARY_MODE_HIERARCHICAL,
+                        callback=self.sink
+                        )
+                    tk = self.personality.model.tokenize(document_text)
+                    depth += 1
+                    if self.personality_config.zip_mode!="sequencial":
+                        self.step_end(f"Comprerssing.. [depth {depth}]")
+                    else:
+                        break
+        if add_summary_formatting:
+            document_text = self.format_summary(document_text, summary_formatting_text, translate_to)
 
         return document_text
-                    
-        
+
+    def get_summary_store(self):
+        settings = {
+            name: getattr(self.personality_config, name)
+            for name in [
+                "zip_mode", "zip_size", "contextual_zipping_text", "add_summary_formatting", "summary_formatting_text",
+                "keep_same_language", "translate_to", "preserve_document_title", "preserve_authors_name",
+                "preserve_results", "maximum_compression"
+            ]
+        }
+        settings["model"] = f"{self.personality.config.binding_name}::{self.personality.config.model_name}"
+        return SummaryStore(self.personality.personality_output_folder/"summaries", settings)
 
     def start_zipping(self, prompt="", full_context="", client:Client=None):
         start_header_id_template    = self.config.start_header_id_template
@@ -200,12 +292,31 @@ class Processor(APScript):
             
         all_summaries=""
         formatted_summaries = f"{start_header_id_template}Documents summaries{end_header_id_template}{separator_template}"
+        document_summaries = []
         self.step(f"summary mode : {self.personality_config.zip_mode}")
-        for i,file in enumerate(files):
-            if file.suffix.lower() in [".pdf", ".docx", ".pptx"]:
-                document_path = Path(file)
+        documents = [Path(file) for file in files if Path(file).suffix.lower() in [".pdf", ".docx", ".pptx"]]
+        store = self.get_summary_store() if self.personality_config.reuse_summaries else None
+        summaries = {}
+        to_read = []
+        for document_path in documents:
+            digest = file_hash(document_path)
+            summary = store.get(digest) if store else None
+            if summary is not None:
+                summaries[document_path] = summary
+            else:
+                to_read.append((document_path, digest))
+        if store:
+            self.step(f"{len(summaries)} documents unchanged since their last summary, {len(to_read)} to summarize")
+        digests = dict(to_read)
+        read = read_documents([document_path for document_path, _ in to_read], self.personality_config.reader_processes)
+        for i, document_path in enumerate(documents):
+            if document_path not in summaries:
+                # Documents are read in the order they are listed, the next one to summarize is the next one read
+                document_path, document_text, error = next(read)
+                if error is not None:
+                    self.step(f"Couldn't read {document_path.name}: {error}")
+                    continue
                 self.step_start(f"summerizing {document_path.stem}")
-                document_text = GenericDataLoader.read_file(document_path)
                 summary = self.zip_text(
                                             document_text,
                                             add_summary_formatting=self.personality_config.add_summary_formatting,
@@ -213,21 +324,37 @@ class Processor(APScript):
                                             summary_formatting_text=self.personality_config.summary_formatting_text,
                                         )
                 self.step_end(f"summerizing {document_path.stem}")
-                if self.personality_config.output_path:
-                    self.save_text(summary, Path(self.personality_config.output_path)/(document_path.stem+"_summary.txt"))
-                all_summaries +=f"\n## Summary of {document_path.stem}\n{summary}"
-                formatted_summaries +=f"{start_header_id_template}Document {i} {end_header_id_template}{separator_template}Document file name: {document_path.stem}\nSummary:\n{summary}"
-                self.set_message_content(all_summaries)
+                if store:
+                    store.set(digests[document_path], document_path.name, summary)
+            else:
+                summary = summaries[document_path]
+            if self.personality_config.output_path:
+                self.save_text(summary, Path(self.personality_config.output_path)/(document_path.stem+"_summary.txt"))
+            all_summaries +=f"\n## Summary of {document_path.stem}\n{summary}"
+            formatted_summaries +=f"{start_header_id_template}Document {i} {end_header_id_template}{separator_template}Document file name: {document_path.stem}\nSummary:\n{summary}"
+            document_summaries.append(f"Document file name: {document_path.stem}\nSummary:\n{summary}")
+            self.set_message_content(all_summaries)
         self.new_message("")        
         ASCIIColors.yellow(all_summaries)
-        summary = self.zip_text(
-                                    formatted_summaries, 
-                                    f"Fuse the following summaries into a single comprehensive document where you extract relevant information and stick to the context.",
-                                    add_summary_formatting=self.personality_config.add_global_summary_formatting,
-                                    contextual_zipping_text=self.personality_config.global_contextual_zipping_text,
-                                    summary_formatting_text=self.personality_config.global_summary_formatting_text,
-                                    
-                                )
+        fuse_instruction = f"Fuse the following summaries into a single comprehensive document where you extract relevant information and stick to the context."
+        if self.personality_config.zip_mode=="map_reduce" and len(document_summaries)>0:
+            summarizer = self.get_summarizer(
+                fuse_instruction,
+                fuse_instruction,
+                self.personality_config.global_contextual_zipping_text
+            )
+            summary = summarizer.reduce(document_summaries) if len(document_summaries)>1 else document_summaries[0]
+            if self.personality_config.add_global_summary_formatting:
+                summary = self.format_summary(summary, self.personality_config.global_summary_formatting_text)
+        else:
+            summary = self.zip_text(
+                                        formatted_summaries, 
+                                        fuse_instruction,
+                                        add_summary_formatting=self.personality_config.add_global_summary_formatting,
+                                        contextual_zipping_text=self.personality_config.global_contextual_zipping_text,
+                                        summary_formatting_text=self.personality_config.global_summary_formatting_text,
+                                        
+                                    )
         output =f"\n## Global summary\n{summary}"
         self.set_message_content(output)
         if self.personality_config.output_path:
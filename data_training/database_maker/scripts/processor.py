@@ -6,8 +6,14 @@ from lollms.prompting import LollmsContextDetails
 from pathlib import Path
 import json
 import re
+import sys
+import time
 from typing import Callable, Any
-from safe_store import parse_document, SafeStore
+from safe_store import SafeStore
+
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+sys.path.append(str(Path(__file__).parent))
+from synthesis import ChunkIndex, JsonlCheckpoint, SynthesisPipeline, parse_documents
 
 def remove_indexing_from_markdown(markdown_text):
     # Define a regular expression pattern to match numbered and hyphenated lists at the beginning of the line
@@ -19,24 +25,23 @@ def remove_indexing_from_markdown(markdown_text):
     return clean_text
 
 
+def database_exists(folder_path, i):
+    folder_path = Path(folder_path)
+    return any((folder_path/f"database_{i}{suffix}").exists() for suffix in [".json", ".jsonl", "_q.json", "_q.jsonl"])
+
+
 def find_last_file(folder_path):
     i = 0
-    while True:
-        file_name = f"database_{i}.json"
-        file_path = Path(folder_path) / file_name
-        if not file_path.exists():
-            return str(f"database_{i-1}.json")
+    while database_exists(folder_path, i):
         i += 1
+    return f"database_{i-1}.json"
 
 
 def find_available_file(folder_path):
     i = 0
-    while True:
-        file_name = f"database_{i}.json"
-        file_path = Path(folder_path) / file_name
-        if not file_path.exists():
-            return str(file_path)
+    while database_exists(folder_path, i):
         i += 1
+    return str(Path(folder_path)/f"database_{i}.json")
 
 class Processor(APScript):
     """
@@ -92,6 +97,31 @@ class Processor(APScript):
                     "value": 2,
                     "help": "The number of chunks to recover from the database",
                 },
+                {
+                    "name": "max_in_flight",
+                    "type": "int",
+                    "value": 4,
+                    "help": "The number of questions or answers generated at the same time",
+                },
+                {
+                    "name": "retrieval_batch_size",
+                    "type": "int",
+                    "value": 64,
+                    "help": "The number of questions whose data chunks are retrieved together",
+                },
+                {
+                    "name": "retrieval_mode",
+                    "type": "str",
+                    "value": "batched",
+                    "options": ["batched", "safe_store"],
+                    "help": "batched retrieves the chunks of a whole batch of questions with one matrix product, safe_store queries the vector store once per question",
+                },
+                {
+                    "name": "parser_processes",
+                    "type": "int",
+                    "value": 2,
+                    "help": "The number of processes parsing the documents ahead (0 parses them in the main process)",
+                },
                 {
                     "name": "use_enhanced_mode",
                     "type": "bool",
@@ -151,78 +181,117 @@ class Processor(APScript):
         data_folder_path = Path(self.personality_config.data_folder_path)
         if not Path(data_folder_path).exists():
             self.warning("The specified data_folder_path does not exist.")
-        document_files = [v for v in data_folder_path.iterdir()]
+            return ""
+        document_files = sorted(v for v in data_folder_path.iterdir() if v.is_file())
         self.step_start(f"Loading files")
-        for file_path in document_files:
-            document_text = parse_document(file_path)
+        self.data_store = SafeStore()
+        for file_path, document_text, error in parse_documents(document_files, self.personality_config.parser_processes):
+            if error is not None:
+                self.warning(f"Couldn't parse {file_path.name}: {error}")
+                continue
             self.data_store.add_text(file_path, document_text)
         self.step_end(f"Loading files")
-        
+        chunks = [(str(chunk_name), chunk["chunk_text"]) for chunk_name, chunk in self.data_store.chunks.items()]
+
         #processing
         if "continue" in prompt.lower():
-            try:
-                db_name = find_last_file(output_folder)
-                with open(output_folder/f"{db_name.split('.')[0]}_q.json", 'r') as file:
-                    questions_vector = json.load(file)
-            except:
-                output = "FAILED to continue from last process: "
-                self.set_message_content(output)
+            db_name = find_last_file(output_folder)
+            if db_name == "database_-1.json":
+                self.set_message_content("FAILED to continue from last process: no database found")
                 return
-            output = "### Loading questions:\n"
-            output += "\n".join(questions_vector)
         else:
-            db_name = find_available_file(output_folder)
-            output = "### Building questions:\n"
+            db_name = Path(find_available_file(output_folder)).name
+        db_stem = db_name.split('.')[0]
+        questions_checkpoint = JsonlCheckpoint(output_folder/f"{db_stem}_q.jsonl")
+        dataset = JsonlCheckpoint(output_folder/f"{db_stem}.jsonl")
+        skipped = JsonlCheckpoint(output_folder/f"{db_stem}_skipped.jsonl")
+
+        output = f"### Building {db_stem}\n"
+        last_update = [0.0]
+        def on_progress(message):
+            # Updating the message for every record would flood the ui on large datasets
+            now = time.monotonic()
+            if now - last_update[0] > 0.5:
+                last_update[0] = now
+                self.set_message_content(output + message)
+
+        if self.personality_config.retrieval_mode == "batched":
+            index = ChunkIndex([text for _, text in chunks])
+            retrieve_batch = lambda questions: index.search_batch(questions, self.personality_config.data_vectorization_nb_chunks)
+        else:
+            retrieve_batch = lambda questions: [self.data_store.recover_text(question, top_k=self.personality_config.data_vectorization_nb_chunks)[0] for question in questions]
+
+        pipeline = SynthesisPipeline(
+            self.generate_questions,
+            retrieve_batch,
+            self.answer_question,
+            self.personality_config.max_in_flight,
+            self.personality_config.retrieval_batch_size,
+            on_progress,
+            lambda ex: self.warning(f"Generation failed, it will be retried by the next run: {ex}")
+        )
+        try:
+            self.step_start(f"Building questions")
+            legacy_questions = output_folder/f"{db_stem}_q.json"
+            if legacy_questions.exists() and not questions_checkpoint.path.exists():
+                # Questions saved by the previous versions, in one block
+                with open(legacy_questions, 'r') as file:
+                    questions_vector = [(f"legacy#{i}", question) for i, question in enumerate(json.load(file))]
+            else:
+                questions_vector = pipeline.build_questions(chunks, questions_checkpoint)
+            self.step_end(f"Building questions")
+            output += f"{len(questions_vector)} questions\n"
             self.set_message_content(output)
-            # Iterate over all documents in data_folder_path
-            processed_chunks = 0
-            # Iterate over all chunks and extract text
-            questions_vector = []
-            total_chunks = len(self.data_store.chunks.items())
-            for chunk_name, chunk in self.data_store.chunks.items():
-                chunk_text = chunk["chunk_text"]
-                processed_chunks += 1
-                self.step_start(f"Processing chunk {chunk_name}: {processed_chunks}/{total_chunks}")
-                # Build the prompt text with placeholders
-                prompt_text = f"{self.config.start_header_id_template}instruction: Generate questions or tasks that delve into the specific details and information presented in the text chunks. Please do not ask questions about the form of the text, and do not mention the text itself in your questions. Make sure you format the output using Markdown with each question or task placed in a separate paragraph starting with __P__.\n{self.config.separator_template}{self.config.start_header_id_template}chunk {{chunk_name}}: {{chunk}}{self.config.separator_template}{self.config.start_header_id_template}Here are some questions and tasks to further explore the contents of the given text chunks:\n__P__"
-                # Ask AI to generate questions
-                generated_text = "__P__"+self.fast_gen(prompt_text, max_generation_size=self.personality_config.questions_gen_size, placeholders={"chunk": chunk_text, "chunk_name":chunk_name}, debug=True)
-                # Split the generated text into lines and accumulate into questions_vector
-                generated_lines = generated_text.strip().split("__P__")
-                generated_lines = [q.replace("__P__","") for q in generated_lines]
-                generated_lines = [remove_indexing_from_markdown(q) for q in generated_lines]
-                questions_vector.extend(generated_lines)
-                self.step_end(f"Processing chunk {chunk_name}: {processed_chunks}/{total_chunks}")
-                output += "\n<".join(generated_lines) + "\n"
-                self.set_message_content(output)
-            
-            self.step_start(f"Saving questions for future use")
-            with open(output_folder/f"{db_name.split('.')[0]}_q.json", 'w') as file:
-                json.dump(questions_vector, file)
-            self.step_end(f"Saving questions for future use")
-        
-        output += "### Building answers:\n"
+
+            self.step_start(f"Building answers")
+            nb_records = pipeline.build_answers(
+                questions_vector,
+                dataset,
+                skipped,
+                lambda question_id, question, answer: {
+                    "conditionning":"Act as LoLLMs expert and answer the following questions.",
+                    "question":question,
+                    "answer":answer,
+                    "id":question_id
+                }
+            )
+            self.step_end(f"Building answers")
+        finally:
+            questions_checkpoint.close()
+            dataset.close()
+            skipped.close()
+
+        # The json list is what the training tools load, it is exported once the dataset is complete
+        with open(output_folder/db_name, 'w') as file:
+            json.dump(pipeline.ordered_records(questions_vector, dataset), file)
+        output += f"{nb_records} question/answer pairs saved to {output_folder/db_name}\n"
         self.set_message_content(output)
-        qna_list=[]
-        # Perform further processing with questions_vector
-        for index, question in enumerate(questions_vector):
-            docs, sorted_similarities, document_ids = self.data_store.recover_text(question, top_k=self.personality_config.data_vectorization_nb_chunks) 
-            if self.personality_config.use_enhanced_mode:
-                self.step_start(f"Verifying RAG data_{index}")
-                prompt_text = """{self.config.start_header_id_template}chunk: {{chunk}}
+        return ""
+
+    def generate_questions(self, chunk_name, chunk_text):
+        prompt_text = f"{self.config.start_header_id_template}instruction: Generate questions or tasks that delve into the specific details and information presented in the text chunks. Please do not ask questions about the form of the text, and do not mention the text itself in your questions. Make sure you format the output using Markdown with each question or task placed in a separate paragraph starting with __P__.\n{self.config.separator_template}{self.config.start_header_id_template}chunk {{chunk_name}}: {{chunk}}{self.config.separator_template}{self.config.start_header_id_template}Here are some questions and tasks to further explore the contents of the given text chunks:\n__P__"
+        # Ask AI to generate questions
+        generated_text = "__P__"+self.fast_gen(prompt_text, max_generation_size=self.personality_config.questions_gen_size, placeholders={"chunk": chunk_text, "chunk_name":chunk_name}, callback=self.sink)
+        # Split the generated text into questions
+        generated_lines = generated_text.strip().split("__P__")
+        generated_lines = [remove_indexing_from_markdown(q.replace("__P__","")) for q in generated_lines]
+        return [q for q in generated_lines if q]
+
+    def answer_question(self, question, docs):
+        """Returns the answer to a question from its data chunks, None when they are not sufficient."""
+        if self.personality_config.use_enhanced_mode:
+            prompt_text = f"""{self.config.start_header_id_template}chunk: {{chunk}}
 {self.config.start_header_id_template}instruction: Is the information provided in the above chunk sufficient to answer the following question?
 Valid answers:
 - Yes
 - No
 {self.config.start_header_id_template}question: {{question}}
 {self.config.start_header_id_template}answer: """
-                if "yes" not in prompt_text.lower():
-                    self.step_end(f"Verifying RAG data_{index}", False)
-                    continue
-                self.step_end(f"Verifying RAG data_{index}")
+            verdict = self.fast_gen(prompt_text, max_generation_size=8, placeholders={"chunk": "\nchunk: ".join(docs), "question": question}, callback=self.sink)
+            if "yes" not in verdict.lower():
+                return None
 
-            self.step_start(f"Asking question {index}/{len(questions_vector)}")
-            prompt_text = """{self.config.start_header_id_template}chunk: {{chunk}}
+        prompt_text = f"""{self.config.start_header_id_template}chunk: {{chunk}}
 {self.config.start_header_id_template}instructions{self.config.end_header_id_template}
 Interpret the textual data contained within the chunk thoroughly to answer the corresponding instruction/task presented alongside it.
 If the information stored in this chunk does not suffice to provide categorically accurate answers, please answer exactly __UNSUFFICIENT_INFORMATION__.
@@ -232,24 +301,8 @@ It is crucial to maintain strict adherence to the content delineated in each ins
 Be precise and helpful.
 {self.config.start_header_id_template}question: {{question}}
 {self.config.start_header_id_template}answer: """
-            # {self.config.start_header_id_template}chunk: {{chunk}}{self.config.separator_template}{self.config.start_header_id_template}instruction: Please use the text chunks to answer the following question:\n{self.config.separator_template}{self.config.start_header_id_template}question: {{question}}\n{self.config.separator_template}{self.config.start_header_id_template}answer: "
-            # Ask AI to generate an answer
-            answer = self.fast_gen(prompt_text, max_generation_size=self.personality_config.answer_gen_size, placeholders={"chunk": "\nchunk: ".join(docs), "question": question})
-            if "UNSUFFICIENT_INFORMATION" in answer:
-                continue
-            qna_list.append({
-                "conditionning":"Act as LoLLMs expert and answer the following questions.",
-                "question":question,
-                "answer":answer,
-                "id":0
-            })
-            output += f"q:{question}\na:{answer}\n"
-            self.set_message_content(output)
-            self.step_end(f"Asking question {index}/{len(questions_vector)}")
-            with open(output_folder/db_name, 'w') as file:
-                json.dump(qna_list, file)
-        print("Dictionary saved as JSON successfully!")
-        return ""
-
-
-
+        # Ask AI to generate an answer
+        answer = self.fast_gen(prompt_text, max_generation_size=self.personality_config.answer_gen_size, placeholders={"chunk": "\nchunk: ".join(docs), "question": question}, callback=self.sink)
+        if "UNSUFFICIENT_INFORMATION" in answer:
+            return None
+        return answer
@@ -0,0 +1,187 @@
+"""
+Question and answer dataset synthesis.
+
+Building a fine-tuning set used to parse every document, then generate the
+questions chunk by chunk and the answers one by one, and the work was only
+saved once all the questions, then all the answers, were generated. Here:
+
+- documents are parsed ahead in a process pool, parsing pdf or docx files is
+  CPU bound;
+- questions and answers are generated with a bounded number of generations in
+  flight, and every record is appended to a JSONL file as soon as it exists, so
+  an interrupted run resumes from the last written record;
+- the chunks answering a whole batch of questions are retrieved at once, with a
+  single product of the question and chunk embedding matrices.
+"""
+import numpy as np
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Iterator, List, Optional, Tuple
+
+from zoo_common.embeddings import HashingEmbedder
+from zoo_common.jsonl_checkpoint import JsonlCheckpoint
+
+
+def parse_file(path: str) -> str:
+    """Runs in a parser process."""
+    from safe_store import parse_document
+    return parse_document(Path(path))
+
+
+def parse_documents(paths: List[Path], workers: int = 2) -> Iterator[Tuple[Path, Optional[str], Optional[Exception]]]:
+    """
+    Parses documents ahead in a process pool.
+
+    Yields:
+        (path, text, error) in the order of paths. Text is None when parsing failed.
+    """
+    if not paths:
+        return
+    if workers <= 0:
+        for path in paths:
+            try:
+                yield path, parse_file(str(path)), None
+            except Exception as ex:
+                yield path, None, ex
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(parse_file, str(path)) for path in paths]
+        for path, future in zip(paths, futures):
+            try:
+                yield path, future.result(), None
+            except Exception as ex:
+                yield path, None, ex
+
+
+class ChunkIndex:
+    """Embeddings of the data chunks, searched for a whole batch of questions at once."""
+    def __init__(self, chunks: List[str], embed: Optional[Callable[[str], np.ndarray]] = None) -> None:
+        self.chunks = chunks
+        self.embed = embed or HashingEmbedder()
+        self.matrix = self._embed_all(chunks)
+
+    def _embed_all(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, 1), dtype=np.float32)
+        matrix = np.stack([np.asarray(self.embed(text), dtype=np.float32) for text in texts])
+        matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        return matrix
+
+    def search_batch(self, queries: List[str], top_k: int) -> List[List[str]]:
+        """The top_k closest chunks of each query, best first."""
+        if not queries or not self.chunks:
+            return [[] for _ in queries]
+        scores = self._embed_all(queries) @ self.matrix.T
+        top_k = min(top_k, len(self.chunks))
+        top = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+        results = []
+        for row, indices in zip(scores, top):
+            indices = indices[np.argsort(-row[indices])]
+            results.append([self.chunks[i] for i in indices])
+        return results
+
+
+class SynthesisPipeline:
+    """
+    Args:
+        generate_questions: Generates the questions of a (chunk name, chunk text) pair.
+        retrieve_batch: Returns the chunks answering each question of a batch.
+        answer: Answers a question from its chunks, None when the chunks are not sufficient.
+        max_in_flight: Number of generations running at the same time.
+        batch_size: Number of questions retrieved together.
+        on_progress: Called with a message after each record.
+        on_error: Called with the exception of a failed generation.
+    """
+    def __init__(self, generate_questions: Callable[[str, str], List[str]], retrieve_batch: Callable[[List[str]], List[List[str]]],
+                 answer: Callable[[str, List[str]], Optional[str]], max_in_flight: int = 4, batch_size: int = 64,
+                 on_progress: Optional[Callable[[str], None]] = None, on_error: Optional[Callable[[Exception], None]] = None) -> None:
+        self.generate_questions = generate_questions
+        self.retrieve_batch = retrieve_batch
+        self.answer = answer
+        self.max_in_flight = max(1, max_in_flight)
+        self.batch_size = max(1, batch_size)
+        self.on_progress = on_progress or (lambda text: None)
+        self.on_error = on_error or (lambda ex: None)
+
+    def _run_bounded(self, jobs: Iterator[tuple], function: Callable) -> Iterator[tuple]:
+        """
+        Runs function(*job) with at most max_in_flight jobs running.
+
+        Yields:
+            (job, result) as the jobs complete. A failed job is reported and not yielded,
+            having no record it is run again by the next run.
+        """
+        def completed(done, running):
+            for future in done:
+                job = running.pop(future)
+                try:
+                    yield job, future.result()
+                except Exception as ex:
+                    self.on_error(ex)
+
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+            running = {}
+            for job in jobs:
+                if len(running) >= self.max_in_flight:
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    yield from completed(done, running)
+                running[executor.submit(function, *job)] = job
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                yield from completed(done, running)
+
+    def build_questions(self, chunks: List[Tuple[str, str]], checkpoint: JsonlCheckpoint) -> List[Tuple[str, str]]:
+        """
+        Generates the questions of the chunks that have no record in the checkpoint.
+
+        Returns:
+            All the (question id, question) pairs, in chunk order. The id of a question is
+            its chunk name and its rank in the chunk, so it doesn't depend on the other chunks.
+        """
+        questions = {record["chunk"]: record["questions"] for record in checkpoint.load()}
+        pending = [(name, text) for name, text in chunks if name not in questions]
+        if len(questions):
+            self.on_progress(f"Resuming questions: {len(questions)}/{len(chunks)} chunks already processed")
+        for (name, _), generated in self._run_bounded(iter(pending), self.generate_questions):
+            questions[name] = generated
+            checkpoint.append({"chunk": name, "questions": generated})
+            self.on_progress(f"Questions: {len(questions)}/{len(chunks)} chunks")
+        return [(f"{name}#{i}", question) for name, _ in chunks for i, question in enumerate(questions.get(name, []))]
+
+    def build_answers(self, questions: List[Tuple[str, str]], dataset: JsonlCheckpoint, skipped: JsonlCheckpoint, record: Callable[[str, str, str], dict]) -> int:
+        """
+        Answers the (question id, question) pairs that have no record in the dataset or skipped checkpoints.
+
+        Returns:
+            The number of records of the dataset.
+        """
+        done = {entry["id"] for entry in dataset.load()}
+        nb_records = len(done)
+        done |= {entry["id"] for entry in skipped.load()}
+        pending = [(question_id, question) for question_id, question in questions if question_id not in done]
+        nb_processed = len(questions) - len(pending)
+        if nb_processed:
+            self.on_progress(f"Resuming answers: {nb_processed}/{len(questions)} questions already processed")
+
+        def jobs():
+            # Retrieval of the next batch only happens once the window needs more questions
+            for start in range(0, len(pending), self.batch_size):
+                batch = pending[start:start + self.batch_size]
+                for (question_id, question), docs in zip(batch, self.retrieve_batch([question for _, question in batch])):
+                    yield question_id, question, docs
+
+        for (question_id, question, _), answer in self._run_bounded(jobs(), lambda question_id, question, docs: self.answer(question, docs)):
+            nb_processed += 1
+            if answer is None:
+                skipped.append({"id": question_id})
+            else:
+                dataset.append(record(question_id, question, answer))
+                nb_records += 1
+            self.on_progress(f"Answers: {nb_processed}/{len(questions)} questions, {nb_records} records")
+        return nb_records
+
+    @staticmethod
+    def ordered_records(questions: List[Tuple[str, str]], dataset: JsonlCheckpoint) -> List[dict]:
+        """The dataset records in question order rather than in completion order."""
+        rank = {question_id: i for i, (question_id, _) in enumerate(questions)}
+        return sorted(dataset.load(), key=lambda entry: rank.get(entry["id"], len(rank)))
@@ -0,0 +1,150 @@
+"""
+Evaluation helpers for the llm tester.
+
+Answers and judgements are appended to a jsonl checkpoint as soon as they are
+produced, so an interrupted run resumes where it stopped. Answers that match a
+reference once normalized are scored without asking the judge, and the other
+answers to a prompt are judged together in a single call.
+"""
+import re
+import json
+import string
+import hashlib
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from zoo_common.jsonl_checkpoint import JsonlCheckpoint
+
+_ARTICLES_RE = re.compile(r"\b(a|an|the)\b")
+_SPACES_RE = re.compile(r"\s+")
+_PUNCTUATION = str.maketrans("", "", string.punctuation)
+
+
+def model_key(model: dict) -> str:
+    return f'answer_{model["binding"]}_{model["model"]}'
+
+
+def normalize_answer(text: str) -> str:
+    """Lower case, no punctuation, no articles and single spaces."""
+    text = text.lower().translate(_PUNCTUATION)
+    text = _ARTICLES_RE.sub(" ", text)
+    return _SPACES_RE.sub(" ", text).strip()
+
+
+def fast_match(answer: str, true_answers: List[dict]) -> Optional[float]:
+    """Returns the value of the first reference equal to the answer once normalized, None when the judge is needed."""
+    normalized = normalize_answer(answer)
+    if not normalized:
+        return None
+    for true_answer in true_answers:
+        if normalize_answer(true_answer["text"]) == normalized:
+            return true_answer["value"]
+    return None
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    rank = (len(values) - 1) * p / 100
+    low = int(rank)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+def build_judge_prompt(prompt: str, true_answers: List[dict], candidates: List[Tuple[str, str]]) -> str:
+    """Asks which reference answer, if any, each candidate answer matches."""
+    lines = [f"prompt:\n{prompt}", "reference answers:"]
+    lines += [f"{i}: {true_answer['text']}" for i, true_answer in enumerate(true_answers)]
+    lines.append("candidate answers:")
+    lines += [f"{label}:\n{answer}" for label, answer in candidates]
+    lines += [
+        "For each candidate answer, give the number of the first reference answer giving the same information, or -1 if none does.",
+        "Answer only with a json object mapping each candidate label to a number, for example:",
+        "```json",
+        json.dumps({label: 0 for label, _ in candidates[:2]}),
+        "```",
+    ]
+    return "\n".join(lines)
+
+
+def parse_judgement(text: str, labels: List[str], nb_true_answers: int) -> Optional[Dict[str, int]]:
+    """Reads the judge answer, None when it is not usable."""
+    match = re.search(r"\{.*\}", text, re.DOTALL)
+    if not match:
+        return None
+    try:
+        data = json.loads(match.group(0))
+    except json.JSONDecodeError:
+        return None
+    result = {}
+    for label in labels:
+        try:
+            index = int(data[label])
+        except (KeyError, TypeError, ValueError):
+            return None
+        result[label] = index if 0 <= index < nb_true_answers else -1
+    return result
+
+
+class Checkpoint:
+    """
+    Append only jsonl log of a test run.
+
+    The first line identifies the test file, a checkpoint written for another test file is discarded.
+    """
+    def __init__(self, path: Path, test_file_path: Path) -> None:
+        self.path = Path(path)
+        self.run_id = hashlib.sha256(Path(test_file_path).read_bytes()).hexdigest()
+        self.answers: Dict[Tuple[str, int], dict] = {}
+        self.judgements: Dict[Tuple[str, int], dict] = {}
+        self.log = JsonlCheckpoint(self.path)
+        if not self.load():
+            self.log.append({"type": "run", "test_file": self.run_id})
+
+    def load(self) -> bool:
+        """Loads the records of a previous run of the same test file, returns False when there is none."""
+        records = self.log.load()
+        if not records or records[0].get("type") != "run" or records[0].get("test_file") != self.run_id:
+            self.log.clear()
+            return False
+        for record in records[1:]:
+            key = (record["model"], record["prompt_id"])
+            if record["type"] == "answer":
+                self.answers[key] = record
+            elif record["type"] == "judgement":
+                self.judgements[key] = record
+        return True
+
+    def add_answer(self, model: str, prompt_id: int, answer: str, seconds: float, nb_tokens: int) -> dict:
+        record = {"type": "answer", "model": model, "prompt_id": prompt_id, "answer": answer, "seconds": seconds, "nb_tokens": nb_tokens}
+        self.answers[(model, prompt_id)] = record
+        self.log.append(record)
+        return record
+
+    def add_judgement(self, model: str, prompt_id: int, val: float, method: str) -> dict:
+        record = {"type": "judgement", "model": model, "prompt_id": prompt_id, "val": val, "method": method}
+        self.judgements[(model, prompt_id)] = record
+        self.log.append(record)
+        return record
+
+    def close(self) -> None:
+        self.log.close()
+
+
+def model_stats(checkpoint: Checkpoint, model: str, nb_prompts: int) -> dict:
+    """Score and throughput of a model."""
+    answers = [checkpoint.answers[(model, i)] for i in range(nb_prompts) if (model, i) in checkpoint.answers]
+    judgements = [checkpoint.judgements[(model, i)] for i in range(nb_prompts) if (model, i) in checkpoint.judgements]
+    latencies = [a["seconds"] for a in answers]
+    speeds = [a["nb_tokens"] / a["seconds"] for a in answers if a["seconds"] > 0]
+    return {
+        "score": 100 * sum(j["val"] for j in judgements) / nb_prompts if nb_prompts else 0,
+        "judged_without_llm": sum(1 for j in judgements if j["method"] == "exact"),
+        "latency_p50": percentile(latencies, 50),
+        "latency_p90": percentile(latencies, 90),
+        "latency_p99": percentile(latencies, 99),
+        "tokens_per_second_p50": percentile(speeds, 50),
+        "tokens_per_second_p10": percentile(speeds, 10),
+        "tokens_per_second_p90": percentile(speeds, 90),
+    }
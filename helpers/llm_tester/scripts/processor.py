@@ -11,7 +11,14 @@ from lollms.personality import APScript, AIPersonality
 from lollms.prompting import LollmsContextDetails
 import subprocess
 import json
+import time
+import sys
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Callable, Any
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+sys.path.append(str(Path(__file__).parent))
+from evaluation import Checkpoint, build_judge_prompt, fast_match, model_key, model_stats, parse_judgement
 
 # Helper functions
 class Processor(APScript):
@@ -40,6 +47,10 @@ class Processor(APScript):
                 {"name":"output_file_path","type":"str","value":"", "help":"Path tp the output file to create"},
                 {"name":"models_to_test","type":"str","value":"open_ai::gpt-4o,open_ai::gpt-4-turbo-preview", "help":"List of coma separated models to test in format binding_name::model_name"},
                 {"name":"master_model","type":"str","value":"open_ai::gpt-4o", "help":"A single powerful model in format binding_name::model_name which is going to judge the other models based on the human test file. This model will just compare the output of the model and the human provided answer."},
+                {"name":"concurrent_requests","type":"int","value":4, "help":"Number of prompts sent at the same time to the tested model and to the judge. Set it to 1 for bindings that serve a single request at a time."},
+                {"name":"max_answer_size","type":"int","value":1024, "help":"Maximum number of tokens of each tested model answer"},
+                {"name":"judge_batch_size","type":"int","value":4, "help":"Number of answers to the same prompt judged in a single call to the master model (at most 26)"},
+                {"name":"resume_from_checkpoint","type":"bool","value":True, "help":"Answers and judgements are saved next to the output file as they are produced. When enabled, a run on the same test file resumes from them instead of starting over."},
             ]
             )
         personality_config_vals = BaseConfig.from_template(personality_config_template)
@@ -80,6 +91,83 @@ class Processor(APScript):
             model_answer = [f'answer_{model_to_test["binding"]}_{model_to_test["model"]}']
             return self.yes_no("Are these two answers similar?",f"prompt:\n{prompt}\nanswer 1:\n{true_answer}\nanswer 2:\n{model_answer}")
     
+    def test_model(self, model, prompts, checkpoint:Checkpoint):
+        """Sends the prompts the model did not answer yet, concurrent_requests at a time, and logs the answers."""
+        key = model_key(model)
+        todo = [prompt_id for prompt_id in range(len(prompts)) if (key, prompt_id) not in checkpoint.answers]
+        if len(todo)==0:
+            self.step(f'Model {model["binding"]}::{model["model"]} already answered all prompts')
+            return
+        self.step_start(f'Started testing model {model["binding"]}::{model["model"]}')
+        self.select_model(model["binding"], model["model"])
+        handle = self.personality.model
+
+        def run(prompt_id):
+            reworked_prompt = f"{self.system_full_header}{self.ai_custom_header('assistant')}Hi I am assistant and I am here to help you.{self.ai_custom_header('prompt')}{prompts[prompt_id]['prompt']}{self.config.separator_template}{self.ai_custom_header('assistant')}"
+            start = time.perf_counter()
+            answer = handle.generate(reworked_prompt, self.personality_config.max_answer_size, callback=self.sink)
+            seconds = time.perf_counter() - start
+            return prompt_id, answer, seconds, len(handle.tokenize(answer))
+
+        with ThreadPoolExecutor(max_workers=max(1, self.personality_config.concurrent_requests)) as executor:
+            futures = [executor.submit(run, prompt_id) for prompt_id in todo]
+            for n, future in enumerate(as_completed(futures)):
+                prompt_id, answer, seconds, nb_tokens = future.result()
+                checkpoint.add_answer(key, prompt_id, answer, seconds, nb_tokens)
+                self.step(f'Prompt {prompt_id+1} answered by {model["model"]} in {seconds:.1f}s ({n+1}/{len(todo)})')
+        self.step_end(f'Started testing model {model["binding"]}::{model["model"]}')
+
+    def judge_models(self, prompts, models_list, checkpoint:Checkpoint):
+        """Scores the answers that were not judged yet, several answers to the same prompt per call."""
+        batch_size = min(max(1, self.personality_config.judge_batch_size), 26)
+        jobs = []
+        for prompt_id, prompt_entry in enumerate(prompts):
+            pending = []
+            for model in models_list:
+                key = model_key(model)
+                if (key, prompt_id) in checkpoint.judgements:
+                    continue
+                # Answers identical to a reference once normalized need no judge
+                val = fast_match(checkpoint.answers[(key, prompt_id)]["answer"], prompt_entry["answers"])
+                if val is not None:
+                    checkpoint.add_judgement(key, prompt_id, val, "exact")
+                else:
+                    pending.append(key)
+            jobs += [(prompt_id, pending[i:i+batch_size]) for i in range(0, len(pending), batch_size)]
+        if len(jobs)==0:
+            return
+        handle = self.personality.model
+
+        def judge(job):
+            prompt_id, keys = job
+            true_answers = prompts[prompt_id]["answers"]
+            labels = [chr(ord("A")+i) for i in range(len(keys))]
+            candidates = [(label, checkpoint.answers[(key, prompt_id)]["answer"]) for label, key in zip(labels, keys)]
+            judge_prompt = f"{self.system_full_header}{build_judge_prompt(prompts[prompt_id]['prompt'], true_answers, candidates)}{self.ai_custom_header('assistant')}"
+            matches = parse_judgement(handle.generate(judge_prompt, 32+16*len(keys), callback=self.sink), labels, len(true_answers))
+            return job, (None if matches is None else [(key, matches[label]) for label, key in zip(labels, keys)])
+
+        failed = []
+        with ThreadPoolExecutor(max_workers=max(1, self.personality_config.concurrent_requests)) as executor:
+            for job, matches in executor.map(judge, jobs):
+                if matches is None:
+                    failed.append(job)
+                    continue
+                true_answers = prompts[job[0]]["answers"]
+                for key, index in matches:
+                    checkpoint.add_judgement(key, job[0], true_answers[index]['value'] if index>=0 else 0, "llm")
+        # Unreadable batched judgements are asked again one answer at a time
+        for prompt_id, keys in failed:
+            prompt = prompts[prompt_id]["prompt"]
+            for key in keys:
+                model_answer = checkpoint.answers[(key, prompt_id)]["answer"]
+                val = 0
+                for true_answer in prompts[prompt_id]["answers"]:
+                    if self.yes_no("Is the second answer giving the same information as the first one?",f"prompt:\n{prompt}\nanswer 1:\n{true_answer['text']}\nanswer 2:\n{model_answer}"):
+                        val = true_answer['value']
+                        break
+                checkpoint.add_judgement(key, prompt_id, val, "llm")
+
     def start_testing(self, prompt="", full_context="", client=None):
         self.new_message("")
         msg =[]
@@ -105,52 +193,47 @@ class Processor(APScript):
         with open(self.personality_config.test_file_path,"r",encoding="utf-8", errors="ignore") as f:
             prompts = json.load(f)
 
+        checkpoint_path = Path(self.personality_config.output_file_path).with_suffix(".checkpoint.jsonl")
+        if not self.personality_config.resume_from_checkpoint and checkpoint_path.exists():
+            checkpoint_path.unlink()
+        checkpoint = Checkpoint(checkpoint_path, self.personality_config.test_file_path)
+        if len(checkpoint.answers)>0:
+            self.step(f"Resuming from {len(checkpoint.answers)} saved answers and {len(checkpoint.judgements)} saved judgements")
+
         previous_binding = self.personality.config["binding_name"]
         previous_model = self.personality.config["model_name"]
-        for model in models_list:
-            self.step_start(f'Started testing model {model["binding"]}::{model["model"]}')
-            self.select_model(model["binding"], model["model"])
-            nb_prompts = len(prompts)
-            for prompt_id, prompt in enumerate(prompts):
-                self.step_start(f'Testing prompt {prompt_id+1}/{nb_prompts} for model {model["model"]}')
-                reworked_prompt = f"{self.system_full_header}{self.ai_custom_header('assistant')}Hi I am assistant and I am here to help you.{self.ai_custom_header('prompt')}{prompt['prompt']}{self.config.separator_template}{self.ai_custom_header('assistant')}"
-                answer = self.fast_gen(reworked_prompt, callback=self.sink)
-                prompt[f'answer_{model["binding"]}_{model["model"]}']={
-                    "answer":answer,
-                    "val":0
-                }
-                self.step_end(f'Testing prompt {prompt_id+1}/{nb_prompts} for model {model["model"]}')
-            self.step_end(f'Started testing model {model["binding"]}::{model["model"]}')
-
-        self.step_start(f'Loading master model {master_model["binding"]}::{master_model["model"]}')
-        self.select_model(master_model["binding"], master_model["model"])
-        self.step_end(f'Loading master model {master_model["binding"]}::{master_model["model"]}')
-        self.step_start(f'Judging models')
-        for prompt_entry in prompts:
-            prompt = prompt_entry["prompt"]
-            true_answers=prompt_entry["answers"]
-            for model_to_test in models_list:
-                for true_answer in true_answers:
-                    model_infos = prompt_entry[f'answer_{model_to_test["binding"]}_{model_to_test["model"]}']
-                    model_answer = model_infos["answer"]
-                    if self.yes_no("Is the second answer giving the same information as the first one?",f"prompt:\n{prompt}\nanswer 1:\n{true_answer['text']}\nanswer 2:\n{model_answer}"):
-                        model_infos["val"]=true_answer['value']
-                        break
-        self.step_end(f'Judging models')
+        try:
+            for model in models_list:
+                self.test_model(model, prompts, checkpoint)
+
+            self.step_start(f'Loading master model {master_model["binding"]}::{master_model["model"]}')
+            self.select_model(master_model["binding"], master_model["model"])
+            self.step_end(f'Loading master model {master_model["binding"]}::{master_model["model"]}')
+            self.step_start(f'Judging models')
+            self.judge_models(prompts, models_list, checkpoint)
+            self.step_end(f'Judging models')
+        finally:
+            checkpoint.close()
+            self.step(f'Back to model {previous_binding}::{previous_model}')
+            self.select_model(previous_binding, previous_model)
 
-        self.step(f'Back to model {model["binding"]}::{model["model"]}')
-        self.select_model(previous_binding, previous_model)
         self.step_start(f'Giving a mark for each AI')
+        for prompt_id, prompt_entry in enumerate(prompts):
+            for model in models_list:
+                key = model_key(model)
+                prompt_entry[key]={
+                    "answer":checkpoint.answers[(key, prompt_id)]["answer"],
+                    "val":checkpoint.judgements[(key, prompt_id)]["val"]
+                }
         results={
             "prompts":prompts,
-            "results":{}
+            "results":{},
+            "stats":{}
         }
         for model in models_list:
-            results["results"][f'answer_{model["binding"]}_{model["model"]}'] = 0
-            for prompt in prompts:
-                results["results"][f'answer_{model["binding"]}_{model["model"]}'] += prompt[f'answer_{model["binding"]}_{model["model"]}']["val"]
-            results["results"][f'answer_{model["binding"]}_{model["model"]}'] /= len(prompts)
-            results["results"][f'answer_{model["binding"]}_{model["model"]}'] *= 100
+            key = model_key(model)
+            results["stats"][key] = model_stats(checkpoint, key, len(prompts))
+            results["results"][key] = results["stats"][key]["score"]
 
         self.step_end(f'Giving a mark for each AI')
 
@@ -159,7 +242,10 @@ class Processor(APScript):
             json.dump(results, f, indent=4)
         
         self.step_end(f'Saving test results')
-        self.set_message_content("Done testing.\nFinal results:\n"+"\n".join([f"{k}: {v}% correct answers." for k,v in results["results"].items()])+f"\nThe details can be found in the generated file on your pc at {self.personality_config.output_file_path}")
+        report = ["| model | correct answers | judged without LLM | latency p50/p90/p99 (s) | tokens/s p10/p50/p90 |", "|---|---|---|---|---|"]
+        for key, stats in results["stats"].items():
+            report.append(f'| {key} | {stats["score"]:.1f}% | {stats["judged_without_llm"]} | {stats["latency_p50"]:.2f} / {stats["latency_p90"]:.2f} / {stats["latency_p99"]:.2f} | {stats["tokens_per_second_p10"]:.1f} / {stats["tokens_per_second_p50"]:.1f} / {stats["tokens_per_second_p90"]:.1f} |')
+        self.set_message_content("Done testing.\nFinal results:\n"+"\n".join(report)+f"\n\nThe details can be found in the generated file on your pc at {self.personality_config.output_file_path}")
     
     def add_file(self, path, client, callback=None):
         """
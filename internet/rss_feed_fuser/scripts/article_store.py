@@ -0,0 +1,121 @@
+"""
+Persistent state of the RSS fuser pipeline.
+
+Articles are keyed by their link and the hash of their title and description.
+The store remembers the converted page text, the AI similarity decisions and
+the summary of every theme, so that a new run only works on what changed and an
+interrupted run restarts after the last summarized theme.
+"""
+import json
+import time
+import hashlib
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+from zoo_common.sqlite_database import SQLiteDatabase
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS articles (
+    link TEXT PRIMARY KEY,
+    content_hash TEXT NOT NULL,
+    title TEXT,
+    description TEXT,
+    media_thumbnail TEXT,
+    thumbnail_html TEXT,
+    page_text TEXT,
+    first_seen REAL,
+    last_seen REAL
+);
+CREATE TABLE IF NOT EXISTS pair_decisions (
+    hash_a TEXT NOT NULL,
+    hash_b TEXT NOT NULL,
+    similar INTEGER NOT NULL,
+    PRIMARY KEY (hash_a, hash_b)
+);
+CREATE TABLE IF NOT EXISTS theme_summaries (
+    signature TEXT PRIMARY KEY,
+    summary TEXT NOT NULL,
+    created_at REAL
+);
+"""
+
+
+def content_hash(article: dict) -> str:
+    text = f"{article.get('title', '')}\n{article.get('description', '')}"
+    return hashlib.sha256(text.encode("utf8")).hexdigest()
+
+
+def theme_signature(hashes: Iterable[str]) -> str:
+    """Identifies a theme by the content of its articles, independently of their order."""
+    return hashlib.sha256("\n".join(sorted(hashes)).encode("utf8")).hexdigest()
+
+
+class ArticleStore(SQLiteDatabase):
+    """Each lollms message runs on its own thread, the base class gives every thread its own connection."""
+    migrations = [SCHEMA]
+
+    def __init__(self, db_path: Path) -> None:
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        super().__init__(db_path)
+
+    def upsert_articles(self, articles: List[dict]) -> List[dict]:
+        """
+        Records the current feed entries.
+
+        Returns:
+            The entries that are new or whose title/description changed since the last run.
+        """
+        now = time.time()
+        changed = []
+        with self.transaction() as cursor:
+            for article in articles:
+                digest = content_hash(article)
+                row = cursor.execute("SELECT content_hash FROM articles WHERE link=?", (article["link"],)).fetchone()
+                if row is not None and row[0] == digest:
+                    cursor.execute("UPDATE articles SET last_seen=? WHERE link=?", (now, article["link"]))
+                    continue
+                # A changed entry loses its converted page text so that it is reloaded
+                cursor.execute(
+                    "INSERT OR REPLACE INTO articles (link, content_hash, title, description, media_thumbnail, thumbnail_html, page_text, first_seen, last_seen) "
+                    "VALUES (?, ?, ?, ?, ?, ?, NULL, COALESCE((SELECT first_seen FROM articles WHERE link=?), ?), ?)",
+                    (
+                        article["link"], digest, article.get("title", ""), article.get("description", ""),
+                        json.dumps(article.get("media_thumbnail", [])), article.get("thumbnail_html", ""),
+                        article["link"], now, now,
+                    ),
+                )
+                changed.append(article)
+        return changed
+
+    def get_thumbnail_html(self, link: str, digest: str) -> Optional[str]:
+        """Returns the thumbnail html of an unchanged article, or None if it has to be rebuilt."""
+        row = self.fetchone("SELECT thumbnail_html FROM articles WHERE link=? AND content_hash=?", (link, digest))
+        return row[0] if row else None
+
+    def get_content_hash(self, link: str) -> Optional[str]:
+        row = self.fetchone("SELECT content_hash FROM articles WHERE link=?", (link,))
+        return row[0] if row else None
+
+    def get_page_text(self, link: str) -> Optional[str]:
+        row = self.fetchone("SELECT page_text FROM articles WHERE link=?", (link,))
+        return row[0] if row else None
+
+    def set_page_text(self, link: str, text: str) -> None:
+        self.write("UPDATE articles SET page_text=? WHERE link=?", (text, link))
+
+    def get_decision(self, hash_a: str, hash_b: str) -> Optional[bool]:
+        hash_a, hash_b = sorted((hash_a, hash_b))
+        row = self.fetchone("SELECT similar FROM pair_decisions WHERE hash_a=? AND hash_b=?", (hash_a, hash_b))
+        return None if row is None else bool(row[0])
+
+    def set_decision(self, hash_a: str, hash_b: str, similar: bool) -> None:
+        hash_a, hash_b = sorted((hash_a, hash_b))
+        self.write("INSERT OR REPLACE INTO pair_decisions (hash_a, hash_b, similar) VALUES (?, ?, ?)", (hash_a, hash_b, int(similar)))
+
+    def get_summary(self, signature: str) -> Optional[str]:
+        row = self.fetchone("SELECT summary FROM theme_summaries WHERE signature=?", (signature,))
+        return row[0] if row else None
+
+    def set_summary(self, signature: str, summary: str) -> None:
+        # Committed right away: this is the checkpoint an interrupted run resumes from
+        self.write("INSERT OR REPLACE INTO theme_summaries (signature, summary, created_at) VALUES (?, ?, ?)", (signature, summary, time.time()))
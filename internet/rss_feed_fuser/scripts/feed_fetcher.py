@@ -0,0 +1,196 @@
+"""
+Concurrent RSS fetching layer.
+
+Feeds are downloaded through a bounded thread pool sharing one requests session
+whose adapter keeps a connection pool per host. Each feed's ETag/Last-Modified
+validators are remembered on disk so that unchanged feeds are answered with a
+304 and skipped. Favicons are resolved once per netloc and kept in a persistent
+cache with a TTL and LRU eviction.
+"""
+import json
+import time
+import hashlib
+import threading
+from pathlib import Path
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+from urllib.parse import urljoin, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from bs4 import BeautifulSoup
+
+
+def build_session(max_workers: int) -> requests.Session:
+    """Creates a session that keeps up to max_workers connections alive per host."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["User-Agent"] = "lollms-rss-feed-fuser"
+    return session
+
+
+class FeedFetchResult:
+    def __init__(self, url: str, content: Optional[bytes], changed: bool, error: Optional[str] = None) -> None:
+        self.url = url
+        self.content = content
+        self.changed = changed
+        self.error = error
+
+
+class FeedFetcher:
+    """
+    Fetches feeds concurrently using conditional GET.
+
+    The last body of every feed is stored next to its validators so that a feed
+    answered with 304 can still be parsed if the caller needs its entries.
+    """
+    def __init__(self, cache_folder: Path, max_workers: int = 8, timeout: float = 10, session: Optional[requests.Session] = None) -> None:
+        self.cache_folder = Path(cache_folder)
+        self.cache_folder.mkdir(parents=True, exist_ok=True)
+        self.max_workers = max(1, max_workers)
+        self.timeout = timeout
+        self.session = session or build_session(self.max_workers)
+        self.state_path = self.cache_folder / "feeds_state.json"
+        self.lock = threading.Lock()
+        self.state: Dict[str, dict] = {}
+        if self.state_path.exists():
+            try:
+                self.state = json.loads(self.state_path.read_text(encoding="utf8"))
+            except (OSError, ValueError):
+                self.state = {}
+
+    def _body_path(self, url: str) -> Path:
+        return self.cache_folder / (hashlib.sha1(url.encode("utf8")).hexdigest() + ".xml")
+
+    def fetch(self, url: str) -> FeedFetchResult:
+        with self.lock:
+            validators = dict(self.state.get(url, {}))
+        body_path = self._body_path(url)
+        headers = {}
+        if body_path.exists():
+            if validators.get("etag"):
+                headers["If-None-Match"] = validators["etag"]
+            if validators.get("last_modified"):
+                headers["If-Modified-Since"] = validators["last_modified"]
+        try:
+            response = self.session.get(url, headers=headers, timeout=self.timeout)
+        except requests.RequestException as ex:
+            return FeedFetchResult(url, None, False, str(ex))
+
+        if response.status_code == 304:
+            return FeedFetchResult(url, body_path.read_bytes(), False)
+        if response.status_code != 200:
+            return FeedFetchResult(url, None, False, f"HTTP {response.status_code}")
+
+        body_path.write_bytes(response.content)
+        with self.lock:
+            self.state[url] = {
+                "etag": response.headers.get("ETag", ""),
+                "last_modified": response.headers.get("Last-Modified", ""),
+                "fetched_at": time.time(),
+            }
+        return FeedFetchResult(url, response.content, True)
+
+    def fetch_all(self, urls: List[str]) -> List[FeedFetchResult]:
+        """Fetches all the urls concurrently and returns the results in the same order."""
+        if not urls:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(urls))) as executor:
+            results = list(executor.map(self.fetch, urls))
+        self.save()
+        return results
+
+    def save(self) -> None:
+        with self.lock:
+            data = json.dumps(self.state, indent=4)
+        self.state_path.write_text(data, encoding="utf8")
+
+
+class FaviconCache:
+    """
+    Persistent netloc -> favicon url cache with a time to live and LRU eviction.
+
+    Failed lookups are cached as empty strings so that unreachable sites are not
+    retried before their entry expires. Concurrent lookups of the same netloc
+    only hit the network once.
+    """
+    def __init__(self, path: Path, ttl: float = 7 * 24 * 3600, max_entries: int = 512) -> None:
+        self.path = Path(path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.key_locks: Dict[str, threading.Lock] = {}
+        self.entries: "OrderedDict[str, dict]" = OrderedDict()
+        if self.path.exists():
+            try:
+                data = json.loads(self.path.read_text(encoding="utf8"))
+                for key, value in sorted(data.items(), key=lambda kv: kv[1].get("last_access", 0)):
+                    self.entries[key] = value
+            except (OSError, ValueError):
+                self.entries = OrderedDict()
+
+    def _lookup(self, netloc: str) -> Optional[str]:
+        with self.lock:
+            entry = self.entries.get(netloc)
+            if entry is None:
+                return None
+            if time.time() - entry["fetched_at"] > self.ttl:
+                del self.entries[netloc]
+                return None
+            entry["last_access"] = time.time()
+            self.entries.move_to_end(netloc)
+            return entry["url"]
+
+    def _store(self, netloc: str, url: str) -> None:
+        with self.lock:
+            now = time.time()
+            self.entries[netloc] = {"url": url, "fetched_at": now, "last_access": now}
+            self.entries.move_to_end(netloc)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def get(self, netloc: str, resolver: Callable[[str], str]) -> str:
+        """Returns the cached favicon url of netloc, calling resolver(netloc) on a miss."""
+        url = self._lookup(netloc)
+        if url is not None:
+            return url
+        with self.lock:
+            key_lock = self.key_locks.setdefault(netloc, threading.Lock())
+        with key_lock:
+            url = self._lookup(netloc)
+            if url is not None:
+                return url
+            try:
+                url = resolver(netloc) or ""
+            except Exception:
+                url = ""
+            self._store(netloc, url)
+            return url
+
+    def save(self) -> None:
+        with self.lock:
+            data = json.dumps(self.entries, indent=4)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.write_text(data, encoding="utf8")
+
+
+def find_favicon(session: requests.Session, site_url: str, timeout: float = 3) -> str:
+    """Loads a site homepage and returns the absolute url of its declared icon, or an empty string."""
+    response = session.get(site_url, timeout=timeout)
+    if response.status_code != 200:
+        return ""
+    soup = BeautifulSoup(response.text, "html.parser")
+    favicon = soup.find("link", rel="icon") or soup.find("link", rel="shortcut icon")
+    if not favicon or not favicon.get("href"):
+        return ""
+    return urljoin(site_url + "/", favicon["href"])
+
+
+def site_root(link: str) -> str:
+    parsed = urlparse(link)
+    if not parsed.netloc:
+        return ""
+    return f"{parsed.scheme or 'https'}://{parsed.netloc}"
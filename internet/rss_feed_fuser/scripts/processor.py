@@ -31,7 +31,14 @@ from ascii_colors import trace_exception
 
 from urllib.parse import urlparse
 
-from docling.document_converter import DocumentConverter
+import sys
+sys.path.append(str(Path(__file__).parent))
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+from zoo_common.document_conversion import get_document_conversion_service
+from article_clustering import cluster_articles
+from feed_fetcher import FeedFetcher, FaviconCache, find_favicon, site_root
+from article_store import ArticleStore, content_hash, theme_signature
+from concurrent.futures import ThreadPoolExecutor
 
 if not pm.is_installed("feedparser"):
    pm.is_installed("feedparser")
@@ -59,10 +66,17 @@ class Processor(APScript):
             [
                 {"name":"output_folder","type":"str","value":"", "help":"The folder where all the files will be stored"},
                 {"name":"nb_rss_feeds_per_source","type":"int","value":5, "help":"the maximum number of rss feed pages to search"},
+                {"name":"fetch_workers","type":"int","value":8, "help":"The number of feeds and favicons downloaded in parallel"},
+                {"name":"favicon_cache_ttl_hours","type":"int","value":168, "help":"How long (in hours) a website favicon is kept in cache before being looked up again"},
+                {"name":"favicon_cache_max_entries","type":"int","value":512, "help":"The maximum number of websites kept in the favicon cache (least recently used ones are evicted first)"},
+                {"name":"conversion_workers","type":"int","value":2, "help":"The number of processes used to convert article pages to text (0 converts them in the main process)"},
+                {"name":"conversion_cache_folder","type":"str","value":"", "help":"The folder where converted pages are cached. If empty, a folder inside the personality output folder is used"},
                 {"name":"rss_scraping_type","type":"str","value":"quick","options":["quick","deep"], "help":"quick uses only the breafs to build the summary and the deep will scrape data from the website"},
                 {"name":"rss_urls","type":"text","value":"https://feeds.bbci.co.uk/news/rss.xml, http://rss.cnn.com/rss/cnn_topstories.rss, https://rss.nytimes.com/services/xml/rss/nyt/HomePage.xml, https://www.theguardian.com/world/rss, https://www.reuters.com/rssfeed/topNews, http://feeds.foxnews.com/foxnews/latest, https://www.aljazeera.com/xml/rss/all.xml, https://www.bloomberg.com/politics/feeds/site.xml", "help":"Here you can put rss feed address to recover data."},
                 {"name":"categories","type":"text","value":"World News,Entertainment,Sport,Technology,Education,Medicine,Space,R&D,Politics,Music,Business,Peaple", "help":"The list of categories to help the AI organize the news."},
                 {"name":"keep_only_multi_articles_subjects","type":"bool","value":False, "help":"When this option is true, only articles that have more than one source are kept"},
+                {"name":"similarity_merge_threshold","type":"float","value":0.6, "help":"Lexical similarity (0-1) above which two articles are fused without asking the AI"},
+                {"name":"similarity_llm_threshold","type":"float","value":0.25, "help":"Lexical similarity (0-1) above which the AI is asked to confirm if two articles talk about the same subject. Pairs below this value are never fused"},
 
 
                 {"name":"memorization_prompt","type":"text","value":"Make sure you keep all important information as bullet points. If you find a new article url and title add it immediately to the memory.", "help":"The instructions about what to memorize from the articles"},
@@ -106,6 +120,9 @@ class Processor(APScript):
                         )
         self.cv = None
         self.position = None
+        self.http_session = None
+        self.favicon_cache = None
+        self.store = None
 
     def install(self):
         super().install()
@@ -124,6 +141,21 @@ class Processor(APScript):
         with open(path,"w", encoding="utf8") as f:
             f.write(text)
 
+    def get_store(self):
+        """
+        Opens the persistent article store that keeps the work done by previous runs.
+        """
+        if self.store is None:
+            self.store = ArticleStore(self.personality.personality_output_folder / "rss_cache" / "articles.db")
+        return self.store
+
+    def get_conversion_service(self):
+        """
+        Returns the shared document converter configured for this personality.
+        """
+        cache_folder = self.personality_config.conversion_cache_folder or self.personality.personality_output_folder / "conversion_cache"
+        return get_document_conversion_service(Path(cache_folder), self.personality_config.conversion_workers)
+
     def generate_thumbnail_html(self, entry):
         """
         Generates HTML for a single thumbnail or favicon from an RSS feed entry.
@@ -160,17 +192,9 @@ class Processor(APScript):
                 if not base_url:
                     return ''
                 
-                # Fetch the website's HTML to find the favicon
-                response = requests.get(f"https://{base_url}",timeout=3)
-                soup = BeautifulSoup(response.text, 'html.parser')
-                
-                # Look for the favicon in the HTML
-                favicon = soup.find('link', rel='icon') or soup.find('link', rel='shortcut icon')
-                if favicon:
-                    favicon_url = favicon['href']
-                    if not favicon_url.startswith(('http:', 'https:')):
-                        favicon_url = f"https://{favicon_url.lstrip('/')}"
-                    
+                # The favicon is looked up once per website and kept in cache
+                favicon_url = self.favicon_cache.get(base_url, lambda _: find_favicon(self.http_session, site_root(link)))
+                if favicon_url:
                     # Use the favicon as the thumbnail
                     thumbnail = {'url': favicon_url}
             except Exception as e:
@@ -221,41 +245,71 @@ class Processor(APScript):
             print("No RSS URLs configured.")
             return
         
-        rss_feeds = [feed.strip() for feed in self.personality_config.rss_urls.split(",")]
+        rss_feeds = [feed.strip() for feed in self.personality_config.rss_urls.split(",") if feed.strip()]
         links = []
         feeds = []
-        
-        for rss_feed in rss_feeds:
-            feed = feedparse(rss_feed)
-            for p in feed.entries[:self.personality_config.nb_rss_feeds_per_source]:
-                self.step(f"Processing {p.title}")
-                content = p.get('summary', p.get('description', ''))
-                thumbnail_html = self.generate_thumbnail_html(p)
-                if content:
-                    # Save feed data for later use in fuse_articles
-                    feed_data = {
-                        'title': p.title,
-                        'link': p.link,
-                        'description': content,
-                        'media_thumbnail': p.get('media_thumbnail', []),  # Assuming media_thumbnail is available
-                        'thumbnail_html': thumbnail_html,  # Add the thumbnail HTML to the JSON
-                    }
-                    feeds.append(feed_data)
-                    
-                    # Generate HTML card for immediate display
-                    card = f'''
-                    <div class="bg-white rounded-lg shadow-md overflow-hidden hover:shadow-lg transition-shadow">
-                        <div class="p-6">
-                            <h3 class="text-lg font-medium text-gray-800 mb-2">
-                                <a href="{p.link}" target="_blank" class="hover:text-blue-600 transition-colors">{p.title}</a>
-                            </h3>
-                            {thumbnail_html}
-                            <p class="text-gray-600 text-sm">{content}</p>
-                        </div>
+
+        cache_folder = self.personality.personality_output_folder / "rss_cache"
+        fetcher = FeedFetcher(cache_folder, max_workers=self.personality_config.fetch_workers)
+        self.http_session = fetcher.session
+        self.favicon_cache = FaviconCache(
+                                            cache_folder / "favicons.json",
+                                            ttl=self.personality_config.favicon_cache_ttl_hours * 3600,
+                                            max_entries=self.personality_config.favicon_cache_max_entries
+                                        )
+
+        self.step_start(f"Fetching {len(rss_feeds)} feeds")
+        entries = []
+        for result in fetcher.fetch_all(rss_feeds):
+            if result.error:
+                self.step(f"Couldn't fetch {result.url}: {result.error}")
+                continue
+            if not result.changed:
+                self.step(f"{result.url} has not changed since last run")
+            feed = feedparse(result.content)
+            entries += feed.entries[:self.personality_config.nb_rss_feeds_per_source]
+        self.step_end(f"Fetching {len(rss_feeds)} feeds")
+
+        # Entries already seen with the same content reuse their thumbnail
+        store = self.get_store()
+        thumbnails = [store.get_thumbnail_html(p.get('link', ''), content_hash({'title': p.get('title', ''), 'description': p.get('summary', p.get('description', ''))})) for p in entries]
+        missing = [i for i, thumbnail_html in enumerate(thumbnails) if thumbnail_html is None]
+        with ThreadPoolExecutor(max_workers=max(1, self.personality_config.fetch_workers)) as executor:
+            for i, thumbnail_html in zip(missing, executor.map(self.generate_thumbnail_html, [entries[i] for i in missing])):
+                thumbnails[i] = thumbnail_html
+        self.favicon_cache.save()
+
+        for p, thumbnail_html in zip(entries, thumbnails):
+            self.step(f"Processing {p.title}")
+            content = p.get('summary', p.get('description', ''))
+            if content:
+                # Save feed data for later use in fuse_articles
+                feed_data = {
+                    'title': p.title,
+                    'link': p.link,
+                    'description': content,
+                    'media_thumbnail': p.get('media_thumbnail', []),  # Assuming media_thumbnail is available
+                    'thumbnail_html': thumbnail_html,  # Add the thumbnail HTML to the JSON
+                }
+                feeds.append(feed_data)
+                
+                # Generate HTML card for immediate display
+                card = f'''
+                <div class="bg-white rounded-lg shadow-md overflow-hidden hover:shadow-lg transition-shadow">
+                    <div class="p-6">
+                        <h3 class="text-lg font-medium text-gray-800 mb-2">
+                            <a href="{p.link}" target="_blank" class="hover:text-blue-600 transition-colors">{p.title}</a>
+                        </h3>
+                        {thumbnail_html}
+                        <p class="text-gray-600 text-sm">{content}</p>
                     </div>
-                    '''
-                    links.append(card)
+                </div>
+                '''
+                links.append(card)
         
+        changed = store.upsert_articles(feeds)
+        self.step(f"{len(changed)} new or updated articles out of {len(feeds)}")
+
         self.step("Saving the news json file")
         # Save feeds to JSON for later use in fuse_articles
         with open(output_folder / "news_data.json", "w") as f:
@@ -300,35 +354,38 @@ class Processor(APScript):
         with open(output_folder / "news_data.json", "r") as f:
             feeds = json.load(f)
         
+        store = self.get_store()
+        hashes = [content_hash(feed) for feed in feeds]
+        total_feeds = len(feeds)
+        self.step_start(f"Clustering {total_feeds} articles")
+        def confirm(i, j):
+            # Pairs judged during a previous run are not sent to the AI again
+            similar = store.get_decision(hashes[i], hashes[j])
+            if similar is None:
+                self.update_double_progress(i, total_feeds, j, total_feeds, feeds[i]['title'], feeds[j]['title'])
+                similar = self.are_articles_similar(feeds[i], feeds[j])
+                store.set_decision(hashes[i], hashes[j], similar)
+            return similar
+        groups, stats = cluster_articles(
+                                            feeds,
+                                            merge_threshold=self.personality_config.similarity_merge_threshold,
+                                            llm_threshold=self.personality_config.similarity_llm_threshold,
+                                            confirm=confirm
+                                        )
+        self.step_end(f"Clustering {total_feeds} articles")
+        self.step(f"{stats.auto_merged} pairs fused directly, {stats.llm_calls} pairs checked by the AI")
+
         themes = {}
-        processed = set()     
-        total_feeds = len(feeds)   
-        for i, feed in enumerate(feeds):
-            if i in processed:
-                continue
-            
-            # Create a new theme for this article
+        for group in groups:
+            feed = feeds[group[0]]
             theme_key = f"theme_{len(themes) + 1}"
             themes[theme_key] = {
                 'title': feed['title'],
                 'thumbnails': feed.get('media_thumbnail', []),
-                'content': feed.get('description', ''),
-                'urls': [feed['link']]
+                'content': "\n\n".join(feeds[i].get('description', '') for i in group),
+                'urls': [feeds[i]['link'] for i in group],
+                'signature': theme_signature(hashes[i] for i in group)
             }
-            
-            # Compare with other articles to find similar ones
-            for j, other_feed in enumerate(feeds[i + 1:], start=i + 1):
-                if j in processed:
-                    continue
-                
-                # Simple similarity check (can be replaced with more advanced NLP)
-                if self.are_articles_similar(feed, other_feed):
-                    themes[theme_key]['urls'].append(other_feed['link'])
-                    themes[theme_key]['content'] += f"\n\n{other_feed.get('description', '')}"
-                    processed.add(j)
-                self.update_double_progress(i, total_feeds, j-i, total_feeds - i, feed['title'], other_feed['title'])
-            
-            processed.add(i)
         nb_fused_articles = 0
         for theme_key, theme_data in themes.items():
             if len(theme_data['urls']) > 1:
@@ -344,15 +401,25 @@ class Processor(APScript):
         document.querySelector('span').textContent = 'Summary complete!';
         }}, 30 * nb_fused_articles);
         </script>""")
+        # Convert all the pages that will be needed in one parallel batch
+        urls = [url for theme_data in themes.values() if len(theme_data['urls']) > 1 and store.get_summary(theme_data['signature']) is None for url in theme_data['urls']]
+        self.prefetch_article_texts(urls)
+
         # Generate summaries for themes with multiple articles
         toremove = []
         for theme_key, theme_data in themes.items():
             if len(theme_data['urls']) > 1:
-                prompt = self.create_summary_prompt(theme_data)
-                summary = self.sequential_summarize(
-                                                        prompt, 
-                                                        summary_context=self.personality_config.memorization_prompt,
-                                                        task=self.personality_config.task_prompt,format=self.personality_config.output_format)
+                # Themes summarized by a previous (possibly interrupted) run are reused as is
+                summary = store.get_summary(theme_data['signature'])
+                if summary is None:
+                    prompt = self.create_summary_prompt(theme_data)
+                    summary = self.sequential_summarize(
+                                                            prompt, 
+                                                            summary_context=self.personality_config.memorization_prompt,
+                                                            task=self.personality_config.task_prompt,format=self.personality_config.output_format)
+                    store.set_summary(theme_data['signature'], summary)
+                else:
+                    self.step(f"Reusing the summary of {theme_data['title']}")
                 theme_data['summary'] = summary
             else:
                 if self.personality_config.keep_only_multi_articles_subjects:
@@ -374,9 +441,31 @@ class Processor(APScript):
         :param url: The URL of the article.
         :return: The text content of the article.
         """
-        converter = DocumentConverter()
-        result = converter.convert(url)
-        return result.document.export_to_markdown()
+        store = self.get_store()
+        text = store.get_page_text(url)
+        if text is None:
+            # The entry hash versions the cached page, a changed entry is converted again
+            text = self.get_conversion_service().convert(url, store.get_content_hash(url))
+            store.set_page_text(url, text)
+        return text
+
+    def prefetch_article_texts(self, urls):
+        """
+        Converts the pages that are not yet in the store using the conversion workers.
+        Pages that can't be converted are left for load_article_text to report.
+
+        :param urls: The URLs of the articles.
+        """
+        store = self.get_store()
+        missing = [url for url in dict.fromkeys(urls) if store.get_page_text(url) is None]
+        if not missing:
+            return
+        self.step_start(f"Loading {len(missing)} article pages")
+        versions = [store.get_content_hash(url) for url in missing]
+        for url, text in zip(missing, self.get_conversion_service().convert_many(missing, raise_errors=False, versions=versions)):
+            if text is not None:
+                store.set_page_text(url, text)
+        self.step_end(f"Loading {len(missing)} article pages")
 
     def create_summary_prompt(self, theme_data):
         """
@@ -0,0 +1,174 @@
+"""
+Multi-lens analysis of document chunks.
+
+Every chunk is analyzed through several lenses (importance, mixture of experts,
+thinking hats...). Sending one request per lens makes the model read the chunk
+once per lens, so two strategies are offered:
+
+    - single_pass: one generation answers all the lenses, each in its own
+      markdown section. Sections the model skipped are asked for separately.
+    - lenses: one generation per lens. The chunk and the instructions come first
+      and are byte identical for all the lenses of a chunk, only the lens
+      instruction differs at the end of the prompt, so backends that keep the
+      prompt cache between requests (llama.cpp, ollama...) process the chunk
+      once. The lenses of a chunk are sent concurrently.
+
+Chunks themselves are analyzed by a bounded pool of workers and the results are
+handed back in document order.
+"""
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Tuple
+
+ANALYSIS_MODES = ["single_pass", "lenses"]
+
+LENSES = [
+    {
+        "title":"Importance",
+        "content":"What is the importance of the content: high,medium or low? Only answer with the importance level without explanations."
+    },
+    {
+        "title":"Mixture_Of_Experts_Report",
+        "content":"Act as a sophisticated document analysis AI, that analyzes document chunks by breaking down complex questions into sub-questions. Leverage multiple expert perspectives to generate intermediate thoughts, evaluating their relevance and logical flow. Construct a chain of reasoning, stitching together the strongest thoughts, while providing explanatory details. Synthesize key insights into a final answer, written by an experienced tech writer at the doctoral level"
+    },
+    {
+        "title":"Thinking_Hat_Report",
+        "content":"Act as a multilingual critical and creative thinker that supports intelligence analysis by following a dynamic sequence of the 6 thinking hats to analyze information in the context of intelligence analysis. First, I'll determine the most suitable hat sequence based on the input of the user while also identifying the language of any provided text, which may involve starting with the White Hat to gather facts and data, then switching to the Red Hat to explore emotions and intuition, followed by the Black Hat to examine potential risks, and so on. The sequence may vary, but it will always culminate in the Blue Hat to organize the thinking process. The steps may include (1) White Hat - gather and analyze data, (2) Red Hat - explore emotions and intuition, (3) Black Hat - examine potential risks, (4) Yellow Hat - investigate benefits and advantages, (5) Green Hat - generate new ideas and alternatives, and (6) Blue Hat - organize the thinking process. Depending on the sequence, additional steps may involve (7) White Hat - re-evaluate data in light of new insights, (8) Red Hat - reassess emotions and intuition, (9) Black Hat - re-examine potential risks, (10) Yellow Hat - re-investigate benefits and advantages, (11) Green Hat - refine new ideas and alternatives, and (12) Blue Hat - finalize the thinking process. The 2nd to last step will involve synthesizing the insights from each hat to craft a comprehensive answer at a doctoral level, followed by the final step of providing 4 follow-on question suggestions to facilitate further exploration and deeper understanding. Throughout the process, I'll maintain a neutral and objective tone, while encouraging creative and innovative thinking"
+    },
+    {
+        "title":"Multistage_Expert_Analysis_Report",
+        "content":"Act as a sophisticated document analysis AI that analyzes document chunks using stages 1-10 without pausing. Stage 1 involves breaking down complex questions into 4-6 sub-questions. Stage 2 involves Leverage multiple expert perspectives to generate 4-6 intermediate analysis thoughts. Stage 3 involves evaluating their relevance and logical flow. Stage 4 involves Constructing a chain of reasoning, stitching together the strongest thoughts, while providing explanatory details. Stage 5 involves backtracking and exploring 1-2 alternative analytical paths by substituting different intermediate thoughts from alternative expert perspectives. Stage 6 involves Leverage multiple analytical expert perspectives to generate 4-6 intermediate thoughts related to Stage 5. Stage 7 involves evaluating the relevance and logical flow of the alternative intermediate thoughts. Stage 8 involves Constructing a chain of reasoning, stitching together the strongest alternative thoughts, while providing explanatory details. Stage 9 involves leveraging adversarial expert perspectives to generate 4-8 intermediate thoughts debating both the initial and alternative reasoning chains. Stage 10 involves synthesizing key insights into a final comprehensive answer, written by an experienced technical writer at the doctoral level who is experienced in analyzing complex problems and synthesizing key insights into coherent narratives."
+    },
+    {
+        "title":"Multi_Reasoning_Report",
+        "content":"Act as a sophisticated document analysis AI that analyzes document chunks using stages 1-10 without pausing. Stage 1 involves breaking down complex questions into 4-6 sub-questions. Stage 2 involves leveraging probabilistic reasoning to generate 4-6 intermediate thoughts. Stage 3 involves evaluating their relevance and logical flow. Stage 4 involves using correlation and causation to generate a chain of reasoning, stitching together the strongest thoughts, while providing explanatory details. Stage 5 involves using doubt to generate 3-5 intermediate thoughts identifying problems with the reasoning. Stage 6 involves using Argumentation to generate 4-8 intermediate thoughts addressing the points raised by Stage 5. Stage 7 involves leveraging 4-5 expert perspectives to generate 4-6 sub-questions to consider alternative paths. Stage 8 involves leveraging deductive reasoning to generate 4-6 intermediate thoughts that answer the sub-questions from Stage 7. Stage 9 involves using analogical reasoning to compare all of the insights gained so far into insightful bullet points. Stage 10 involves synthesizing key insights into a final comprehensive analysis report, written by an experienced all source intelligence analyst at the doctoral level who is experienced in analyzing complex problems and synthesizing key insights into coherent narratives."
+    },
+    {
+        "title":"Intelligence_Value_Report",
+        "content":"Act as a multiple disciplined sophisticated AI intelligence analyst that analyzes document chunks using stages 1-10 without pausing. Stage 1 involves breaking information down into 4-6 sub-questions. Stage 2 involves leveraging probabilistic reasoning to generate 4-6 intermediate thoughts answering the sub-questions in relation to the potential intelligence value. Stage 3 involves evaluating their relevance and logical flow. Stage 4 involves using correlation and causation to generate a chain of reasoning, stitching together the strongest thoughts into intelligence report summarized bullet points, while providing explanatory details with each. Stage 5 involves using doubt to generate 3-5 intermediate thoughts identifying problems with the reasoning or intelligence value estimations. Stage 6 involves using Argumentation to generate 4-8 intermediate thoughts addressing the points raised by Stage 5 to further clarify the potential intelligence value of the information. Stage 7 involves leveraging 4-5 expert intelligence analysis perspectives to generate 4-6 sub-questions to consider alternative paths to additional information. Stage 8 involves leveraging deductive reasoning to generate 4-6 intermediate thoughts that answer the sub-questions from Stage 7 while also considering all previous stages. Stage 9 involves using analogical reasoning to explain the intelligence value of the information. Stage 10 involves synthesizing key insights from all stages into a final comprehensive intelligence report summary, written by an experienced analyst at the doctoral level who is experienced in analyzing complex national security problems and synthesizing key insights into coherent narrative."
+    },
+]
+
+
+def _title_key(title: str) -> str:
+    return re.sub(r"[\W_]+", " ", title).strip().lower()
+
+
+def parse_sections(text: str, titles: List[str]) -> Dict[str, str]:
+    """
+    Splits a markdown answer on headers matching the lens titles.
+
+    Headers are matched case insensitively, with underscores and spaces considered equal.
+    Returns:
+        The non empty sections found, by lens title.
+    """
+    keys = {_title_key(title): title for title in titles}
+    sections: Dict[str, List[str]] = {}
+    current = None
+    for line in text.splitlines():
+        header = re.match(r"^\s*#{1,6}\s*(.+?)\s*#*\s*$", line)
+        if header:
+            key = _title_key(header.group(1).strip("*` "))
+            if key in keys:
+                current = keys[key]
+                sections[current] = []
+                continue
+        if current is not None:
+            sections[current].append(line)
+    return {title: "\n".join(lines).strip() for title, lines in sections.items() if "\n".join(lines).strip()}
+
+
+class PrefixCache:
+    """
+    Keeps the shared prompt prefix of the chunks being analyzed.
+
+    The prefix of a chunk is built once and the same string is used by all its
+    lens requests, which guarantees they share their leading bytes.
+    """
+    def __init__(self, build_prefix: Callable[[str], str], size: int = 32) -> None:
+        self.build_prefix = build_prefix
+        self.size = size
+        self.prefixes: "OrderedDict[str, str]" = OrderedDict()
+        self.hits = 0
+        self.lock = threading.Lock()
+
+    def get(self, chunk: str) -> str:
+        with self.lock:
+            if chunk in self.prefixes:
+                self.prefixes.move_to_end(chunk)
+                self.hits += 1
+                return self.prefixes[chunk]
+        prefix = self.build_prefix(chunk)
+        with self.lock:
+            self.prefixes[chunk] = prefix
+            if len(self.prefixes) > self.size:
+                self.prefixes.popitem(last=False)
+        return prefix
+
+
+class LensAnalyzer:
+    """
+    Args:
+        generate: Generates the answer to a prompt.
+        build_prefix: Builds the instructions and chunk part of the prompt, shared by all the lenses.
+        build_single_pass: Builds the prompt asking for all the lenses at once from the shared prefix.
+        lens_suffix: Builds the end of the prompt of a single lens from its instruction.
+        mode: One of ANALYSIS_MODES.
+        lens_workers: Lenses of a chunk sent at the same time in lenses mode.
+    """
+    def __init__(self, generate: Callable[[str], str], build_prefix: Callable[[str], str], build_single_pass: Callable[[str, List[dict]], str],
+                 lens_suffix: Callable[[dict], str], lenses: List[dict] = LENSES, mode: str = "single_pass", lens_workers: int = 1) -> None:
+        self.generate = generate
+        self.prefixes = PrefixCache(build_prefix)
+        self.build_single_pass = build_single_pass
+        self.lens_suffix = lens_suffix
+        self.lenses = lenses
+        self.mode = mode if mode in ANALYSIS_MODES else "single_pass"
+        self.lens_workers = max(1, lens_workers)
+
+    def analyze_lenses(self, chunk: str, lenses: List[dict]) -> Dict[str, str]:
+        prefix = self.prefixes.get(chunk)
+
+        def run(lens):
+            return lens["title"], self.generate(prefix + self.lens_suffix(lens)).strip()
+
+        if self.lens_workers <= 1 or len(lenses) <= 1:
+            return dict(run(lens) for lens in lenses)
+        with ThreadPoolExecutor(max_workers=min(self.lens_workers, len(lenses))) as executor:
+            return dict(executor.map(run, lenses))
+
+    def analyze(self, chunk: str) -> Dict[str, str]:
+        """Returns the analysis of the chunk by lens title, in the order of the lenses."""
+        if self.mode == "single_pass":
+            prefix = self.prefixes.get(chunk)
+            sections = parse_sections(self.generate(self.build_single_pass(prefix, self.lenses)), [lens["title"] for lens in self.lenses])
+            missing = [lens for lens in self.lenses if lens["title"] not in sections]
+            if missing:
+                sections.update(self.analyze_lenses(chunk, missing))
+        else:
+            sections = self.analyze_lenses(chunk, self.lenses)
+        return {lens["title"]: sections.get(lens["title"], "") for lens in self.lenses}
+
+    def analyze_chunks(self, chunks: List[str], workers: int = 1) -> Iterator[Tuple[int, Dict[str, str]]]:
+        """
+        Analyzes the chunks with up to workers chunks in flight.
+
+        Yields:
+            (chunk index, analysis) pairs in chunk order, as soon as all the previous chunks are done.
+        """
+        workers = max(1, workers)
+        if workers == 1:
+            for i, chunk in enumerate(chunks):
+                yield i, self.analyze(chunk)
+            return
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {}
+            next_chunk = 0
+            for i in range(len(chunks)):
+                # Keeps the pool busy without queueing the whole document
+                while next_chunk < len(chunks) and next_chunk < i + workers:
+                    futures[next_chunk] = executor.submit(self.analyze, chunks[next_chunk])
+                    next_chunk += 1
+                yield i, futures.pop(i).result()
@@ -10,6 +10,11 @@ import subprocess
 from pathlib import Path
 import json
 import pipmaster as pm
+import sys
+
+sys.path.append(str(Path(__file__).parent))
+from analysis import LensAnalyzer, LENSES, ANALYSIS_MODES
+from tail_follow import FileStateStore, Debouncer, read_appended, end_state, is_appendable
 
 if not pm.is_installed("watchdog"):
     pm.install("watchdog")
@@ -44,6 +49,12 @@ class Processor(APScript, FileSystemEventHandler):
                 {"name":"chunk_size","type":"int","value":3072, "help":"The size of the chunk to read each time"},
                 {"name":"chunk_overlap","type":"int","value":256, "help":"The overlap between blocs"},
                 {"name":"save_each_n_chunks","type":"int","value":0, "help":"The number of chunks to process before saving the file. If 0, then the report is built at the end and a soingle report will be built for all logs."},
+                {"name":"analysis_mode","type":"str","value":"single_pass","options":ANALYSIS_MODES, "help":"single_pass asks for all the analysis sections in one generation per chunk (sections the model skips are asked for separately). lenses sends one generation per section, all sharing the same chunk prefix so that backends with a prompt cache read the chunk only once"},
+                {"name":"analysis_workers","type":"int","value":2, "help":"The number of chunks analyzed at the same time. Set to 1 if your binding can't serve concurrent requests"},
+                {"name":"tail_follow","type":"bool","value":True, "help":"When monitoring, only analyze what was appended to a log since its last analysis instead of the whole file"},
+                {"name":"debounce_seconds","type":"float","value":2.0, "help":"When monitoring, a modified file is analyzed once it stopped changing for this number of seconds"},
+                {"name":"debounce_max_wait","type":"float","value":30.0, "help":"When monitoring, maximum number of seconds a file that keeps changing waits before being analyzed"},
+                {"name":"lens_workers","type":"int","value":1, "help":"In lenses mode, the number of sections of a chunk generated at the same time"},
             ]
             )
         personality_config_vals = BaseConfig.from_template(personality_config_template)
@@ -87,55 +98,45 @@ class Processor(APScript, FileSystemEventHandler):
     def on_modified(self, event):
         if not event.is_directory:
             file_path = Path(event.src_path)
-            self.step(f"Detected modification in log file {file_path}")
-            self.process_file(file_path)
-    
-    
-    def process_file(self, file: Path):
+            if self.is_log_file(file_path):
+                self.debouncer.touch(file_path)
 
-        prompts = [
-            {
-                "title":"Importance",
-                "content":"What is the importance of the content: high,medium or low? Only answer with the importance level without explanations."
-            },
-            {
-                "title":"Mixture_Of_Experts_Report",
-                "content":"Act as a sophisticated document analysis AI, that analyzes document chunks by breaking down complex questions into sub-questions. Leverage multiple expert perspectives to generate intermediate thoughts, evaluating their relevance and logical flow. Construct a chain of reasoning, stitching together the strongest thoughts, while providing explanatory details. Synthesize key insights into a final answer, written by an experienced tech writer at the doctoral level"
-            },
-            {
-                "title":"Thinking_Hat_Report",
-                "content":"Act as a multilingual critical and creative thinker that supports intelligence analysis by following a dynamic sequence of the 6 thinking hats to analyze information in the context of intelligence analysis. First, I'll determine the most suitable hat sequence based on the input of the user while also identifying the language of any provided text, which may involve starting with the White Hat to gather facts and data, then switching to the Red Hat to explore emotions and intuition, followed by the Black Hat to examine potential risks, and so on. The sequence may vary, but it will always culminate in the Blue Hat to organize the thinking process. The steps may include (1) White Hat - gather and analyze data, (2) Red Hat - explore emotions and intuition, (3) Black Hat - examine potential risks, (4) Yellow Hat - investigate benefits and advantages, (5) Green Hat - generate new ideas and alternatives, and (6) Blue Hat - organize the thinking process. Depending on the sequence, additional steps may involve (7) White Hat - re-evaluate data in light of new insights, (8) Red Hat - reassess emotions and intuition, (9) Black Hat - re-examine potential risks, (10) Yellow Hat - re-investigate benefits and advantages, (11) Green Hat - refine new ideas and alternatives, and (12) Blue Hat - finalize the thinking process. The 2nd to last step will involve synthesizing the insights from each hat to craft a comprehensive answer at a doctoral level, followed by the final step of providing 4 follow-on question suggestions to facilitate further exploration and deeper understanding. Throughout the process, I'll maintain a neutral and objective tone, while encouraging creative and innovative thinking"
-            },
-            {
-                "title":"Multistage_Expert_Analysis_Report",
-                "content":"Act as a sophisticated document analysis AI that analyzes document chunks using stages 1-10 without pausing. Stage 1 involves breaking down complex questions into 4-6 sub-questions. Stage 2 involves Leverage multiple expert perspectives to generate 4-6 intermediate analysis thoughts. Stage 3 involves evaluating their relevance and logical flow. Stage 4 involves Constructing a chain of reasoning, stitching together the strongest thoughts, while providing explanatory details. Stage 5 involves backtracking and exploring 1-2 alternative analytical paths by substituting different intermediate thoughts from alternative expert perspectives. Stage 6 involves Leverage multiple analytical expert perspectives to generate 4-6 intermediate thoughts related to Stage 5. Stage 7 involves evaluating the relevance and logical flow of the alternative intermediate thoughts. Stage 8 involves Constructing a chain of reasoning, stitching together the strongest alternative thoughts, while providing explanatory details. Stage 9 involves leveraging adversarial expert perspectives to generate 4-8 intermediate thoughts debating both the initial and alternative reasoning chains. Stage 10 involves synthesizing key insights into a final comprehensive answer, written by an experienced technical writer at the doctoral level who is experienced in analyzing complex problems and synthesizing key insights into coherent narratives."
-            },
-            {
-                "title":"Multi_Reasoning_Report",
-                "content":"Act as a sophisticated document analysis AI that analyzes document chunks using stages 1-10 without pausing. Stage 1 involves breaking down complex questions into 4-6 sub-questions. Stage 2 involves leveraging probabilistic reasoning to generate 4-6 intermediate thoughts. Stage 3 involves evaluating their relevance and logical flow. Stage 4 involves using correlation and causation to generate a chain of reasoning, stitching together the strongest thoughts, while providing explanatory details. Stage 5 involves using doubt to generate 3-5 intermediate thoughts identifying problems with the reasoning. Stage 6 involves using Argumentation to generate 4-8 intermediate thoughts addressing the points raised by Stage 5. Stage 7 involves leveraging 4-5 expert perspectives to generate 4-6 sub-questions to consider alternative paths. Stage 8 involves leveraging deductive reasoning to generate 4-6 intermediate thoughts that answer the sub-questions from Stage 7. Stage 9 involves using analogical reasoning to compare all of the insights gained so far into insightful bullet points. Stage 10 involves synthesizing key insights into a final comprehensive analysis report, written by an experienced all source intelligence analyst at the doctoral level who is experienced in analyzing complex problems and synthesizing key insights into coherent narratives."
-            },
-            {
-                "title":"Intelligence_Value_Report",
-                "content":"Act as a multiple disciplined sophisticated AI intelligence analyst that analyzes document chunks using stages 1-10 without pausing. Stage 1 involves breaking information down into 4-6 sub-questions. Stage 2 involves leveraging probabilistic reasoning to generate 4-6 intermediate thoughts answering the sub-questions in relation to the potential intelligence value. Stage 3 involves evaluating their relevance and logical flow. Stage 4 involves using correlation and causation to generate a chain of reasoning, stitching together the strongest thoughts into intelligence report summarized bullet points, while providing explanatory details with each. Stage 5 involves using doubt to generate 3-5 intermediate thoughts identifying problems with the reasoning or intelligence value estimations. Stage 6 involves using Argumentation to generate 4-8 intermediate thoughts addressing the points raised by Stage 5 to further clarify the potential intelligence value of the information. Stage 7 involves leveraging 4-5 expert intelligence analysis perspectives to generate 4-6 sub-questions to consider alternative paths to additional information. Stage 8 involves leveraging deductive reasoning to generate 4-6 intermediate thoughts that answer the sub-questions from Stage 7 while also considering all previous stages. Stage 9 involves using analogical reasoning to explain the intelligence value of the information. Stage 10 involves synthesizing key insights from all stages into a final comprehensive intelligence report summary, written by an experienced analyst at the doctoral level who is experienced in analyzing complex national security problems and synthesizing key insights into coherent narrative."
-            },
-        ]        
-        import hashlib
-        hasher = hashlib.md5()
-        self.step_start(f"Processing {file.name}")
-        data = parse_document(file)
-        chunks = chunk_text(
-            data,
-            self.personality_config.chunk_size,
-            self.personality_config.chunk_overlap
-        )
-        hasher.update(data.encode("utf8"))
+    def is_log_file(self, file: Path):
+        extension_list = [v.strip() for v in self.personality_config.file_types.split(',')]
+        return file.suffix[1:] in extension_list and file.resolve()!=self.output_file_path.resolve()
 
-                    
-        n_chunks = len(chunks)
-        for i, chunk in enumerate(chunks):
-            self.step_start(f"Processing {file.name} chunk {i+1}/{n_chunks}")
-            
-            prompt_prefix = f"""{self.system_custom_header("instructions")}
+    @property
+    def tail_size(self):
+        # chunk_overlap is in tokens, a token is about 4 characters
+        return self.personality_config.chunk_overlap*4
+
+    def follow_file(self, file_path: Path):
+        """Analyzes what changed in a monitored file since its last analysis."""
+        if not file_path.exists():
+            return
+        self.step(f"Detected modification in log file {file_path}")
+        state = self.file_states.get(file_path)
+        try:
+            if self.personality_config.tail_follow and is_appendable(file_path):
+                tail, text, new_state = read_appended(file_path, state, self.tail_size)
+                if text.strip()=="":
+                    return
+                self.analyze_text(file_path.name, tail+text)
+                self.file_states.set(file_path, new_state)
+            else:
+                # Taken before reading, what is written during the analysis is seen by the next event
+                new_state = end_state(file_path, self.tail_size)
+                if state is not None and state.get("digest")==new_state["digest"]:
+                    return
+                self.process_file(file_path)
+                self.file_states.set(file_path, new_state)
+        except Exception as ex:
+            ASCIIColors.error(ex)
+    
+    
+    def build_prompt_prefix(self, chunk: str) -> str:
+        """Instructions and chunk, shared by all the lenses of the chunk so they come first."""
+        return f"""{self.system_custom_header("instructions")}
 Act as DocuSphere, a comprehensive document analysis AI that provides insightful analysis and recommendations on the importance of information contained within documents by examining content, identifying key concepts, evaluating relevance, and synthesizing findings to deliver actionable intelligence.
 - Comprehensively analyze the provided document content using the indicated instructions and provide a detailed report.
 - Identify any significant patterns or anomalies that may indicate important information or key concepts.
@@ -150,33 +151,69 @@ Act as DocuSphere, a comprehensive document analysis AI that provides insightful
 - Only report findings that are relevant to the analysis. Do not report general or mundane information.
 
 {self.system_custom_header("output format")}
-"""
-            
-            chunk_prompt = f"""
+
 {self.system_custom_header("text chunk")}
-{chunk.text}
+{chunk}
 Answer in a markdown format without any extra comments following the instruction.
 {self.system_custom_header("instructions")}
 """
-            for prompt in prompts:
-                self.step_start(f"Processing {file.name} chunk {i+1}/{n_chunks}- {prompt['title']}")
-                analysis = self.fast_gen(prompt_prefix+chunk_prompt+prompt["content"]+self.ai_full_header)
-                try:
-                    self.output_file.write("### "+ prompt['title'] + "\n" + prompt["content"]+"\n"+analysis+"\n")
-                    self.output_file.flush()
-
-                    if self.personality_config.save_each_n_chunks>0 and i%self.personality_config.save_each_n_chunks==0:
-                        self.output_file.close()
-                        self.output_file = open(self.output_file_path.parent/(self.output_file_path.stem+f"_{i}"+self.output_file_path.suffix),"w")
-
-                except Exception as ex:
-                    ASCIIColors.error(ex)
-                self.step_end(f"Processing {file.name} chunk {i+1}/{n_chunks}")
-                self.set_message_content(self.output)
+
+    def build_lens_suffix(self, lens: dict) -> str:
+        return lens["content"] + self.ai_full_header
+
+    def build_single_pass_prompt(self, prefix: str, lenses: list) -> str:
+        sections = "\n".join(f"## {lens['title']}\n{lens['content']}\n" for lens in lenses)
+        return (
+            prefix
+            + "Analyze the text chunk once for each of the following sections. Start each section with its exact markdown header and answer every section, in this order:\n"
+            + sections
+            + self.ai_full_header
+        )
+
+    def get_analyzer(self) -> LensAnalyzer:
+        return LensAnalyzer(
+            lambda prompt: self.fast_gen(prompt, callback=self.sink),
+            self.build_prompt_prefix,
+            self.build_single_pass_prompt,
+            self.build_lens_suffix,
+            LENSES,
+            self.personality_config.analysis_mode,
+            self.personality_config.lens_workers,
+        )
+
+    def write_analysis(self, i: int, analysis: dict):
+        try:
+            for lens in LENSES:
+                self.output_file.write("### "+ lens['title'] + "\n" + lens["content"]+"\n"+analysis[lens['title']]+"\n")
             self.output_file.write("\n\n")
             self.output_file.flush()
 
-        self.step_end(f"Processing {file.name}")
+            if self.personality_config.save_each_n_chunks>0 and i%self.personality_config.save_each_n_chunks==0:
+                self.output_file.close()
+                self.output_file = open(self.output_file_path.parent/(self.output_file_path.stem+f"_{i}"+self.output_file_path.suffix),"w")
+
+        except Exception as ex:
+            ASCIIColors.error(ex)
+
+    def process_file(self, file: Path):
+        self.analyze_text(file.name, parse_document(file))
+
+    def analyze_text(self, name: str, data: str):
+        self.step_start(f"Processing {name}")
+        chunks = chunk_text(
+            data,
+            self.personality_config.chunk_size,
+            self.personality_config.chunk_overlap
+        )
+        n_chunks = len(chunks)
+        analyzer = self.get_analyzer()
+        self.step(f"Analyzing {n_chunks} chunks ({self.personality_config.analysis_mode}, {self.personality_config.analysis_workers} at a time)")
+        for i, analysis in analyzer.analyze_chunks([chunk.text for chunk in chunks], self.personality_config.analysis_workers):
+            self.write_analysis(i, analysis)
+            self.step(f"Processed {name} chunk {i+1}/{n_chunks}")
+            self.set_message_content(self.output)
+
+        self.step_end(f"Processing {name}")
 
     def read_all_logs(self, command="", full_context="", callback=None, context_state="", client=None):
         if self.personality_config.output_file_path=="":
@@ -194,6 +231,7 @@ Answer in a markdown format without any extra comments following the instruction
 
     def stop_logs_monitoring(self, command="", full_context="", callback=None, context_state="", client=None):
         self.observer.stop()
+        self.debouncer.stop()
 
     def start_logs_monitoring(self,  command="", full_context="", callback=None, context_state="", client=None):
         if self.personality_config.output_file_path=="":
@@ -203,6 +241,15 @@ Answer in a markdown format without any extra comments following the instruction
             self.personality.info("Please setup logs folder path first")
             return
         self.new_message("Starting continuous logs process...")
+        self.output = ""
+        self.output_file_path = Path(self.personality_config.output_file_path)
+        self.output_file = open(self.output_file_path,"a")
+        self.file_states = FileStateStore(self.personality.personality_output_folder/"tail_follow_state.json")
+        self.debouncer = Debouncer(
+                                    self.follow_file,
+                                    self.personality_config.debounce_seconds,
+                                    self.personality_config.debounce_max_wait
+                                )
         self.observer = Observer()
         self.observer.schedule(self, self.personality_config.logs_path, recursive=True)
         self.observer.start()
@@ -216,10 +263,15 @@ Answer in a markdown format without any extra comments following the instruction
         self.output_file = open(self.output_file_path,"w")
         
         self.output = ""
+        self.file_states = FileStateStore(self.personality.personality_output_folder/"tail_follow_state.json")
 
         for file in files:
             if file.is_file() and file.suffix[1:] in extension_list:
+                # Monitoring will start from here instead of analyzing the file again. The state is
+                # taken before reading so that the lines appended during the analysis are followed
+                state = end_state(file, self.tail_size)
                 self.process_file(file)
+                self.file_states.set(file, state)
 
     
     def add_file(self, path, client, callback=None):
@@ -0,0 +1,167 @@
+"""
+Incremental reading of growing log files.
+
+The state of each followed file (bytes already analyzed, fingerprints of the
+analyzed region and the end of the analyzed text) is persisted, so a
+modification only reads what was appended since the last analysis. The end of
+the previous text is prepended to the new region to give its first chunk the
+same overlap as the chunks of a full read. A file that was truncated, rotated
+or rewritten is detected by its fingerprints and read again from the start.
+
+Watchdog reports a write burst as many modification events; Debouncer
+coalesces them and hands a file over once it has been quiet for a while, or
+once it has been waiting for too long on a log that never stops growing.
+"""
+import json
+import time
+import hashlib
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+from ascii_colors import ASCIIColors, trace_exception
+
+# Formats that need a parser, they are never appended to and are analyzed as a whole
+PARSED_FORMATS = {"pdf", "docx", "doc", "pptx", "xlsx", "odt", "epub", "html", "htm", "msg"}
+FINGERPRINT_SIZE = 4096
+
+
+def file_digest(path: Path) -> str:
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def _fingerprints(f, offset: int) -> Tuple[str, str]:
+    """Hashes of the first and last FINGERPRINT_SIZE bytes before offset."""
+    f.seek(0)
+    head = hashlib.sha256(f.read(min(offset, FINGERPRINT_SIZE))).hexdigest()
+    start = max(0, offset - FINGERPRINT_SIZE)
+    f.seek(start)
+    end = hashlib.sha256(f.read(offset - start)).hexdigest()
+    return head, end
+
+
+class FileStateStore:
+    """Json file holding the follow state of each file, keyed by resolved path."""
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self.states: Dict[str, dict] = {}
+        if self.path.exists():
+            try:
+                self.states = json.loads(self.path.read_text(encoding="utf8"))
+            except (json.JSONDecodeError, OSError):
+                self.states = {}
+
+    def get(self, file: Path) -> Optional[dict]:
+        with self.lock:
+            return self.states.get(str(Path(file).resolve()))
+
+    def set(self, file: Path, state: dict) -> None:
+        with self.lock:
+            self.states[str(Path(file).resolve())] = state
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(self.states, indent=4), encoding="utf8")
+            tmp.replace(self.path)
+
+
+def is_appendable(file: Path) -> bool:
+    return Path(file).suffix[1:].lower() not in PARSED_FORMATS
+
+
+def read_appended(file: Path, state: Optional[dict], tail_size: int) -> Tuple[str, str, dict]:
+    """
+    Reads the complete lines appended to a text file since state was saved.
+
+    Args:
+        state: The state returned by the previous call, None for a file never read.
+        tail_size: Characters of the end of the text kept as overlap for the next call.
+    Returns:
+        The overlap with the previous text, the new text and the state to save
+        once the new text is analyzed. The new text is empty when nothing was appended.
+    """
+    file = Path(file)
+    size = file.stat().st_size
+    with open(file, "rb") as f:
+        offset, tail = 0, ""
+        if state is not None and state["offset"] <= size:
+            head, end = _fingerprints(f, state["offset"])
+            if head == state["head"] and end == state["end"]:
+                offset, tail = state["offset"], state["tail"]
+        f.seek(offset)
+        data = f.read(size - offset)
+        # A line being written is left for the next call
+        last_newline = data.rfind(b"\n")
+        data = data[:last_newline + 1] if last_newline >= 0 else b""
+        new_offset = offset + len(data)
+        head, end = _fingerprints(f, new_offset)
+    text = data.decode("utf8", errors="replace")
+    new_tail = (tail + text)[-tail_size:] if tail_size > 0 else ""
+    return tail, text, {"offset": new_offset, "head": head, "end": end, "tail": new_tail, "digest": None}
+
+
+def end_state(file: Path, tail_size: int) -> dict:
+    """State of a file whose whole content was just analyzed."""
+    _, _, state = read_appended(file, None, tail_size)
+    if not is_appendable(file):
+        state["digest"] = file_digest(file)
+    return state
+
+
+class Debouncer:
+    """
+    Calls handle(key) once the key stopped being touched for delay seconds, or
+    max_wait seconds after it was first touched. Keys are handled one at a
+    time by a single background thread.
+    """
+    def __init__(self, handle: Callable[[object], None], delay: float = 2.0, max_wait: float = 30.0) -> None:
+        self.handle = handle
+        self.delay = delay
+        self.max_wait = max(delay, max_wait)
+        self.pending: Dict[object, Tuple[float, float]] = {}
+        self.condition = threading.Condition()
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def touch(self, key) -> None:
+        now = time.monotonic()
+        with self.condition:
+            first, _ = self.pending.get(key, (now, now))
+            self.pending[key] = (first, now)
+            self.condition.notify()
+
+    def _due(self, now: float) -> Tuple[Optional[object], float]:
+        """The first key due for handling, or the time to wait for the next one."""
+        wait = None
+        for key, (first, last) in self.pending.items():
+            due = min(last + self.delay, first + self.max_wait)
+            if due <= now:
+                return key, 0
+            wait = due - now if wait is None else min(wait, due - now)
+        return None, wait
+
+    def _run(self) -> None:
+        while True:
+            with self.condition:
+                while self.running:
+                    key, wait = self._due(time.monotonic())
+                    if key is not None:
+                        del self.pending[key]
+                        break
+                    self.condition.wait(wait)
+                if not self.running:
+                    return
+            try:
+                self.handle(key)
+            except Exception as ex:
+                ASCIIColors.error(f"Couldn't process {key}")
+                trace_exception(ex)
+
+    def stop(self) -> None:
+        with self.condition:
+            self.running = False
+            self.condition.notify()
@@ -22,58 +22,194 @@ from typing import Callable, Any
 from functools import partial
 from ascii_colors import trace_exception
 
+import re
+import sys
 import sqlite3
+import numpy as np
 from pathlib import Path
-from typing import List, Tuple
+from typing import Callable, Iterable, List, Optional, Tuple
 from lollms.utilities import PackageManager
 
 from safe_store import SafeStore
 
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+from zoo_common.sqlite_database import SQLiteDatabase
 
-class QNADatabase:
-    def __init__(self, db_path: str):
-        self.db_path = Path(db_path)
-        self.connection = sqlite3.connect(self.db_path)
-        self.cursor = self.connection.cursor()
-        self._create_table()
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
 
-    def _create_table(self):
-        """Creates the QNA table if it doesn't exist. Because who doesn't like a good table?"""
-        self.cursor.execute('''
+
+def _scale(scores: dict) -> dict:
+    """Scales positive scores to (0, 1] so that BM25 and cosine scores can be added."""
+    scores = {key: value for key, value in scores.items() if value > 0}
+    if not scores:
+        return {}
+    high = max(scores.values())
+    return {key: value / high for key, value in scores.items()}
+
+
+class QNADatabase(SQLiteDatabase):
+    """
+    Questions and answers with hybrid search.
+
+    Questions are indexed by an FTS5 table that triggers keep in sync with the qna table,
+    and optionally embedded (float32 blobs) when an embedding function is given.
+    Search results fuse the BM25 rank and the cosine similarity of the embeddings.
+    Each embedding records the embedder that produced it, the vector search skips the
+    rows of another embedder or of another dimension as they can't be compared.
+    """
+    migrations = [
+        '''
             CREATE TABLE IF NOT EXISTS qna (
                 id INTEGER PRIMARY KEY,
                 question TEXT NOT NULL,
                 answer TEXT NOT NULL
-            )
-        ''')
-        self.connection.commit()
-
-    def add_qna(self, question: str, answer: str):
-        """Adds a new QNA entry to the database. It's like adding a new friend to your contact list!"""
-        self.cursor.execute('''
-            INSERT INTO qna (question, answer) VALUES (?, ?)
-        ''', (question, answer))
-        self.connection.commit()
-
-    def search_similar_questions(self, search_term: str) -> List[Tuple[int, str, str]]:
-        """Searches for similar questions in the database. It's like playing hide and seek with questions!"""
-        self.cursor.execute('''
-            SELECT * FROM qna WHERE question LIKE ?
-        ''', (f'%{search_term}%',))
-        return self.cursor.fetchall()
+            );
+        ''',
+        # Full text index of the questions, external content kept in sync by triggers
+        '''
+            CREATE VIRTUAL TABLE IF NOT EXISTS qna_fts USING fts5(question, content='qna', content_rowid='id');
+            CREATE TRIGGER IF NOT EXISTS qna_ai AFTER INSERT ON qna BEGIN
+                INSERT INTO qna_fts(rowid, question) VALUES (new.id, new.question);
+            END;
+            CREATE TRIGGER IF NOT EXISTS qna_ad AFTER DELETE ON qna BEGIN
+                INSERT INTO qna_fts(qna_fts, rowid, question) VALUES ('delete', old.id, old.question);
+            END;
+            CREATE TRIGGER IF NOT EXISTS qna_au AFTER UPDATE OF question ON qna BEGIN
+                INSERT INTO qna_fts(qna_fts, rowid, question) VALUES ('delete', old.id, old.question);
+                INSERT INTO qna_fts(rowid, question) VALUES (new.id, new.question);
+            END;
+            INSERT INTO qna_fts(qna_fts) VALUES ('rebuild');
+        ''',
+        '''
+            ALTER TABLE qna ADD COLUMN embedding BLOB;
+        ''',
+        '''
+            ALTER TABLE qna ADD COLUMN embedder TEXT;
+        ''',
+    ]
+
+    def __init__(self, db_path: str, embed: Optional[Callable[[str], np.ndarray]] = None, embedder_name: Optional[str] = None):
+        """
+        Args:
+            db_path: Path of the database file.
+            embed: Optional question embedding function enabling the vector part of the search.
+            embedder_name: Identifies embed. Rows embedded without a name are only checked for their dimension.
+        """
+        self.embed = embed
+        self.embedder_name = embedder_name
+        self._vectors = None
+        self._vectors_stamp = None
+        super().__init__(db_path)
+
+    def _embedding_blob(self, question: str, embedding=None) -> Optional[bytes]:
+        if embedding is None and self.embed is not None:
+            embedding = self.embed(question)
+        if embedding is None:
+            return None
+        return np.asarray(embedding, dtype=np.float32).ravel().tobytes()
+
+    def add_qna(self, question: str, answer: str, embedding=None) -> int:
+        """Adds a new QNA entry to the database and returns its id."""
+        return self.write('''
+            INSERT INTO qna (question, answer, embedding, embedder) VALUES (?, ?, ?, ?)
+        ''', (question, answer, self._embedding_blob(question, embedding), self.embedder_name))
+
+    def add_qna_many(self, entries: Iterable[tuple]) -> int:
+        """
+        Adds (question, answer) or (question, answer, embedding) entries in a single transaction.
+
+        Returns:
+            The number of entries added.
+        """
+        rows = [(entry[0], entry[1], self._embedding_blob(entry[0], entry[2] if len(entry) > 2 else None), self.embedder_name) for entry in entries]
+        with self.transaction() as cursor:
+            cursor.executemany('''
+                INSERT INTO qna (question, answer, embedding, embedder) VALUES (?, ?, ?, ?)
+            ''', rows)
+        return len(rows)
+
+    def _fts_query(self, text: str) -> str:
+        # Every word is quoted so that user text can't be read as FTS5 syntax
+        return " OR ".join(f'"{word}"' for word in _WORD_RE.findall(text))
+
+    def search_bm25(self, search_term: str, limit: int = 50) -> dict:
+        """BM25 relevance (higher is better) of the best matching questions, by id."""
+        query = self._fts_query(search_term)
+        if not query:
+            return {}
+        rows = self.fetchall('''
+            SELECT rowid, bm25(qna_fts) FROM qna_fts WHERE qna_fts MATCH ? ORDER BY bm25(qna_fts) LIMIT ?
+        ''', (query, limit))
+        return {row[0]: -row[1] for row in rows}
+
+    def _load_vectors(self, dim: int):
+        """The ids and normalized embeddings of the rows embedded by the current embedder with dim dimensions."""
+        stamp = (*self.fetchone("SELECT count(embedding), max(id) FROM qna"), dim)
+        if self._vectors is None or stamp != self._vectors_stamp:
+            ids, vectors = [], []
+            rows = self.iter_rows('''
+                SELECT id, embedding FROM qna
+                WHERE embedding IS NOT NULL AND length(embedding) = ? AND (embedder IS NULL OR ? IS NULL OR embedder = ?)
+            ''', (4 * dim, self.embedder_name, self.embedder_name), batch_size=1000)
+            for row_id, blob in rows:
+                ids.append(row_id)
+                vectors.append(np.frombuffer(blob, dtype=np.float32))
+            if vectors:
+                matrix = np.stack(vectors)
+                matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+            else:
+                matrix = np.zeros((0, 0), dtype=np.float32)
+            self._vectors = (np.array(ids, dtype=np.int64), matrix)
+            self._vectors_stamp = stamp
+        return self._vectors
+
+    def search_vectors(self, search_term: str, limit: int = 50) -> dict:
+        """Cosine similarity of the closest question embeddings, by id."""
+        if self.embed is None:
+            return {}
+        query = np.asarray(self.embed(search_term), dtype=np.float32).ravel()
+        query /= max(float(np.linalg.norm(query)), 1e-12)
+        ids, matrix = self._load_vectors(len(query))
+        if len(ids) == 0:
+            return {}
+        scores = matrix @ query
+        top = np.argpartition(-scores, min(limit, len(scores)) - 1)[:limit]
+        return {int(ids[i]): float(scores[i]) for i in top}
+
+    def search(self, search_term: str, limit: int = 10, alpha: float = 0.5) -> List[Tuple[int, str, str, float]]:
+        """
+        Hybrid search fusing the scaled BM25 and cosine scores.
+
+        Args:
+            alpha: Weight of BM25, the vector similarity gets 1 - alpha. Without embeddings only BM25 is used.
+        Returns:
+            (id, question, answer, score) tuples, best first.
+        """
+        bm25 = _scale(self.search_bm25(search_term, limit * 4))
+        vectors = _scale(self.search_vectors(search_term, limit * 4))
+        if not vectors:
+            alpha = 1.0
+        elif not bm25:
+            alpha = 0.0
+        fused = {key: alpha * bm25.get(key, 0.0) + (1 - alpha) * vectors.get(key, 0.0) for key in set(bm25) | set(vectors)}
+        best = sorted(fused.items(), key=lambda item: -item[1])[:limit]
+        if not best:
+            return []
+        placeholders = ",".join("?" * len(best))
+        rows = {row[0]: row for row in self.fetchall(f"SELECT id, question, answer FROM qna WHERE id IN ({placeholders})", tuple(key for key, _ in best))}
+        return [(*rows[key], score) for key, score in best if key in rows]
+
+    def search_similar_questions(self, search_term: str, limit: int = 10) -> List[Tuple[int, str, str]]:
+        """Searches for similar questions in the database, best matches first."""
+        return [(row_id, question, answer) for row_id, question, answer, _ in self.search(search_term, limit)]
 
     def get_answer(self, question_id: int) -> str:
         """Gets the answer to a question by its ID. Because every question deserves an answer, right?"""
-        self.cursor.execute('''
+        result = self.fetchone('''
             SELECT answer FROM qna WHERE id = ?
         ''', (question_id,))
-        result = self.cursor.fetchone()
         return result[0] if result else "No answer found. Oops!"
 
-    def close(self):
-        """Closes the database connection. Because even databases need a break!"""
-        self.connection.close()
-
 
 class Processor(APScript):
     """
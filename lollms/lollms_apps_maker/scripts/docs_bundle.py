@@ -0,0 +1,139 @@
+"""
+Cached documentation bundle of the lollms apps maker.
+
+Every generation step (plan, description, index, server, updates, docs) pastes
+the documentation of the enabled libraries in its prompt. The documents are
+read and split into sections once, with the token count of each section, and
+reloaded only when their modification time changes. A bundle is cached by its
+ordered list of parts, so building it again for the next step costs a
+dictionary lookup and its size is known without tokenizing it.
+
+The relevant mode keeps, within a token budget, only the sections closest to
+the user request, plus the instructions that are not documentation.
+"""
+import re
+import threading
+import numpy as np
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+from zoo_common.context_packing import ContextItem, ContextPacker
+from zoo_common.embeddings import HashingEmbedder, normalize
+
+_HEADER_RE = re.compile(r"^#{1,6}\s")
+
+# Part of a bundle: ("doc", file name) or ("text", literal text)
+Part = Tuple[str, str]
+
+
+class DocSection:
+    def __init__(self, doc: str, index: int, title: str, text: str, nb_tokens: int, vector: np.ndarray) -> None:
+        self.doc = doc
+        self.index = index
+        self.title = title
+        self.text = text
+        self.nb_tokens = nb_tokens
+        self.vector = vector
+
+
+def split_sections(text: str) -> List[Tuple[str, str]]:
+    """Splits a markdown text on its headers into (title, text) pairs, the text before the first header has an empty title."""
+    sections = []
+    title, lines = "", []
+    for line in text.splitlines(keepends=True):
+        if _HEADER_RE.match(line) and lines:
+            sections.append((title, "".join(lines)))
+            lines = []
+        if _HEADER_RE.match(line):
+            title = line.strip("# \n")
+        lines.append(line)
+    if lines:
+        sections.append((title, "".join(lines)))
+    return sections
+
+
+class DocsBundle:
+    """
+    Args:
+        folder: Folder holding the markdown documentation files.
+        count_tokens: Token counter of the current model.
+    """
+    def __init__(self, folder: Path, count_tokens: Callable[[str], int]) -> None:
+        self.folder = Path(folder)
+        self.count_tokens = count_tokens
+        self.embed = HashingEmbedder(2048)
+        self.docs: Dict[str, Tuple[tuple, List[DocSection]]] = {}
+        self.bundles: Dict[tuple, Tuple[str, int]] = {}
+        self.lock = threading.Lock()
+
+    def _stamp(self, name: str) -> tuple:
+        stat = (self.folder / name).stat()
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def sections(self, name: str) -> List[DocSection]:
+        """The sections of a documentation file, read again only when it changed."""
+        stamp = self._stamp(name)
+        with self.lock:
+            cached = self.docs.get(name)
+            if cached is not None and cached[0] == stamp:
+                return cached[1]
+        with open(self.folder / name, "r", errors="ignore") as f:
+            text = f.read() + "\n"
+        sections = [
+            DocSection(name, i, title, section_text, self.count_tokens(section_text), normalize(self.embed(f"{title}\n{section_text}")))
+            for i, (title, section_text) in enumerate(split_sections(text))
+        ]
+        with self.lock:
+            self.docs[name] = (stamp, sections)
+        return sections
+
+    def _key(self, parts: List[Part]) -> tuple:
+        return tuple((kind, value, self._stamp(value) if kind == "doc" else None) for kind, value in parts)
+
+    def build(self, parts: List[Part]) -> Tuple[str, int]:
+        """
+        Returns:
+            The full bundle text and its size in tokens.
+        """
+        key = self._key(parts)
+        with self.lock:
+            if key in self.bundles:
+                return self.bundles[key]
+        texts, nb_tokens = [], 0
+        for kind, value in parts:
+            if kind == "doc":
+                sections = self.sections(value)
+                texts += [section.text for section in sections]
+                nb_tokens += sum(section.nb_tokens for section in sections)
+            else:
+                texts.append(value)
+                nb_tokens += self.count_tokens(value)
+        bundle = ("".join(texts), nb_tokens)
+        with self.lock:
+            self.bundles[key] = bundle
+        return bundle
+
+    def build_relevant(self, parts: List[Part], query: str, budget: int) -> Tuple[str, int]:
+        """
+        Returns:
+            The bundle keeping the instructions and, within budget tokens, the documentation
+            sections closest to the query, in their original order, and its size in tokens.
+        """
+        text_parts = [(i, value, self.count_tokens(value)) for i, (kind, value) in enumerate(parts) if kind == "text"]
+        budget -= sum(nb_tokens for _, _, nb_tokens in text_parts)
+        query_vector = normalize(self.embed(query))
+        items = []
+        for i, (kind, value) in enumerate(parts):
+            if kind != "doc":
+                continue
+            for section in self.sections(value):
+                score = float(section.vector @ query_vector)
+                if section.index == 0:
+                    # The opening section tells what the library is and how to load it
+                    score += 0.1
+                items.append(ContextItem(section.text, score, section.nb_tokens, value, {"part": i, "index": section.index}))
+        packed = ContextPacker(self.count_tokens, dedup_threshold=1.0).pack(items, max(0, budget))
+        selected = [(item.metadata["part"], item.metadata["index"], item.text, item.nb_tokens) for item in packed.items]
+        selected += [(i, 0, value, nb_tokens) for i, value, nb_tokens in text_parts]
+        selected.sort(key=lambda entry: (entry[0], entry[1]))
+        return "".join(entry[2] for entry in selected), sum(entry[3] for entry in selected)
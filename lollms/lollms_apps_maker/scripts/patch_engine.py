@@ -0,0 +1,388 @@
+"""
+Patch application for the lollms apps maker edit mode.
+
+The model answers an update request with small edits instead of the whole
+file. Edits can be written as:
+
+    - search/replace blocks:
+        <<<<<<< SEARCH
+        old lines
+        =======
+        new lines
+        >>>>>>> REPLACE
+    - the # REPLACE / # ORIGINAL / # SET blocks of the previous prompts
+    - unified diffs (@@ -start,count +start,count @@ hunks)
+    - a # FULL_REWRITE block holding the whole new file
+
+The lines to replace are searched exactly first, then ignoring whitespace and
+blank lines, then approximately around lines that match the first or last
+lines of the search text. Candidate windows are found with a rolling hash over
+the line hashes, so exact and whitespace insensitive lookups stay linear in the
+size of the file. All the hunks are located in the original file and applied
+in one pass, and the result is checked (Python compile, HTML tag balance)
+before it is written.
+"""
+import re
+import zlib
+import difflib
+from collections import Counter
+from html.parser import HTMLParser
+from typing import List, Optional, Tuple
+
+_HUNK_HEADER_RE = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+_MARKER_RE = re.compile(r"^\s*(?:#|//|<!--)?\s*(REPLACE|ORIGINAL|SET|FULL_REWRITE)\s*(?:-->)?\s*$")
+_SPACES_RE = re.compile(r"\s+")
+
+_HASH_BASE = 1_000_003
+_HASH_MOD = (1 << 61) - 1
+
+
+class Hunk:
+    """
+    Args:
+        search: Lines to replace. Empty to insert at line_hint, or at the end of the file.
+        replace: New lines.
+        line_hint: 0 based line where the search text is expected, when the patch tells it.
+    """
+    def __init__(self, search: List[str], replace: List[str], line_hint: Optional[int] = None) -> None:
+        self.search = search
+        self.replace = replace
+        self.line_hint = line_hint
+
+
+class PatchResult:
+    def __init__(self, text: str, applied: int, failures: List[str], full_rewrite: bool = False) -> None:
+        self.text = text
+        self.applied = applied
+        self.failures = failures
+        self.full_rewrite = full_rewrite
+
+    @property
+    def ok(self) -> bool:
+        return not self.failures and (self.applied > 0 or self.full_rewrite)
+
+
+def _normalize(line: str) -> str:
+    return _SPACES_RE.sub(" ", line).strip()
+
+
+def _indent(line: str) -> str:
+    return line[:len(line) - len(line.lstrip())]
+
+
+def parse_unified_diff(text: str) -> List[Hunk]:
+    hunks = []
+    current = None
+    for line in text.splitlines():
+        header = _HUNK_HEADER_RE.match(line)
+        if header:
+            current = Hunk([], [], max(0, int(header.group(1)) - 1))
+            hunks.append(current)
+            continue
+        if current is None or line.startswith(("---", "+++", "\\")):
+            continue
+        if line.startswith("-"):
+            current.search.append(line[1:])
+        elif line.startswith("+"):
+            current.replace.append(line[1:])
+        else:
+            # Models often drop the leading space of empty context lines
+            context = line[1:] if line.startswith(" ") else line
+            current.search.append(context)
+            current.replace.append(context)
+    return hunks
+
+
+def parse_search_replace(text: str) -> List[Hunk]:
+    hunks = []
+    state, search, replace = None, [], []
+    for line in text.splitlines():
+        stripped = line.strip()
+        if stripped.startswith("<<<<<<<") and "SEARCH" in stripped:
+            state, search, replace = "search", [], []
+        elif stripped.startswith("=======") and state == "search":
+            state = "replace"
+        elif stripped.startswith(">>>>>>>") and state == "replace":
+            hunks.append(Hunk(search, replace))
+            state = None
+        elif state == "search":
+            search.append(line)
+        elif state == "replace":
+            replace.append(line)
+    return hunks
+
+
+def parse_replace_blocks(text: str) -> Tuple[List[Hunk], Optional[str]]:
+    """Parses # REPLACE / # ORIGINAL / # SET blocks. Returns the hunks and the full rewrite if there is one."""
+    hunks = []
+    state, search, replace = None, [], []
+    lines = text.splitlines()
+    for i, line in enumerate(lines):
+        marker = _MARKER_RE.match(line)
+        if marker:
+            kind = marker.group(1)
+            if kind == "FULL_REWRITE":
+                return [], "\n".join(lines[i + 1:])
+            if kind in ("REPLACE", "ORIGINAL") and state == "set":
+                hunks.append(Hunk(search, replace))
+                search, replace = [], []
+            if kind == "ORIGINAL":
+                state = "original"
+            elif kind == "SET":
+                state = "set"
+            continue
+        if state == "original":
+            search.append(line)
+        elif state == "set":
+            replace.append(line)
+    if state == "set":
+        hunks.append(Hunk(search, replace))
+    return hunks, None
+
+
+def parse_patches(blocks: List[str]) -> Tuple[List[Hunk], Optional[str]]:
+    """
+    Reads the edits of the model from the content of its code blocks.
+
+    Returns:
+        The hunks and, when the model chose to rewrite the file, the new file content.
+    """
+    hunks = []
+    for block in blocks:
+        if "<<<<<<<" in block and ">>>>>>>" in block:
+            hunks += parse_search_replace(block)
+        elif any(_HUNK_HEADER_RE.match(line) for line in block.splitlines()):
+            hunks += parse_unified_diff(block)
+        else:
+            block_hunks, full_rewrite = parse_replace_blocks(block)
+            if full_rewrite is not None:
+                return [], full_rewrite
+            hunks += block_hunks
+    return hunks, None
+
+
+def _line_hash(line: str) -> int:
+    return zlib.crc32(line.encode("utf8"))
+
+
+def find_all(haystack: List[int], needle: List[int]) -> List[int]:
+    """Start positions of needle in haystack, sequences of line hashes compared with a rolling hash."""
+    m = len(needle)
+    if m == 0 or m > len(haystack):
+        return []
+    target = 0
+    for h in needle:
+        target = (target * _HASH_BASE + h) % _HASH_MOD
+    power = pow(_HASH_BASE, m - 1, _HASH_MOD)
+    window = 0
+    positions = []
+    for i, h in enumerate(haystack):
+        if i >= m:
+            window = (window - haystack[i - m] * power) % _HASH_MOD
+        window = (window * _HASH_BASE + h) % _HASH_MOD
+        if i >= m - 1 and window == target and haystack[i - m + 1:i + 1] == needle:
+            positions.append(i - m + 1)
+    return positions
+
+
+class PatchEngine:
+    """
+    Args:
+        fuzzy_threshold: Minimum similarity ratio of an approximate match.
+    """
+    def __init__(self, fuzzy_threshold: float = 0.85) -> None:
+        self.fuzzy_threshold = fuzzy_threshold
+
+    def _closest(self, positions: List[int], hint: Optional[int]) -> int:
+        if hint is None:
+            return positions[0]
+        return min(positions, key=lambda p: abs(p - hint))
+
+    def locate(self, lines: List[str], search: List[str], hint: Optional[int] = None) -> Optional[Tuple[int, int, bool]]:
+        """
+        Returns:
+            The [start, end) range of the lines matching search and whether it was an exact match, None when not found.
+        """
+        exact = find_all([_line_hash(line) for line in lines], [_line_hash(line) for line in search])
+        if exact:
+            start = self._closest(exact, hint)
+            return start, start + len(search), True
+
+        # Whitespace and blank lines are ignored, positions are mapped back to the file lines
+        kept = [i for i, line in enumerate(lines) if line.strip()]
+        normalized = [_normalize(lines[i]) for i in kept]
+        needle = [_normalize(line) for line in search if line.strip()]
+        if not needle:
+            return None
+        loose = find_all([_line_hash(line) for line in normalized], [_line_hash(line) for line in needle])
+        if loose:
+            start = self._closest([kept[p] for p in loose], hint)
+            p = kept.index(start)
+            return start, kept[p + len(needle) - 1] + 1, False
+
+        # Approximate match of windows anchored on a line equal to one of the first or last search lines
+        m = len(needle)
+        candidates = set()
+        for offset in {0, 1, m - 2, m - 1}:
+            if 0 <= offset < m:
+                for p, line in enumerate(normalized):
+                    if line == needle[offset] and 0 <= p - offset <= len(normalized) - m:
+                        candidates.add(p - offset)
+        needle_text = "\n".join(needle)
+        best, best_ratio = None, self.fuzzy_threshold
+        for p in sorted(candidates):
+            matcher = difflib.SequenceMatcher(None, "\n".join(normalized[p:p + m]), needle_text, autojunk=False)
+            if matcher.real_quick_ratio() < best_ratio or matcher.quick_ratio() < best_ratio:
+                continue
+            ratio = matcher.ratio()
+            if ratio > best_ratio or (ratio == best_ratio and best is None):
+                best, best_ratio = p, ratio
+        if best is None:
+            return None
+        return kept[best], kept[best + m - 1] + 1, False
+
+    def _reindent(self, replace: List[str], search: List[str], matched: List[str]) -> List[str]:
+        """
+        Gives the replacement the indentation of the matched lines.
+
+        Indentation widths of the search text are mapped linearly to the widths of the
+        matched lines they align with, which handles both a shift and a different indent size.
+        """
+        pairs = sorted({(len(_indent(a)), len(_indent(b))) for a, b in zip([line for line in search if line.strip()], [line for line in matched if line.strip()])})
+        if not pairs or all(a == b for a, b in pairs):
+            return replace
+        (s1, m1), scale = pairs[0], 1.0
+        wider = [(s, m) for s, m in pairs if s > s1 and m > m1]
+        if wider:
+            scale = (wider[0][1] - m1) / (wider[0][0] - s1)
+        unit = "\t" if any(_indent(line).startswith("\t") for line in matched) else " "
+        result = []
+        for line in replace:
+            if not line.strip():
+                result.append(line)
+                continue
+            width = max(0, round(m1 + (len(_indent(line)) - s1) * scale))
+            result.append(unit * width + line.lstrip())
+        return result
+
+    def apply(self, text: str, hunks: List[Hunk]) -> PatchResult:
+        """Locates all the hunks in text and applies those that were found and don't overlap."""
+        lines = text.splitlines()
+        located = []
+        failures = []
+        for number, hunk in enumerate(hunks, start=1):
+            if not hunk.search:
+                position = len(lines) if hunk.line_hint is None else min(hunk.line_hint, len(lines))
+                located.append((position, position, hunk.replace))
+                continue
+            found = self.locate(lines, hunk.search, hunk.line_hint)
+            if found is None:
+                failures.append(f"hunk {number}: lines to replace not found:\n" + "\n".join(hunk.search[:5]))
+                continue
+            start, end, exact = found
+            replace = hunk.replace if exact else self._reindent(hunk.replace, hunk.search, lines[start:end])
+            located.append((start, end, replace))
+
+        located.sort(key=lambda entry: (entry[0], entry[1]))
+        applied = []
+        for entry in located:
+            if applied and entry[0] < applied[-1][1]:
+                failures.append(f"hunk replacing lines {entry[0] + 1}-{entry[1]} overlaps another hunk")
+                continue
+            applied.append(entry)
+        for start, end, replace in reversed(applied):
+            lines[start:end] = replace
+        new_text = "\n".join(lines) + ("\n" if text.endswith("\n") else "")
+        return PatchResult(new_text, len(applied), failures)
+
+    def apply_blocks(self, text: str, blocks: List[str]) -> PatchResult:
+        hunks, full_rewrite = parse_patches(blocks)
+        if full_rewrite is not None:
+            return PatchResult(full_rewrite, 0, [], full_rewrite=True)
+        if not hunks:
+            return PatchResult(text, 0, ["no edit found in the answer"])
+        return self.apply(text, hunks)
+
+
+class _TagBalanceChecker(HTMLParser):
+    VOID = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "param", "source", "track", "wbr", "!doctype"}
+    # Elements whose closing tag can be omitted
+    OPTIONAL = {"html", "head", "body", "p", "li", "dt", "dd", "tr", "td", "th", "thead", "tbody", "tfoot", "option", "optgroup", "colgroup", "caption", "rt", "rp"}
+
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.stack: List[Tuple[str, int]] = []
+        self.errors: List[Tuple[int, str]] = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag not in self.VOID:
+            self.stack.append((tag, self.getpos()[0]))
+
+    def handle_startendtag(self, tag, attrs):
+        pass
+
+    def handle_endtag(self, tag):
+        if tag in self.VOID:
+            return
+        if not any(open_tag == tag for open_tag, _ in self.stack):
+            self.errors.append((self.getpos()[0], f"unexpected </{tag}>"))
+            return
+        while self.stack:
+            open_tag, line = self.stack.pop()
+            if open_tag == tag:
+                break
+            if open_tag not in self.OPTIONAL:
+                self.errors.append((line, f"<{open_tag}> is not closed"))
+
+
+def find_problems(text: str, language: str) -> List[Tuple[Optional[int], str]]:
+    """The (line, description) of the problems found in the code, python only reports its first syntax error."""
+    if language == "python":
+        try:
+            compile(text, "<patched>", "exec")
+        except SyntaxError as ex:
+            return [(ex.lineno, ex.msg)]
+        return []
+    if language == "html":
+        checker = _TagBalanceChecker()
+        try:
+            checker.feed(text)
+            checker.close()
+        except Exception as ex:
+            return [(None, str(ex))]
+        checker.errors += [(line, f"<{tag}> is not closed") for tag, line in checker.stack if tag not in checker.OPTIONAL]
+        return checker.errors
+    return []
+
+
+def _format_problems(problems: List[Tuple[Optional[int], str]]) -> Optional[str]:
+    if not problems:
+        return None
+    return "\n".join(description if line is None else f"line {line}: {description}" for line, description in problems[:5])
+
+
+def verify(text: str, language: str) -> Optional[str]:
+    """Returns the problem found in the code, None when it looks valid."""
+    return _format_problems(find_problems(text, language))
+
+
+def verify_patch(original: str, text: str, language: str) -> Optional[str]:
+    """
+    Returns the problems the patch introduced, None when it introduced none.
+
+    Problems the original code already had are not held against the patch, otherwise a file
+    that is already broken could never be edited. They are matched by description as the
+    edit moves their lines. Python stops at its first syntax error, so a patch to a file that
+    didn't compile is never rejected.
+    """
+    before = find_problems(original, language)
+    if before and language == "python":
+        return None
+    remaining = Counter(description for _, description in before)
+    introduced = []
+    for line, description in find_problems(text, language):
+        if remaining[description] > 0:
+            remaining[description] -= 1
+        else:
+            introduced.append((line, description))
+    return _format_problems(introduced)
@@ -29,6 +29,14 @@ import shutil
 import yaml
 import git
 import json
+import sys
+
+sys.path.append(str(Path(__file__).parent))
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+from zoo_common.context_packing import TokenCounter
+from docs_bundle import DocsBundle
+from patch_engine import PatchEngine, verify_patch
+from repo_manager import get_app_repository
 
 class Processor(APScript):
     """
@@ -66,6 +74,8 @@ class Processor(APScript):
                 {"name":"project_path", "type":"str", "value":"", "help":"Path to the current project."},
                 {"name":"server_port_number", "type":"int", "value":8000, "help":"If a backend is active, use this port number"},                
                 {"name":"update_mode", "type":"str", "value":"rewrite", "options":["rewrite","edit"], "help":"The update mode specifies if the AI needs to rewrite the whole code which is a good idea if the code is not long or just update parts of the code which is more suitable for long codes."},
+                {"name":"undo_history_size", "type":"int", "value":10, "help":"The number of updates of an application that can be undone with the undo command"},
+                {"name":"patch_fuzzy_threshold", "type":"float", "value":0.85, "help":"In edit mode, the minimum similarity between the code the AI wants to replace and the code found in the file when they don't match exactly"},
                 {"name":"interactive_mode", "type":"bool", "value":False, "help":"Activate this mode to start talking to the AI about snippets of your code. The AI will generate updates depending on your own requirements in an interactive way."},
                 {"name":"build_a_backend", "type":"bool", "value":False, "help":"Builds a backend server.py. Required if a serverside code is required"},
                 {"name":"create_a_plan", "type":"bool", "value":False, "help":"Create a plan for the app before starting."},
@@ -82,6 +92,8 @@ class Processor(APScript):
                 {"name":"use_lollms_flow_library", "type":"bool", "value":False, "help":"Activate this library if you want to use lollms flow library in your application into multiple languages."},
                 {"name":"lollms_anything_to_markdown_library", "type":"bool", "value":False, "help":"Activate this library if you want to use lollms anything to markdown library which allows you to read any text type of files and returns it as markdown (useful for RAG)."},
                 {"name":"lollms_markdown_renderer", "type":"bool", "value":False, "help":"Activate this library if you want to use lollms markdown renderer that allows you to render markdown text with support for headers, tables, code as well as converting mermaid code into actual mermaid graphs"},
+                {"name":"docs_mode", "type":"str", "value":"full", "options":["full","relevant"], "help":"full gives the whole documentation of the activated libraries to the AI. relevant only gives the sections of the documentation closest to your request, within docs_token_budget"},
+                {"name":"docs_token_budget", "type":"int", "value":2048, "help":"In relevant docs mode, the maximum number of tokens of documentation given to the AI"},
 
                 # Boolean configuration for enabling scripted AI
                 #{"name":"make_scripted", "type":"bool", "value":False, "help":"Enables a scripted AI that can perform operations using python scripts."},
@@ -126,12 +138,17 @@ class Processor(APScript):
                                     "name": "idle",
                                     "commands": {
                                         "help": self.help, # Command triggering the help method
+                                        "undo_last_update": self.undo_last_update,
                                     },
                                     "default": None
                                 },                           
                             ],
                             callback=callback
                         )
+        self.docs_bundle = None
+        self.docs_bundle_model = None
+        self.docs_query = ""
+        self.patch_engine = PatchEngine()
 
     def mounted(self):
         """
@@ -203,63 +220,72 @@ class Processor(APScript):
         # available commands, and user context.
         self.set_message_content(self.personality.help)
         
-    def get_lollms_infos(self):
-        if self.personality_config.use_lollms_library:
-            with open(Path(__file__).parent.parent/"assets"/"docs"/"lollms_client_js_info.md","r", errors="ignore") as f:
-                lollms_infos = f.read() + "\n"
+    def get_repository(self, app_path):
+        """The repository manager of an application, git operations run on its background thread."""
+        return get_app_repository(app_path, self.personality_config.undo_history_size, on_error=lambda ex: ASCIIColors.error(f"Git error: {ex}"))
+
+    def undo_last_update(self, prompt="", full_context=""):
+        if self.personality_config.project_path=="":
+            self.set_message_content("No application is selected. Set the project path in the settings or create an application first.")
+            return
+        message = self.get_repository(self.personality_config.project_path).undo()
+        if message is None:
+            self.set_message_content("There is no update to undo in this session.")
         else:
-            lollms_infos = ""
-        
-        
+            self.set_message_content(f"Undid: {message}")
+
+    def get_docs_bundle(self):
+        """The documentation bundle of the mounted model, rebuilt when the model changes as its token counts depend on the tokenizer."""
+        if self.docs_bundle is None or self.docs_bundle_model is not self.personality.model:
+            self.docs_bundle_model = self.personality.model
+            self.docs_bundle = DocsBundle(Path(__file__).parent.parent/"assets"/"docs", TokenCounter(self.personality.model.tokenize))
+        return self.docs_bundle
+
+    def get_lollms_infos_parts(self):
+        """The documentation files and instructions to give to the model, in order."""
+        parts = []
+        if self.personality_config.use_lollms_library:
+            parts.append(("doc", "lollms_client_js_info.md"))
         if self.personality_config.force_lollms_multisupport:
-            lollms_infos += f"{self.system_custom_header('important instruction')}Make sure to add a settings pannel that allows the user to select the lollms host and the ELF_GENERATION_FORMAT.\n"
-
+            parts.append(("text", f"{self.system_custom_header('important instruction')}Make sure to add a settings pannel that allows the user to select the lollms host and the ELF_GENERATION_FORMAT.\n"))
         if self.personality_config.use_lollms_rag_library:
-            with open(Path(__file__).parent.parent/"assets"/"docs"/"lollms_rag_info.md","r", errors="ignore") as f:
-                lollms_infos += f.read() + "\n"
-
+            parts.append(("doc", "lollms_rag_info.md"))
         if self.personality_config.use_lollms_image_gen_library:
-            with open(Path(__file__).parent.parent/"assets"/"docs"/"lollms_tti.md","r", errors="ignore") as f:
-                lollms_infos += f.read() + "\n"
-
-
+            parts.append(("doc", "lollms_tti.md"))
         if self.personality_config.use_lollms_speach_library:
-            with open(Path(__file__).parent.parent/"assets"/"docs"/"lollms_speach.md","r", errors="ignore") as f:
-                lollms_infos += f.read() + "\n"
-
-
+            parts.append(("doc", "lollms_speach.md"))
         if self.personality_config.use_lollms_localization_library:
-            with open(Path(__file__).parent.parent/"assets"/"docs"/"lollms_auto_localizer.md","r", errors="ignore") as f:
-                lollms_infos += f.read() + "\n"
-
+            parts.append(("doc", "lollms_auto_localizer.md"))
         if self.personality_config.use_lollms_flow_library:
-            with open(Path(__file__).parent.parent/"assets"/"docs"/"lollms_flow.md","r", errors="ignore") as f:
-                lollms_infos += f.read() + "\n"
-
+            parts.append(("doc", "lollms_flow.md"))
         if self.personality_config.lollms_anything_to_markdown_library:
-            with open(Path(__file__).parent.parent/"assets"/"docs"/"lollms_anything_to_markdown.md","r", errors="ignore") as f:
-                lollms_infos += f.read() + "\n"
-
+            parts.append(("doc", "lollms_anything_to_markdown.md"))
         if self.personality_config.lollms_markdown_renderer:
-            with open(Path(__file__).parent.parent/"assets"/"docs"/"lollms_markdown_renderer.md","r", errors="ignore") as f:
-                lollms_infos += f.read() + "\n"
-
+            parts.append(("doc", "lollms_markdown_renderer.md"))
         if self.personality_config.lollms_theme:
-            with open(Path(__file__).parent.parent/"assets"/"docs"/"lollms_theme.md","r", errors="ignore") as f:
-                lollms_infos += f.read() + "\n"
+            parts.append(("doc", "lollms_theme.md"))
         if self.personality_config.use_vue_js:
-            lollms_infos += f"{self.system_custom_header('important instruction')}Please use vue3.\n"
+            parts.append(("text", f"{self.system_custom_header('important instruction')}Please use vue3.\n"))
         if self.personality_config.use_tailwind_css:
-            lollms_infos += f"{self.system_custom_header('important instruction')}Please use tailwindcss for styling.\n"
+            parts.append(("text", f"{self.system_custom_header('important instruction')}Please use tailwindcss for styling.\n"))
+        if self.personality_config.use_lollms_tasks_library:
+            parts.append(("doc", "lollms_taskslib_js_info.md"))
+        return parts
 
-        
+    def get_lollms_infos(self, query=None):
+        """
+        Returns the documentation of the enabled libraries.
+
+        In relevant docs mode, only the sections closest to query (the current user request by default) are kept.
+        """
+        query = self.docs_query if query is None else query
+        bundle = self.get_docs_bundle()
+        parts = self.get_lollms_infos_parts()
+        if self.personality_config.docs_mode=="relevant" and query:
+            lollms_infos, ltk = bundle.build_relevant(parts, query, self.personality_config.docs_token_budget)
+        else:
+            lollms_infos, ltk = bundle.build(parts)
 
-        if self.personality_config.use_lollms_tasks_library:
-            with open(Path(__file__).parent.parent/"assets"/"docs"/"lollms_taskslib_js_info.md","r", errors="ignore") as f:
-                lollms_infos += f.read()
-        
-        tk = self.personality.model.tokenize(lollms_infos)
-        ltk = len(tk)
         if ltk>self.personality.config.ctx_size:
             ASCIIColors.red("WARNING! The lollms_infos is bigger than the context. The quality will be reduced and the mùodel may fail!!")        
             self.warning("WARNING! The lollms_infos is bigger than the context. The quality will be reduced and the mùodel may fail!!")
@@ -445,21 +471,7 @@ disclaimer: {old_infos.get("disclaimer", "[If needed, write a disclaimer. else n
         if self.config.debug:
             ASCIIColors.yellow("--- Code file ---")
             ASCIIColors.yellow(code)
-        app_path = metadata["app_path"]
         if len(code)>0:
-            # Backup the existing index.html file
-            index_file_path = Path(metadata["app_path"]) / "index.html"
-            if index_file_path.exists():
-                try:
-                    if not (Path(app_path) / ".git").exists():
-                        repo = git.Repo.init(app_path)
-                    else:
-                        repo = git.Repo(app_path)
-                    # Stage the current version of index.html
-                    repo.index.add([os.path.relpath(index_file_path, app_path)])
-                    repo.index.commit(f"Backup before update.")
-                except Exception as ex:
-                    trace_exception(ex)
             self.step_end("Building index.html")
             return code
         else:
@@ -506,23 +518,7 @@ Infos: The client will be running on an server that is not the same as the one w
             ASCIIColors.yellow("--- Code file ---")
             ASCIIColors.yellow(code)
         
-        app_path = metadata["app_path"]
         if len(code) > 0:
-            # Backup the existing server.py file
-            server_file_path = Path(metadata["app_path"]) / "server.py"
-            if server_file_path.exists():
-                try:
-                    if not (Path(app_path) / ".git").exists():
-                        repo = git.Repo.init(app_path)
-                    else:
-                        repo = git.Repo(app_path)
-
-                    # Stage the current version of server.py
-                    repo.index.add([os.path.relpath(server_file_path, app_path)])
-                    repo.index.commit("Backup before update")
-                except Exception as ex:
-                    trace_exception(ex)
-            
             self.step_end("Building server.py")
 
             return code
@@ -532,6 +528,46 @@ Infos: The client will be running on an server that is not the same as the one w
             return None
 
 
+    def get_patch_instructions(self, language):
+        return [
+            "Only write the parts of the code to change, using search/replace blocks:",
+            f"```{language}",
+            "<<<<<<< SEARCH",
+            "<lines of the original code to change, copied exactly>",
+            "=======",
+            "<new lines replacing them>",
+            ">>>>>>> REPLACE",
+            "```",
+            "Use one block per change and put enough lines in SEARCH to identify the place to change. To add code, search the line just before the insertion point and repeat it at the start of the new lines.",
+            "Unified diffs in a diff code tag are accepted too.",
+            "The new lines must be fully working and without placeholders.",
+            "If too many changes needs to be done, and you think a full rewrite of the code is much more adequate, use this syntax:",
+            f"```{language}",
+            "# FULL_REWRITE",
+            "<new_full_code>",
+            "```",
+            "Select the best between full rewrite and search/replace blocks according to the amount of text to update.",
+        ]
+
+    def patch_code(self, original_content:str, answer:str, language:str):
+        """
+        Applies the edits found in the answer of the model.
+
+        Returns:
+            The new code, or None when the edits could not be applied or introduce problems in the code, and a report.
+        """
+        self.patch_engine.fuzzy_threshold = self.personality_config.patch_fuzzy_threshold
+        codes = self.extract_code_blocks(answer)
+        result = self.patch_engine.apply_blocks(original_content, [code["content"] for code in codes])
+        if not result.ok:
+            return None, "The AI edits could not be applied:\n" + "\n".join(result.failures)
+        problem = verify_patch(original_content, result.text, language)
+        if problem:
+            return None, f"The updated code is not valid, the file was left unchanged:\n{problem}"
+        if result.full_rewrite:
+            return result.text, "The AI rewrote the whole file."
+        return result.text, f"Applied {result.applied} edit(s)."
+
     def update_index(self, prompt, context_details, metadata, out:str):
         if not metadata.get("app_path", None):
             self.set_message_content("""
@@ -560,26 +596,7 @@ Infos: The client will be running on an server that is not the same as the one w
         
         app_path = Path(metadata["app_path"])
         index_file_path = app_path / "index.html"
-
-        # Initialize Git repository if not already initialized
-        self.step_start("Backing up previous version")
-        app_path = Path(metadata["app_path"])
-        try:
-            if not (app_path / ".git").exists():
-                repo = git.Repo.init(app_path)
-            else:
-                repo = git.Repo(app_path)
-
-            # Stage and commit the icon
-            try:
-                repo.index.add([os.path.relpath(index_file_path, app_path)])
-                repo.index.commit("Backing up index.html")        
-            except Exception:
-                pass        
-        except Exception as ex:
-            self.warning(str(ex))
-        self.step_end("Backing up previous version")
-
+        repository = self.get_repository(app_path)
 
 
         self.step_start("Updating index.html")
@@ -620,17 +637,8 @@ Infos: The client will be running on an server that is not the same as the one w
 
             if len(code) > 0:
                 self.step_end("Updating index.html")
-                self.step_start("Backing up previous version")       
-                # Stage the current version of index.html
-                repo.index.add([os.path.relpath(index_file_path, app_path)])
-                repo.index.commit("Backup before update")
-                self.step_end("Backing up previous version")
-                # Write the updated content back to index.html
-                index_file_path.write_text(code, encoding='utf8')
-                
-                # Stage and commit the changes
-                repo.index.add([os.path.relpath(index_file_path, app_path)])
-                repo.index.commit("Update index.html")
+                # Write the updated content back to index.html, the previous version can be restored with undo_last_update
+                repository.write({"index.html": code}, "Update index.html")
                 
                 out += """
 <div class="max-w-md mx-auto my-2">
@@ -652,20 +660,7 @@ Infos: The client will be running on an server that is not the same as the one w
                 [
                     self.system_full_header,
                     "You are Lollms Apps Maker. Your objective is to update the HTML, JavaScript, and CSS code for a specific lollms application.",
-                    "The user gives the code the AI should update the code parts using the following syntax",
-                    "To update existing code:",
-                    "```python",
-                    "# REPLACE",
-                    "# ORIGINAL",
-                    "<old_code>",
-                    "# SET",
-                    "<new_code_snippet>",
-                    "```",
-                    "The ORIGINAL statement (<old_code>) should contain valid code from the orginal code. It should be a full statement and not just a fragment of a statement.",
-                    "The SET statement (<new_code_snippet>) is mandatory. You should put the new lines of code just after it.",
-                    "Make sure if possible to change full statements or functions. The code to SET must be fully working and without placeholders.",
-                    "To add code, use the same REPLACE syntax with the last line before where you must add you new code then in the SET rewrite that line and then the new lines to add.",
-                    "The code to SET must be fully working and without placeholders.",
+                    *self.get_patch_instructions("html"),
                     "Update the code from the user suggestion",
                     self.system_custom_header("context"),
                     context_details.discussion_messages,
@@ -684,29 +679,17 @@ Infos: The client will be running on an server that is not the same as the one w
                 updated_sections = self.generate(crafted_prompt, temperature=0.1, top_k=10, top_p=0.98, debug=True, callback=self.sink)
 
 
-            # Extract code blocks
-            codes = self.extract_code_blocks(updated_sections)
-            if len(codes) > 0:
-                # Stage the current version of index.html
-                repo.index.add([os.path.relpath(index_file_path, app_path)])
-                repo.index.commit("Backup before update")
+            new_content, report = self.patch_code(original_content, updated_sections, "html")
+            if new_content is not None:
+                # Write the updated content back to index.html, the previous version can be restored with undo_last_update
+                repository.write({"index.html": new_content}, "Update index.html")
                 
-                for code_block in codes:
-                    original_code, new_code = self.parse_code_replacement(code_block["content"])
-                    original_content = self.update_code_with_best_match(original_content, original_code, new_code)
-                
-                # Write the updated content back to index.html
-                index_file_path.write_text(original_content, encoding='utf8')
-                
-                # Stage and commit the changes
-                repo.index.add([os.path.relpath(index_file_path, app_path)])
-                repo.index.commit("Update index.html")
-                
-                out += f"Updated index file:\n```html\n{original_content}\n```\n"
+                out += f"{report}\nUpdated index file:\n```html\n{new_content}\n```\n"
+                self.step_end("Updating index.html")
             else:
-                out += "No sections were updated."
-
-            self.step_end("Updating index.html")
+                out += report
+                self.step_end("Updating index.html", False)
+            self.set_message_html(out)
 
 
     def update_server(self, prompt, context_details, metadata, out: str):
@@ -725,22 +708,7 @@ Infos: The client will be running on an server that is not the same as the one w
         
         app_path = Path(metadata["app_path"])
         server_file_path = app_path / "server.py"
-
-        # Initialize Git repository if not already initialized
-        self.step_start("Backing up previous version")
-        app_path = Path(metadata["app_path"])
-        if not (app_path / ".git").exists():
-            repo = git.Repo.init(app_path)
-        else:
-            repo = git.Repo(app_path)
-
-        # Stage and commit the server file
-        try:
-            repo.index.add([os.path.relpath(server_file_path, app_path)])
-            repo.index.commit("Backing up server.py")        
-        except Exception:
-            pass        
-        self.step_end("Backing up previous version")
+        repository = self.get_repository(app_path)
 
         self.step_start("Updating server.py")
         with open(server_file_path, "r", encoding="utf8") as f:
@@ -778,17 +746,8 @@ Infos: The client will be running on an server that is not the same as the one w
 
             if len(code) > 0:
                 self.step_end("Updating server.py")
-                self.step_start("Backing up previous version")       
-                # Stage the current version of server.py
-                repo.index.add([os.path.relpath(server_file_path, app_path)])
-                repo.index.commit("Backup before update")
-                self.step_end("Backing up previous version")
-                # Write the updated content back to server.py
-                server_file_path.write_text(code, encoding='utf8')
-                
-                # Stage and commit the changes
-                repo.index.add([os.path.relpath(server_file_path, app_path)])
-                repo.index.commit("Update server.py")
+                # Write the updated content back to server.py, the previous version can be restored with undo_last_update
+                repository.write({"server.py": code}, "Update server.py")
                 
                 out += full_response
             else:
@@ -803,26 +762,8 @@ Infos: The client will be running on an server that is not the same as the one w
                 [
                     self.system_full_header,
                     "You are Lollms Apps Maker. Your objective is to update the Python code for a specific lollms FastAPI application.",
-                    "The user gives the code the AI should update the code parts using the following syntax",
-                    "To update existing code:",
-                    "```python",
-                    "# REPLACE",
-                    "# ORIGINAL",
-                    "<old_code>",
-                    "# SET",
-                    "<new_code_snippet>",
-                    "```",
-                    "The ORIGINAL statement (<old_code>) should contain valid code from the orginal code. It should be a full statement and not just a fragment of a statement.",
-                    "The SET statement (<new_code_snippet>) is mandatory. You should put the new lines of code just after it.",
-                    "Make sure if possible to change full statements or functions. The code to SET must be fully working and without placeholders.",
-                    "If there is no ambiguity, just use a single line of code for each (first line to be changed and last line to be changed).",
-                    "When providing code changes, make sure to respect the indentation in Python. Only provide the changes, do not repeat unchanged code. Use comments to indicate the type of change.",
-                    "If too many changes needs to be done, and you think a full rewrite of the code is much more adequate, use this syntax:",
-                    "```python",
-                    "# FULL_REWRITE",
-                    "<new_full_code>",
-                    "```",
-                    "Select the best between full rewrite and replace according to the amount of text to update.",
+                    *self.get_patch_instructions("python"),
+                    "When providing code changes, make sure to respect the indentation in Python. Only provide the changes, do not repeat unchanged code.",
                     "Update the code from the user suggestion",
                     self.system_custom_header("context"),
                     context_details.discussion_messages,
@@ -841,33 +782,17 @@ Infos: The client will be running on an server that is not the same as the one w
                 updated_sections = self.generate(crafted_prompt, temperature=0.1, top_k=10, top_p=0.98, debug=True, callback=self.sink)
             self.add_chunk_to_message_content("\n")
 
-            # Extract code blocks
-            codes = self.extract_code_blocks(updated_sections)
-            if len(codes) > 0:
-                # Stage the current version of server.py
-                repo.index.add([os.path.relpath(server_file_path, app_path)])
-                repo.index.commit("Backup before update")
-
-                for code_block in codes:
-                    original_code, new_code = self.parse_code_replacement(code_block["content"])
-                    out_ = self.update_code_with_best_match(original_content, original_code, new_code)
-                    if out_["hasQuery"]:
-                        out += f"Updated server file with new code\n"
-                    else:
-                        print(f"Warning: The AI did not manage to update the code!")
-                
-                # Write the updated content back to server.py
-                server_file_path.write_text(out_["updatedCode"], encoding='utf8')
-                
-                # Stage and commit the changes
-                repo.index.add([os.path.relpath(server_file_path, app_path)])
-                repo.index.commit("Update server.py")
+            new_content, report = self.patch_code(original_content, updated_sections, "python")
+            if new_content is not None:
+                # Write the updated content back to server.py, the previous version can be restored with undo_last_update
+                repository.write({"server.py": new_content}, "Update server.py")
                 
-                out += f"Updated server file:\n```python\n{out_['updatedCode']}\n```\n"
+                out += f"{report}\nUpdated server file:\n```python\n{new_content}\n```\n"
+                self.step_end("Updating server.py")
             else:
-                out += "No sections were updated."
-
-            self.step_end("Updating server.py")
+                out += report
+                self.step_end("Updating server.py", False)
+            self.set_message_html(out)
 
     def extract_endpoints(self, metadata):
         app_path = Path(metadata["app_path"])
@@ -897,23 +822,7 @@ Infos: The client will be running on an server that is not the same as the one w
         index_file_path = app_path / "index.html"
         doc_file_path = app_path / "README.md"
 
-        # Initialize Git repository if not already initialized
-        self.step_start("Backing up previous version")
-        app_path = Path(metadata["app_path"])
-
-        # Stage and commit the icon
-        try:
-            if not (app_path / ".git").exists():
-                repo = git.Repo.init(app_path)
-            else:
-                repo = git.Repo(app_path)
-            repo.index.add([os.path.relpath(doc_file_path, app_path)])
-            repo.index.commit("Backing up README.md")        
-        except Exception:
-            pass        
-        self.step_end("Backing up previous version")
-
-
+        repository = self.get_repository(app_path)
 
         self.step_start("Updating README.md")
         # First read code
@@ -948,7 +857,7 @@ Infos: The client will be running on an server that is not the same as the one w
 
         self.step_end("Updating README.md")
         # Write the updated content back to README.md
-        doc_file_path.write_text(doc, encoding='utf8')
+        repository.write({"README.md": doc}, "Update README.md")
                 
         out += doc
 
@@ -957,22 +866,11 @@ Infos: The client will be running on an server that is not the same as the one w
         self.set_message_html(out)      
 
     def generate_icon(self, metadata, infos, client):
-        self.step_start("Backing up previous version")
         app_path = Path(metadata["app_path"])
-        if not (app_path / ".git").exists():
-            repo = git.Repo.init(app_path)
-        else:
-            repo = git.Repo(app_path)
+        repository = self.get_repository(app_path)
 
         #path to the output icon
         icon_dst = str(app_path/"icon.png")
-        # Stage and commit the icon
-        try:
-            repo.index.add([os.path.relpath(icon_dst, app_path)])
-            repo.index.commit("Add icon.png")        
-        except Exception:
-            pass        
-        self.step_end("Backing up previous version")
         out = self.build_message_element_with_thinking_animation("I am generating an icon")
         self.set_message_html(out)        
         if self.personality_config.generate_icon:
@@ -993,11 +891,8 @@ Infos: The client will be running on an server that is not the same as the one w
                 shutil.copy(icon_src, icon_dst)
                 self.step_end("Generating icon")
 
-                # Stage and commit the icon
-                self.step_start("Commiting to git")
-                repo.index.add([os.path.relpath(icon_dst, app_path)])
-                repo.index.commit("Add icon.png")
-                self.step_end("Commiting to git")
+                # Stage and commit the icon in the background
+                repository.commit([icon_dst], "Add icon.png")
             except:
                 self.step_start("Using default icon")
                 # Copy icon.png
@@ -1006,11 +901,8 @@ Infos: The client will be running on an server that is not the same as the one w
                 shutil.copy(icon_src, icon_dst)
                 self.step_end("Using default icon")
                 
-                # Stage and commit the icon
-                self.step_start("Commiting to git")
-                repo.index.add([os.path.relpath(icon_dst, app_path)])
-                repo.index.commit("Add icon.png")        
-                self.step_end("Commiting to git")
+                # Stage and commit the icon in the background
+                repository.commit([icon_dst], "Add icon.png")
 
         else:
             self.step_start("Using default icon")
@@ -1020,21 +912,13 @@ Infos: The client will be running on an server that is not the same as the one w
             shutil.copy(icon_src, icon_dst)
             self.step_end("Using default icon")
             
-            # Stage and commit the icon
-            self.step_start("Commiting to git")
-            repo.index.add([os.path.relpath(icon_dst, app_path)])
-            repo.index.commit("Add icon.png")        
-            self.step_end("Commiting to git")
+            # Stage and commit the icon in the background
+            repository.commit([icon_dst], "Add icon.png")
         return icon_dst
 
     def create_git_repository(self, infos, metadata):
         self.step_start("Initializing Git repository")
-        app_path = metadata["app_path"]
-        if not (app_path / ".git").exists():
-            repo = git.Repo.init(app_path)
-        else:
-            repo = git.Repo(app_path)
-
+        repository = self.get_repository(metadata["app_path"])
 
         # Create .gitignore file
         gitignore_content = """
@@ -1085,11 +969,8 @@ Infos: The client will be running on an server that is not the same as the one w
         with open(Path(metadata["app_path"]) / "README.md", "w") as f:
             f.write(readme_content)
 
-        # Add all files to Git
-        repo.git.add(all=True)
-
-        # Commit the initial code
-        repo.index.commit("Initial commit")
+        # Add all files to Git and commit the initial code in the background
+        repository.commit_all("Initial commit")
 
         self.step_end("Initializing Git repository")
 
@@ -1119,6 +1000,7 @@ Infos: The client will be running on an server that is not the same as the one w
         prompt = context_details.prompt
         previous_discussion_text = context_details.discussion_messages
         self.callback = callback
+        self.docs_query = prompt
         # Load project
         metadata = client.discussion.get_metadata()
         if "app_path" in metadata and metadata["app_path"] and metadata["app_path"]!="":
@@ -1193,8 +1075,7 @@ The code contains description.yaml that describes the application, the author, t
                 if self.personality_config.build_a_backend:
                     backend_code = self.build_server(context_details, infos, metadata, client)
                     if backend_code:
-                        with open(Path(metadata["app_path"])/"server.py","w", encoding="utf8") as f:
-                            f.write(backend_code)
+                        self.get_repository(metadata["app_path"]).write({"server.py": backend_code}, f"Updated server.py by {self.personality.model.model_name}, in answer to prompt: {prompt}")
                         out +=self.build_info_message("Back end coding done successfully.")
                         self.set_message_html(out)
                     else:
@@ -1205,17 +1086,9 @@ The code contains description.yaml that describes the application, the author, t
                     backend_code = None
                 code = self.build_index(context_details, infos, metadata, client)
                 if code:
-                    index_file_path = Path(metadata["app_path"])/"index.html"
                     app_path = metadata["app_path"]
-                    with open(index_file_path,"w", encoding="utf8") as f:
-                        f.write(code)
+                    self.get_repository(app_path).write({"index.html": code}, f"Updated index.html by {self.personality.model.model_name}, in answer to prompt: {prompt}")
                     out +=self.build_info_message("Front end coding done successfully.")
-                    if not (Path(app_path) / ".git").exists():
-                        repo = git.Repo.init(app_path)
-                    else:
-                        repo = git.Repo(app_path)
-                    repo.index.add([os.path.relpath(index_file_path, app_path)])
-                    repo.index.commit(f"Updated index.html by {self.personality.model.model_name}, in answer to prompt: {prompt}")
 
                     self.set_message_html(out)
                 else:
@@ -0,0 +1,161 @@
+"""
+Git history of the applications built by the lollms apps maker.
+
+Each update used to open the repository again and make up to three commits
+(backup, backup before update, update) while the user waited. An AppRepository
+keeps a single Repo handle per application folder and runs all the git work on
+its own background thread, in submission order. The files are written on the
+calling thread so the next step sees them immediately, and an update is a
+single commit. The previous content of the written files is kept in memory, so
+the last updates can be undone without touching git.
+"""
+import threading
+from collections import deque
+from pathlib import Path
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Union
+
+_repositories: Dict[str, "AppRepository"] = {}
+_repositories_lock = threading.Lock()
+
+
+class AppRepository:
+    """
+    Args:
+        app_path: Folder of the application, initialized as a git repository when needed.
+        history_size: Number of updates that can be undone.
+        on_error: Called with the exception of a git operation that failed in the background.
+    """
+    def __init__(self, app_path: Path, history_size: int = 10, on_error: Optional[Callable[[Exception], None]] = None) -> None:
+        self.app_path = Path(app_path).resolve()
+        self.history = deque(maxlen=max(1, history_size))
+        self.on_error = on_error
+        self._repo = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="app_repository")
+        self._last: Optional[Future] = None
+        self._lock = threading.Lock()
+
+    def set_history_size(self, history_size: int) -> None:
+        """Changes the number of updates that can be undone, the oldest ones are dropped when it shrinks."""
+        history_size = max(1, history_size)
+        if self.history.maxlen != history_size:
+            self.history = deque(self.history, maxlen=history_size)
+
+    @property
+    def repo(self):
+        """The Repo handle, only used from the worker thread."""
+        if self._repo is None:
+            import git
+            if (self.app_path / ".git").exists():
+                self._repo = git.Repo(self.app_path)
+            else:
+                self._repo = git.Repo.init(self.app_path)
+        return self._repo
+
+    def _relative(self, path: Union[str, Path]) -> str:
+        path = Path(path)
+        return (path.resolve().relative_to(self.app_path) if path.is_absolute() else path).as_posix()
+
+    def submit(self, function: Callable, *args) -> Future:
+        """Queues function(repo, *args) on the worker thread."""
+        def run():
+            try:
+                return function(self.repo, *args)
+            except Exception as ex:
+                if self.on_error:
+                    self.on_error(ex)
+                raise
+        with self._lock:
+            self._last = self._executor.submit(run)
+            return self._last
+
+    def _commit(self, repo, paths: List[str], message: str) -> Optional[str]:
+        existing = [p for p in paths if (self.app_path / p).exists()]
+        removed = [p for p in paths if not (self.app_path / p).exists()]
+        if existing:
+            repo.index.add(existing)
+        if removed:
+            tracked = {entry[0] for entry in repo.index.entries}
+            removed = [p for p in removed if p in tracked]
+            if removed:
+                repo.index.remove(removed)
+        if repo.head.is_valid() and not repo.index.diff("HEAD"):
+            # Nothing changed since the last commit
+            return None
+        return repo.index.commit(message).hexsha
+
+    def commit(self, paths: List[Union[str, Path]], message: str) -> Future:
+        """Commits the current content of the files in the background."""
+        return self.submit(self._commit, [self._relative(p) for p in paths], message)
+
+    def commit_all(self, message: str) -> Future:
+        def run(repo):
+            repo.git.add(all=True)
+            if repo.head.is_valid() and not repo.index.diff("HEAD"):
+                return None
+            return repo.index.commit(message).hexsha
+        return self.submit(run)
+
+    def write(self, files: Dict[Union[str, Path], Union[str, bytes]], message: str) -> Future:
+        """
+        Writes the files now and commits them in the background, as one commit.
+
+        The previous content of the files is pushed on the undo history.
+        """
+        previous = {}
+        for path, content in files.items():
+            relative = self._relative(path)
+            file_path = self.app_path / relative
+            previous[relative] = file_path.read_bytes() if file_path.exists() else None
+            file_path.parent.mkdir(parents=True, exist_ok=True)
+            if isinstance(content, bytes):
+                file_path.write_bytes(content)
+            else:
+                file_path.write_text(content, encoding="utf8")
+        self.history.append((message, previous))
+        return self.commit(list(previous), message)
+
+    def undo(self) -> Optional[str]:
+        """
+        Restores the files written by the last update and commits the restoration in the background.
+
+        Returns:
+            The message of the undone update, None when there is nothing to undo.
+        """
+        if not self.history:
+            return None
+        message, previous = self.history.pop()
+        for relative, content in previous.items():
+            file_path = self.app_path / relative
+            if content is None:
+                if file_path.exists():
+                    file_path.unlink()
+            else:
+                file_path.write_bytes(content)
+        self.commit(list(previous), f"Undo: {message}")
+        return message
+
+    def wait(self, timeout: Optional[float] = None) -> None:
+        """Blocks until the queued git operations are done."""
+        with self._lock:
+            last = self._last
+        if last is not None:
+            try:
+                last.result(timeout)
+            except Exception:
+                pass
+
+
+def get_app_repository(app_path: Path, history_size: int = 10, on_error: Optional[Callable[[Exception], None]] = None) -> AppRepository:
+    """
+    Returns the process-wide repository manager of an application folder, creating it once.
+    The history size and the error callback of an existing manager are updated.
+    """
+    key = str(Path(app_path).resolve())
+    with _repositories_lock:
+        if key not in _repositories:
+            _repositories[key] = AppRepository(app_path, history_size, on_error)
+        else:
+            _repositories[key].set_history_size(history_size)
+            _repositories[key].on_error = on_error
+        return _repositories[key]
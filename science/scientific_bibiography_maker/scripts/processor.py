@@ -15,6 +15,9 @@ import json
 from lollmsvectordb import VectorDatabase
 import requests 
 from typing import Callable, Any
+import sys
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+from zoo_common.context_packing import ContextItem, ContextPacker, TokenCounter, available_budget
 if not PackageManager.check_package_installed("arxiv"):
     PackageManager.install_package("arxiv")
 
@@ -488,10 +491,16 @@ class Processor(APScript):
     def summarize_report(self, report, download_folder, client:Client=None):
         self.new_message("")
         if len(report)>0:
-            text_to_summarize = ""
-            for entry in report:
-                if entry["relevance"]!="irrelevant" and entry["relevance"]!="unchecked":
-                    text_to_summarize +=f"{entry['title']}\nauthors: {entry['authors']}\nAbstract: {entry['abstract']}\n"
+            # The most relevant articles are kept first and the same article found on two sources only once
+            items = [
+                ContextItem(f"{entry['title']}\nauthors: {entry['authors']}\nAbstract: {entry['abstract']}\n", float(entry["relevance_score"] or 0), source=entry['title'])
+                for entry in report if entry["relevance"]!="irrelevant" and entry["relevance"]!="unchecked"
+            ]
+            packer = ContextPacker(TokenCounter(self.personality.model.tokenize))
+            packed = packer.pack(items, available_budget(self.personality.config.ctx_size, self.personality_config.max_generation_prompt_size))
+            if packed.dropped:
+                self.step(f"{len(packed.dropped)} less relevant or duplicated articles were left out of the summary to fit the context")
+            text_to_summarize = packed.join(separator="")
 
             self.step_start(f"Summerizing content")
             summary = self.summarize_text(text_to_summarize,"Create a comprehensive scientific bibliography report using markdown format. Include a title and one or more paragraphs summarizing each source's content. Make sure to only list the references cited within the document. Exclude any references not explicitly present in the text.", callback=self.sink)
@@ -12,6 +12,10 @@ from lollms.prompting import LollmsContextDetails
 import subprocess
 import json
 from typing import Callable, Any
+from pathlib import Path
+import sys
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+from zoo_common.agent_fanout import AgentScheduler, AgentResult, parse_model_list
 
 # Helper functions
 class Processor(APScript):
@@ -39,7 +43,10 @@ class Processor(APScript):
                 {"name":"master_system_message","type":"text","value":"Build a comprehensive answer to the user. Format it as a markdown text and hilight important information.", "help":"System message to use for all questions"},
                 {"name":"models_to_use","type":"str","value":"", "help":"List of coma separated models to test in format binding_name::model_name"},
                 {"name":"master_model","type":"str","value":"", "help":"A single powerful model in format binding_name::model_name which is going to judge the other models based on the human test file. This model will just compare the output of the model and the human provided answer."},
-                {"name":"n_rounds","type":"int","value":3,"help":"The number of rounds in the mixture of agents process. A round is a full pass through all agents."}                
+                {"name":"n_rounds","type":"int","value":3,"help":"The number of rounds in the mixture of agents process. A round is a full pass through all agents."},
+                {"name":"parallel_agents","type":"bool","value":True,"help":"Keeps every agent model loaded and queries them at the same time. Disable it for local bindings that can only hold one model at a time."},
+                {"name":"agents_timeout","type":"int","value":0,"help":"Seconds an agent has to answer in parallel mode before its answer is ignored for the round (0 for no limit)."},
+                {"name":"agents_max_answer_size","type":"int","value":2048,"help":"Maximum number of tokens of each agent answer in parallel mode."},
             ]
             )
         personality_config_vals = BaseConfig.from_template(personality_config_template)
@@ -62,6 +69,8 @@ class Processor(APScript):
                             ],
                             callback=callback
                         )
+        self.agent_scheduler = None
+        self.agent_scheduler_models = None
         
     def install(self):
         super().install()
@@ -79,6 +88,43 @@ class Processor(APScript):
             model_answer = [f'answer_{model_to_test["binding"]}_{model_to_test["model"]}']
             return self.yes_no("Are these two answers similar?",f"prompt:\n{prompt}\nanswer 1:\n{true_answer}\nanswer 2:\n{model_answer}")
         
+    def get_agent_scheduler(self):
+        """Returns the scheduler holding the warm agent models, rebuilt when the list of models changes."""
+        if self.agent_scheduler is None or self.agent_scheduler_models != self.personality_config.models_to_use:
+            def load_model(binding_name, model_name):
+                self.select_model(binding_name, model_name)
+                return self.personality.model
+            def generate(model, prompt):
+                return model.generate(prompt, self.personality_config.agents_max_answer_size, callback=self.sink)
+            self.agent_scheduler = AgentScheduler(load_model, generate, timeout=self.personality_config.agents_timeout or None)
+            self.agent_scheduler_models = self.personality_config.models_to_use
+        return self.agent_scheduler
+
+    def run_agents(self, models, prompt):
+        """Asks the prompt to every agent model and returns the answers that succeeded."""
+        if not self.personality_config.parallel_agents:
+            outputs = []
+            for binding_name, model_name in models:
+                self.step_start(f"using model {binding_name}::{model_name}")
+                self.select_model(binding_name, model_name)
+                out = self.fast_gen(prompt, callback=self.sink)
+                outputs.append({"model_name":model_name, "text":out})
+                self.step_end(f"using model {binding_name}::{model_name}")
+            return outputs
+
+        scheduler = self.get_agent_scheduler()
+        self.step_start("Loading agent models")
+        scheduler.warm_up(models)
+        self.step_end("Loading agent models")
+        for binding_name, model_name in models:
+            self.step_start(f"using model {binding_name}::{model_name}")
+        def on_result(result:AgentResult):
+            if not result.ok:
+                ASCIIColors.warning(f"Agent {result.key} failed: {result.error}")
+            self.step_end(f"using model {result.key}", result.ok)
+        results = scheduler.run_round(models, prompt, on_result)
+        return [{"model_name":result.model_name, "text":result.text} for result in results if result.ok]
+
     def add_file(self, path, client, callback=None):
         """
         Here we implement the file reception handling
@@ -112,7 +158,7 @@ class Processor(APScript):
         previous_discussion_text = context_details.discussion_messages
         self.personality.info("Generating")
         self.callback = callback
-        models_to_use = self.personality_config.models_to_use
+        models_to_use = parse_model_list(self.personality_config.models_to_use)
         model_outputs = []
         context_details.conditionning=self.personality_config.agents_system_message
         rounds = []
@@ -127,14 +173,7 @@ class Processor(APScript):
             prompt = self.build_prompt_from_context_details(context_details, formatted_models_outputs)
             if self.config.debug:
                 self.print_prompt("Intermediate prompt",prompt)
-            model_outputs = []
-            for model_infos in models_to_use.split(","):
-                self.step_start(f"using model {model_infos}")
-                binding_name, model_name = model_infos.split("::")
-                self.select_model(binding_name, model_name)
-                out = self.fast_gen(prompt, callback=self.sink)
-                model_outputs.append({"model_name":model_name, "text":out})
-                self.step_end(f"using model {model_infos}")
+            model_outputs = self.run_agents(models_to_use, prompt)
             self.step_end(f"Processing round {round+1}")
             rounds.append(model_outputs)
         context_details.conditionning=self.personality_config.master_system_message
@@ -14,8 +14,11 @@ import sys
 import yaml
 import re
 import random
+from concurrent.futures import ThreadPoolExecutor
 
 from typing import Callable, Any
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+from zoo_common.context_packing import TokenCounter
 
 
 def find_matching_number(numbers, text):
@@ -46,6 +49,9 @@ class Processor(APScript):
                 {"name":"nb_samples_per_idea","type":"int","value":3, "min":2, "max":100},
                 {"name":"nb_ideas","type":"int","value":3, "min":2, "max":100},
                 {"name":"idea_temperature","type":"float","value":0.8, "min":0, "max":2, "help":"The temperature of the idea generation controls the creativily level.\nA higher temperature yields more original ideas and more variety and lower temperatures yield more logical ideas."},
+                {"name":"temperature_spread","type":"float","value":0.2, "min":0, "max":1, "help":"The samples of a level use temperatures spread evenly in idea_temperature +/- temperature_spread so that they explore different directions."},
+                {"name":"parallel_samples","type":"int","value":4, "min":1, "max":100, "help":"Number of idea samples generated at the same time. Set it to 1 for bindings that serve a single request at a time."},
+                {"name":"beam_width","type":"int","value":1, "min":1, "max":100, "help":"Number of idea paths kept after each level. Each kept path is developed with nb_samples_per_idea new ideas on the next level."},
                 {"name":"thinking_method","type":"str","value":"synthesize", "options":["synthesize","pick_best","develop"], "min":2, "max":100}
             ])
         personality_config = BaseConfig.from_template(personality_config_template)
@@ -58,6 +64,16 @@ class Processor(APScript):
                             personality_config,
                             callback=callback
                         )
+        self._token_counter = None
+        self._token_counter_model = None
+
+    @property
+    def token_counter(self):
+        """Counter of the mounted model, built on first use and again when the model changes."""
+        if self._token_counter is None or self._token_counter_model is not self.personality.model:
+            self._token_counter_model = self.personality.model
+            self._token_counter = TokenCounter(self.personality.model.tokenize)
+        return self._token_counter
         
     def install(self):
         super().install()
@@ -79,6 +95,98 @@ class Processor(APScript):
             self.bot_says = bot_says
             return True
         
+    def build_idea_prompt(self, previous_discussion_text, path):
+        """
+        Builds the prompt asking for the next idea of a path of ideas.
+        The discussion comes first and is identical for every sample and level so that
+        bindings caching prompt prefixes reuse it.
+        """
+        idea_prompt = f"""{self.config.start_header_id_template}discussion:
+{previous_discussion_text}
+"""
+        if len(path)>0:
+            final_ideas_text = "\n".join([f'Idea {n}:{i}' for n,i in enumerate(path)])
+            idea_prompt += f"""{self.config.start_header_id_template}previous ideas: {final_ideas_text}
+{self.config.start_header_id_template}instructions: Given the above discussion and previous ideas, try to give another idea to solve the proposed problem. 
+"""
+        else:
+            idea_prompt += f"""{self.config.start_header_id_template}instructions: Given the above discussion, try to give an original idea to solve the proposed problem. 
+"""
+        return idea_prompt + f"{self.config.start_header_id_template}idea:"
+
+    def prompt_size(self, previous_discussion_text, path):
+        # The discussion and the ideas are counted once and cached, not the assembled prompt of every sample
+        return self.token_counter(previous_discussion_text) + sum(self.token_counter(idea) for idea in path) + 20*(len(path)+3)
+
+    def sample_temperatures(self, nb_samples):
+        base = self.personality_config.idea_temperature
+        spread = self.personality_config.temperature_spread
+        if nb_samples<2:
+            return [base]
+        return [max(0.0, base - spread + 2*spread*i/(nb_samples-1)) for i in range(nb_samples)]
+
+    def sample_ideas(self, previous_discussion_text, paths):
+        """
+        Generates nb_samples_per_idea ideas for each path at once.
+
+        Returns:
+            A list of (path index, idea) tuples.
+        """
+        nb_samples = self.personality_config.nb_samples_per_idea
+        jobs = []
+        for path_index, path in enumerate(paths):
+            idea_prompt = self.build_idea_prompt(previous_discussion_text, path)
+            max_size = min(self.personality_config.max_thought_size, self.personality.config.ctx_size - self.prompt_size(previous_discussion_text, path))
+            for temperature in self.sample_temperatures(nb_samples):
+                jobs.append((path_index, idea_prompt, max(16, max_size), temperature))
+
+        def run(job):
+            path_index, idea_prompt, max_size, temperature = job
+            idea = self.personality.model.generate(
+                idea_prompt,
+                max_size,
+                self.sink,
+                temperature=temperature,
+                top_k=self.personality.model_top_k,
+                top_p=self.personality.model_top_p,
+                repeat_penalty=self.personality.model_repeat_penalty,
+            )
+            return path_index, idea.strip()
+
+        if self.personality_config.parallel_samples<=1:
+            return [run(job) for job in jobs]
+        with ThreadPoolExecutor(max_workers=self.personality_config.parallel_samples) as executor:
+            return list(executor.map(run, jobs))
+
+    def select_ideas(self, prompt, candidates, width, previous_discussion_text):
+        """Returns the indices of the width best candidates, best first."""
+        if len(candidates)<=1:
+            return list(range(len(candidates)))
+        if width==1:
+            idea_id = self.multichoice_question(f"What is the most adequate idea to the context?\n",[f"{i} - {candidate}" for i, candidate in enumerate(candidates)],previous_discussion_text)
+            if idea_id>=0 and idea_id<len(candidates):
+                return [idea_id]
+            self.warning("Warning, the model made a wrong answer, taking random idea as the best")
+            return [random.randint(0,len(candidates)-1)]
+        ranking_prompt = "\n".join([
+            f"{self.config.start_header_id_template}discussion:\n{previous_discussion_text}",
+            f"{self.config.start_header_id_template}prompt: {prompt}",
+            *[f"{self.config.start_header_id_template}Idea {i}:{candidate}" for i, candidate in enumerate(candidates)],
+            f"{self.config.start_header_id_template}instructions: Rank the ideas from the most to the least adequate to the context. Answer only with the idea numbers separated by comas.",
+            f"{self.config.start_header_id_template}ranking:"
+        ])
+        ranking = self.fast_gen(ranking_prompt, max_generation_size=8*len(candidates), callback=self.sink)
+        selected = []
+        for number in re.findall(r"\d+", ranking):
+            number = int(number)
+            if number<len(candidates) and number not in selected:
+                selected.append(number)
+        if len(selected)==0:
+            self.warning("Warning, the model made a wrong answer, keeping the first ideas")
+        # Unranked candidates complete the beam in generation order
+        selected += [i for i in range(len(candidates)) if i not in selected]
+        return selected[:width]
+
     from lollms.client_session import Client
     def run_workflow(self,  context_details:LollmsContextDetails=None, client:Client=None,  callback: Callable[[str | list | None, MSG_OPERATION_TYPE, str, AIPersonality| None], bool]=None):
         """
@@ -106,10 +214,10 @@ class Processor(APScript):
         previous_discussion_text = context_details.discussion_messages
         self.callback = callback
         self.bot_says = ""
-        # 1 first ask the model to formulate a query
-        final_ideas = []
+        width = max(1, self.personality_config.beam_width)
+        # Each path of the beam is the list of ideas chosen so far, best path first
+        beam = [[]]
         summary_prompt = ""
-        prev_number = -1
         layers = []
         selections = []
         output = ""
@@ -118,49 +226,26 @@ class Processor(APScript):
             output += f"\n-- level {j+1} ---\n"
             self.set_message_content(output)
             self.step_start(f"Processing Level {j+1} of the tree")
-            local_ideas=[]
-            judgement_prompt = f"{self.config.start_header_id_template}prompt: {prompt}\n"
-            for i in range(self.personality_config.nb_samples_per_idea):
-                self.step_start(f"Generating idea number {j+1}:{i+1}/{self.personality_config.nb_samples_per_idea}")
-                print(f"\nIdea {i+1}")
-                if len(final_ideas)>0:
-                    final_ideas_text = "\n".join([f'Idea {n}:{i}' for n,i in enumerate(final_ideas)])
-                    idea_prompt = f"""{self.config.start_header_id_template}instructions: Given the following discussion and previous ideas, try to give another idea to solve the proposed problem. 
-{self.config.start_header_id_template}discussion:
-{previous_discussion_text}
-{self.config.start_header_id_template}previous ideas: {final_ideas_text}
-{self.config.start_header_id_template}idea:"""
-                else:
-                    idea_prompt = f"""{self.config.start_header_id_template}instructions: Given the following discussion, try to give an original idea to solve the proposed problem. 
-{self.config.start_header_id_template}discussion:
-{previous_discussion_text}
-{self.config.start_header_id_template}idea:"""
-                idea = self.generate(idea_prompt,self.personality_config.max_thought_size,temperature=self.personality_config.idea_temperature)
+            self.step_start(f"Generating {len(beam)*self.personality_config.nb_samples_per_idea} ideas")
+            samples = self.sample_ideas(previous_discussion_text, beam)
+            self.step_end(f"Generating {len(beam)*self.personality_config.nb_samples_per_idea} ideas")
+            local_ideas = [idea for _, idea in samples]
+            for i, idea in enumerate(local_ideas):
                 output += f"\n## Idea {i+1}:\n {idea}\n"
-                self.set_message_content(output)
-                local_ideas.append(idea.strip())
-                judgement_prompt += f"{self.config.separator_template}{self.config.start_header_id_template}Idea {i}:{idea}\n"
-                self.step_end(f"Generating idea number {j+1}:{i+1}/{self.personality_config.nb_samples_per_idea}")
-
-            idea_id = self.multichoice_question(f"What is the most adequate idea to the context?\n",[f"{i} - {local_idea}" for local_idea in local_ideas],previous_discussion_text)
-            if idea_id>=0 and idea_id<len(local_ideas):
-                print(f"Chosen thought n:{idea_id}")
-                final_ideas.append(local_ideas[idea_id])
-            else:
-                self.warning("Warning, the model made a wrong answer, taking random idea as the best")
-                idea_id = random.randint(0,self.personality_config["nb_samples_per_idea"])
-                print(f"Chosen thought n:{idea_id+1}")
-                if idea_id>=0 and idea_id<len(local_ideas):
-                    final_ideas.append(local_ideas[idea_id]) 
-                else:
-                    final_ideas.append(local_ideas[0]) 
-            output += f"\n<b>Best level idea:</b>\n{local_ideas[idea_id]}\n"
+            self.set_message_content(output)
+
+            selected = self.select_ideas(prompt, local_ideas, width, previous_discussion_text)
+            print(f"Chosen thoughts n:{selected}")
+            beam = [beam[samples[i][0]] + [local_ideas[i]] for i in selected]
+            output += f"\n<b>Best level idea:</b>\n{local_ideas[selected[0]]}\n"
             self.set_message_content(output)
             layers.append(local_ideas)
-            selections.append(idea_id)
+            selections.append(selected[0] if width==1 else selected)
             
             self.step_end(f"Processing Level {j+1} of the tree")
 
+        final_ideas = beam[0]
+
         self.step_start(f"Building final summary")
         if self.personality_config.thinking_method=="synthesize":
             summary_prompt += f"{self.config.start_header_id_template}Instructions: Combine these ideas in a comprihensive essai. Give a detailed explanation.\n"
@@ -0,0 +1,8 @@
+"""
+Helpers shared by several personalities of the zoo.
+
+A personality script makes them importable by adding the zoo root to its path:
+
+    sys.path.append(str(Path(__file__).resolve().parents[3]))
+    from zoo_common.document_conversion import get_document_conversion_service
+"""
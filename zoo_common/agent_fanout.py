@@ -0,0 +1,157 @@
+"""
+Concurrent fan-out of prompts to several models.
+
+Mixture of agents personalities ask the same question to several
+binding::model pairs on every round. Selecting each model before querying it
+serializes the whole round and reloads the models on every round. The
+scheduler below loads each model once, keeps its handle warm, and queries all
+the agents of a round at the same time, so a round takes as long as its slowest
+agent instead of the sum of all agents.
+
+Threads are used rather than processes: model handles hold sockets or device
+memory and can't be sent to another process, and generation releases the GIL
+while it waits on the model.
+"""
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+def parse_model_list(models: str) -> List[Tuple[str, str]]:
+    """Parses a coma separated list of binding_name::model_name entries."""
+    entries = []
+    for entry in models.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        binding_name, model_name = entry.split("::", 1)
+        entries.append((binding_name.strip(), model_name.strip()))
+    return entries
+
+
+class AgentResult:
+    def __init__(self, binding_name: str, model_name: str, text: str = "", error: Optional[str] = None, seconds: float = 0.0) -> None:
+        self.binding_name = binding_name
+        self.model_name = model_name
+        self.text = text
+        self.error = error
+        self.seconds = seconds
+
+    @property
+    def key(self) -> str:
+        return f"{self.binding_name}::{self.model_name}"
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class AgentScheduler:
+    """
+    Args:
+        load_model: Builds the handle of a model from its binding and model names.
+        generate: Generates the answer of a handle to a prompt.
+        max_workers: Number of agents queried at the same time. 0 queries all of them at once.
+        timeout: Seconds an agent is given once it started, None waits forever.
+    """
+    def __init__(self, load_model: Callable[[str, str], Any], generate: Callable[[Any, str], str], max_workers: int = 0, timeout: Optional[float] = None) -> None:
+        self.load_model = load_model
+        self.generate = generate
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.handles: Dict[str, Any] = {}
+        self.lock = threading.Lock()
+
+    def get_handle(self, binding_name: str, model_name: str) -> Any:
+        key = f"{binding_name}::{model_name}"
+        with self.lock:
+            if key not in self.handles:
+                self.handles[key] = self.load_model(binding_name, model_name)
+            return self.handles[key]
+
+    def warm_up(self, models: List[Tuple[str, str]]) -> None:
+        """Loads the models in the calling thread, bindings are rarely safe to build concurrently."""
+        for binding_name, model_name in models:
+            self.get_handle(binding_name, model_name)
+
+    def _run_agent(self, binding_name: str, model_name: str, prompt: str, started: Dict[int, float], index: int) -> AgentResult:
+        started[index] = time.perf_counter()
+        try:
+            text = self.generate(self.get_handle(binding_name, model_name), prompt)
+            return AgentResult(binding_name, model_name, text, seconds=time.perf_counter() - started[index])
+        except Exception as ex:
+            return AgentResult(binding_name, model_name, error=str(ex), seconds=time.perf_counter() - started[index])
+
+    def run_round(self, models: List[Tuple[str, str]], prompt: str, on_result: Optional[Callable[[AgentResult], None]] = None) -> List[AgentResult]:
+        """
+        Sends the prompt to all the models concurrently.
+
+        Agents that fail or exceed the timeout get a result carrying the error and no text.
+        Returns:
+            One result per model, in the order of models.
+        """
+        self.warm_up(models)
+        results: List[Optional[AgentResult]] = [None] * len(models)
+        started: Dict[int, float] = {}
+        executor = ThreadPoolExecutor(max_workers=self.max_workers or max(1, len(models)))
+        futures = {
+            executor.submit(self._run_agent, binding_name, model_name, prompt, started, i): i
+            for i, (binding_name, model_name) in enumerate(models)
+        }
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=None if self.timeout is None else 0.1, return_when=FIRST_COMPLETED)
+            for future in done:
+                i = futures[future]
+                results[i] = future.result()
+                if on_result:
+                    on_result(results[i])
+            if self.timeout is None:
+                continue
+            now = time.perf_counter()
+            for future in list(pending):
+                i = futures[future]
+                if i in started and now - started[i] > self.timeout:
+                    # The generation keeps running in its thread, its answer is ignored
+                    pending.discard(future)
+                    binding_name, model_name = models[i]
+                    results[i] = AgentResult(binding_name, model_name, error=f"timed out after {self.timeout}s", seconds=now - started[i])
+                    if on_result:
+                        on_result(results[i])
+        executor.shutdown(wait=False)
+        return results
+
+
+if __name__ == "__main__":
+    # Compares serial and concurrent rounds with stub bindings that sleep instead of generating
+    import random
+
+    class StubModel:
+        def __init__(self, name: str, latency: float) -> None:
+            self.name = name
+            self.latency = latency
+
+        def generate(self, prompt: str) -> str:
+            time.sleep(self.latency * random.uniform(0.8, 1.2))
+            return f"{self.name} answer"
+
+    def load(binding_name: str, model_name: str) -> StubModel:
+        time.sleep(0.5)  # loading a model costs more than a generation
+        return StubModel(model_name, 0.3)
+
+    models = [("stub", f"model_{i}") for i in range(3)]
+    n_rounds = 3
+
+    start = time.perf_counter()
+    for _ in range(n_rounds):
+        for binding_name, model_name in models:
+            load(binding_name, model_name).generate("prompt")
+    serial = time.perf_counter() - start
+
+    scheduler = AgentScheduler(load, lambda handle, prompt: handle.generate(prompt))
+    start = time.perf_counter()
+    for _ in range(n_rounds):
+        scheduler.run_round(models, "prompt")
+    concurrent = time.perf_counter() - start
+    print(f"{len(models)} models x {n_rounds} rounds: serial {serial:.2f}s, scheduler {concurrent:.2f}s ({serial / concurrent:.1f}x)")
@@ -0,0 +1,334 @@
+"""
+Syntax aware chunking of source files.
+
+Code personalities (code documenters, codeguard, code builders) send large
+files to the model in chunks. Cutting on token counts splits functions in the
+middle, and the python only extractors they used sliced token lists with line
+numbers. The chunker below splits a file into top level pieces on syntactic
+boundaries, then packs consecutive pieces greedily into a token budget. A piece
+larger than the budget is split into its members (methods of a class, members
+of a struct or namespace), and as a last resort into lines.
+
+Python is parsed with ast, with an indentation heuristic for files that don't
+parse. Brace languages (JavaScript, TypeScript, C, C++, Go, and anything not
+recognized) use a small scanner that tracks brace depth outside of strings and
+comments. Token counts go through a TokenCounter, so a definition that didn't
+change is not tokenized again when its file is chunked again. A caller that
+already tokenized the whole file can pass its count instead, the size of each
+piece is then estimated from its share of the characters and nothing is
+tokenized again.
+"""
+import ast
+import re
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+
+from zoo_common.context_packing import TokenCounter
+
+LANGUAGES = {
+    ".py": "python", ".pyw": "python",
+    ".js": "javascript", ".jsx": "javascript", ".mjs": "javascript", ".cjs": "javascript",
+    ".ts": "typescript", ".tsx": "typescript",
+    ".c": "c", ".h": "c",
+    ".cc": "cpp", ".cpp": "cpp", ".cxx": "cpp", ".hpp": "cpp", ".hh": "cpp", ".hxx": "cpp",
+    ".go": "go",
+}
+
+_STRING_DELIMITERS = {
+    "javascript": "\"'`", "typescript": "\"'`", "go": "\"'`", "c": "\"'", "cpp": "\"'",
+}
+
+_DEFINITION_RE = re.compile(r"^\s*(?:export\s+)?(?:default\s+)?(?:async\s+)?(?:func|function|class|struct|interface|enum|namespace|type|const|let|var|union)\b\s*(?:\([^)]*\)\s*)?\*?\s*([A-Za-z_$][\w$]*)")
+_C_FUNCTION_RE = re.compile(r"([A-Za-z_~][\w:~]*)\s*\([^;]*$")
+
+
+def language_of(file_name: str) -> str:
+    """The language of a file from its extension, "text" when it isn't recognized."""
+    return LANGUAGES.get(Path(file_name).suffix.lower(), "text")
+
+
+class CodePiece:
+    """
+    Lines start_line to end_line (1 based, included) of a file.
+
+    A piece that can be split further lists its members in children, the header
+    and footer lines of the block being pieces of their own.
+    """
+    def __init__(self, kind: str, name: str, start_line: int, end_line: int, text: str, children: Optional[List["CodePiece"]] = None) -> None:
+        self.kind = kind
+        self.name = name
+        self.start_line = start_line
+        self.end_line = end_line
+        self.text = text
+        self.children = children or []
+
+
+class CodeChunk:
+    def __init__(self, text: str, start_line: int, end_line: int, names: List[str], nb_tokens: int) -> None:
+        self.text = text
+        self.start_line = start_line
+        self.end_line = end_line
+        self.names = names
+        self.nb_tokens = nb_tokens
+
+
+def _merge_blank(pieces: List[CodePiece]) -> List[CodePiece]:
+    """Appends the blank pieces to the previous piece (or prepends them to the next one) so no line is lost."""
+    merged: List[CodePiece] = []
+    pending = None
+    for piece in pieces:
+        if not piece.text.strip():
+            if merged:
+                previous = merged[-1]
+                while previous is not None:
+                    previous.text += piece.text
+                    previous.end_line = piece.end_line
+                    previous = previous.children[-1] if previous.children else None
+            elif pending is None:
+                pending = piece
+            else:
+                pending.text += piece.text
+                pending.end_line = piece.end_line
+            continue
+        if pending is not None:
+            following = piece
+            while following is not None:
+                following.text = pending.text + following.text
+                following.start_line = pending.start_line
+                following = following.children[0] if following.children else None
+            pending = None
+        merged.append(piece)
+    if pending is not None:
+        merged.append(pending)
+    return merged
+
+
+def _piece(lines: List[str], start: int, end: int, kind: str = "code", name: str = "", children=None) -> CodePiece:
+    """Piece of lines[start:end], start being a 0 based index."""
+    return CodePiece(kind, name, start + 1, end, "".join(lines[start:end]), children)
+
+
+# Python
+
+def _python_pieces(lines: List[str], nodes: list, start: int, end: int) -> List[CodePiece]:
+    """Pieces covering lines[start:end], split at the given statements."""
+    pieces = []
+    current = start
+    for node in nodes:
+        node_start = min([node.lineno] + [decorator.lineno for decorator in getattr(node, "decorator_list", [])]) - 1
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            # Comments right above a definition belong to it
+            while node_start > current and lines[node_start - 1].lstrip().startswith("#"):
+                node_start -= 1
+            if node_start > current:
+                pieces.append(_piece(lines, current, node_start))
+            children = None
+            if isinstance(node, ast.ClassDef) and node.body:
+                body_start = node.body[0].lineno - 1
+                if isinstance(node.body[0], (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)) and node.body[0].decorator_list:
+                    body_start = min(decorator.lineno for decorator in node.body[0].decorator_list) - 1
+                children = [_piece(lines, node_start, body_start, "header", node.name)]
+                children += _python_pieces(lines, node.body, body_start, node.end_lineno)
+            kind = "class" if isinstance(node, ast.ClassDef) else "function"
+            pieces.append(_piece(lines, node_start, node.end_lineno, kind, node.name, children))
+            current = node.end_lineno
+    if current < end:
+        pieces.append(_piece(lines, current, end))
+    return _merge_blank(pieces)
+
+
+def _indent_pieces(lines: List[str]) -> List[CodePiece]:
+    """Pieces starting at each non indented line following an indented block, for code that doesn't parse."""
+    pieces = []
+    start = 0
+    indented = False
+    for i, line in enumerate(lines):
+        if not line.strip():
+            continue
+        if line[0] not in " \t":
+            if indented and not line.lstrip().startswith(("else", "elif", "except", "finally", ")", "]", "}")):
+                pieces.append(_piece(lines, start, i))
+                start = i
+            indented = False
+        else:
+            indented = True
+    pieces.append(_piece(lines, start, len(lines)))
+    return _merge_blank(pieces)
+
+
+def split_python(code: str) -> List[CodePiece]:
+    lines = code.splitlines(keepends=True)
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return _indent_pieces(lines)
+    return _python_pieces(lines, tree.body, 0, len(lines))
+
+
+# Brace languages
+
+def _line_depths(lines: List[str], delimiters: str) -> List[Tuple[int, int]]:
+    """(depth at the start of the line, lowest depth reached in the line) for each line."""
+    depths = []
+    depth = 0
+    in_block_comment = False
+    quote = None
+    for line in lines:
+        start_depth = low = depth
+        i = 0
+        n = len(line)
+        while i < n:
+            c = line[i]
+            if in_block_comment:
+                if c == "*" and line.startswith("*/", i):
+                    in_block_comment = False
+                    i += 1
+            elif quote is not None:
+                if c == "\\" and quote != "`":
+                    i += 1
+                elif c == quote:
+                    quote = None
+            elif c == "/" and line.startswith("//", i):
+                break
+            elif c == "/" and line.startswith("/*", i):
+                in_block_comment = True
+                i += 1
+            elif c in delimiters:
+                quote = c
+            elif c in "{([":
+                depth += 1
+            elif c in "})]":
+                depth = max(0, depth - 1)
+                low = min(low, depth)
+            i += 1
+        if quote in ("'", '"'):
+            # Those quotes don't span lines, an unbalanced one was part of a regex or a char literal
+            quote = None
+        depths.append((start_depth, low))
+    depths.append((depth, depth))
+    return depths
+
+
+def _definition_name(text: str) -> str:
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not stripped or stripped.startswith(("//", "/*", "*", "#")):
+            continue
+        match = _DEFINITION_RE.match(line) or _C_FUNCTION_RE.search(stripped)
+        return match.group(1) if match else ""
+    return ""
+
+
+def _brace_pieces(lines: List[str], depths: List[Tuple[int, int]], start: int, end: int, base: int) -> List[CodePiece]:
+    """
+    Pieces covering lines[start:end], cut after every line that ends at the base depth with a
+    closing brace or a statement end, and at blank lines between statements.
+    """
+    pieces = []
+    current = start
+    for i in range(start, end):
+        stripped = lines[i].strip()
+        at_base = depths[i + 1][0] == base
+        closes = at_base and (depths[i][0] > base or stripped.endswith((";", "}", "};", "})", "});")) or stripped.startswith("#"))
+        blank = at_base and not stripped and depths[i][0] == base
+        if (closes or blank) and i + 1 > current:
+            pieces.append(_brace_piece(lines, depths, current, i + 1, base))
+            current = i + 1
+    if current < end:
+        pieces.append(_brace_piece(lines, depths, current, end, base))
+    return _merge_blank(pieces)
+
+
+def _brace_piece(lines: List[str], depths: List[Tuple[int, int]], start: int, end: int, base: int) -> CodePiece:
+    text = "".join(lines[start:end])
+    name = _definition_name(text)
+    children = None
+    # The block opens on the first line going deeper than base and closes on the last line coming back to it
+    opening = next((i for i in range(start, end) if depths[i + 1][0] > base), None)
+    if opening is not None and end - start > 2:
+        closing = end - 1
+        while closing > opening and depths[closing][0] <= base:
+            closing -= 1
+        if closing > opening + 1:
+            children = [_piece(lines, start, opening + 1, "header", name)]
+            children += _brace_pieces(lines, depths, opening + 1, closing, base + 1)
+            children.append(_piece(lines, closing, end, "footer", name))
+    kind = "definition" if name else "code"
+    return CodePiece(kind, name, start + 1, end, text, children)
+
+
+def split_braces(code: str, language: str = "c") -> List[CodePiece]:
+    lines = code.splitlines(keepends=True)
+    if not lines:
+        return []
+    depths = _line_depths(lines, _STRING_DELIMITERS.get(language, "\"'"))
+    return _brace_pieces(lines, depths, 0, len(lines), 0)
+
+
+def split_code(code: str, file_name: str) -> List[CodePiece]:
+    """Top level pieces of a source file, on the syntactic boundaries of its language."""
+    if language_of(file_name) == "python":
+        return split_python(code)
+    return split_braces(code, language_of(file_name))
+
+
+class CodeChunker:
+    """
+    Args:
+        tokenize: Tokenizer of the model, or a TokenCounter shared with other helpers.
+        cache_size: Number of piece token counts kept.
+    """
+    def __init__(self, tokenize: Callable[[str], list], cache_size: int = 8192) -> None:
+        self.count_tokens = tokenize if isinstance(tokenize, TokenCounter) else TokenCounter(tokenize, cache_size)
+
+    def _fit(self, piece: CodePiece, max_tokens: int, count_tokens: Callable[[str], int]) -> List[Tuple[CodePiece, int]]:
+        """The piece with its size, or its parts when it is larger than max_tokens."""
+        nb_tokens = count_tokens(piece.text)
+        if nb_tokens <= max_tokens:
+            return [(piece, nb_tokens)]
+        if piece.children:
+            return [fitted for child in piece.children for fitted in self._fit(child, max_tokens, count_tokens)]
+        lines = piece.text.splitlines(keepends=True)
+        if len(lines) <= 1:
+            return [(piece, nb_tokens)]
+        middle = len(lines) // 2
+        halves = [
+            CodePiece(piece.kind, piece.name, piece.start_line, piece.start_line + middle - 1, "".join(lines[:middle])),
+            CodePiece(piece.kind, piece.name, piece.start_line + middle, piece.end_line, "".join(lines[middle:])),
+        ]
+        return [fitted for half in halves for fitted in self._fit(half, max_tokens, count_tokens)]
+
+    def chunk(self, code: str, file_name: str, max_tokens: int, nb_tokens: Optional[int] = None) -> List[CodeChunk]:
+        """
+        Packs the pieces of a file in order into chunks of at most max_tokens tokens.
+
+        The size of a chunk is the sum of the sizes of its pieces, which is within a few
+        tokens of the size of their concatenation.
+
+        Args:
+            nb_tokens: Token count of the whole file. When given, piece sizes are estimated
+                from it instead of being counted, and the file is not tokenized again.
+        """
+        if nb_tokens is None:
+            count_tokens = self.count_tokens
+        else:
+            tokens_per_char = nb_tokens / max(1, len(code))
+            count_tokens = lambda text: int(len(text) * tokens_per_char) + 1
+        chunks: List[CodeChunk] = []
+        pieces: List[CodePiece] = []
+        size = 0
+
+        def flush():
+            if pieces:
+                names = [piece.name for piece in pieces if piece.name and piece.kind != "footer"]
+                chunks.append(CodeChunk("".join(piece.text for piece in pieces), pieces[0].start_line, pieces[-1].end_line, list(dict.fromkeys(names)), size))
+
+        for top_piece in split_code(code, file_name):
+            for piece, piece_tokens in self._fit(top_piece, max_tokens, count_tokens):
+                if pieces and size + piece_tokens > max_tokens:
+                    flush()
+                    pieces, size = [], 0
+                pieces.append(piece)
+                size += piece_tokens
+        flush()
+        return chunks
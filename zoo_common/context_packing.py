@@ -0,0 +1,124 @@
+"""
+Token budget aware context packing.
+
+Retrieval personalities pick the most relevant pieces of text and paste them in
+the prompt. ContextPacker fills a token budget greedily by relevance, skipping
+pieces that mostly repeat an already selected one (overlapping chunks), and
+never tokenizes the assembled prompt: each piece is counted once, either when it
+is indexed (pass nb_tokens) or on first use through an LRU cache of counts.
+"""
+import re
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable, List, Optional, Set
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+class ContextItem:
+    def __init__(self, text: str, score: float = 0.0, nb_tokens: Optional[int] = None, source: str = "", metadata: Optional[dict] = None) -> None:
+        self.text = text
+        self.score = score
+        self.nb_tokens = nb_tokens
+        self.source = source
+        self.metadata = metadata or {}
+
+
+class PackedContext:
+    def __init__(self, items: List[ContextItem], nb_tokens: int, dropped: List[ContextItem]) -> None:
+        self.items = items
+        self.nb_tokens = nb_tokens
+        self.dropped = dropped
+
+    def join(self, formatter: Callable[[ContextItem], str] = lambda item: item.text, separator: str = "\n") -> str:
+        return separator.join(formatter(item) for item in self.items)
+
+
+class TokenCounter:
+    """Counts tokens with a tokenizer, memoizing the counts of recently seen texts."""
+    def __init__(self, tokenize: Callable[[str], list], cache_size: int = 4096) -> None:
+        self.tokenize = tokenize
+        self.cache_size = cache_size
+        self.cache: "OrderedDict[str, int]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __call__(self, text: str) -> int:
+        key = hashlib.sha1(text.encode("utf8")).hexdigest()
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+        count = len(self.tokenize(text))
+        with self.lock:
+            self.cache[key] = count
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return count
+
+
+def _trigrams(text: str) -> Set[tuple]:
+    words = _WORD_RE.findall(text.lower())
+    if len(words) < 3:
+        return {tuple(words)} if words else set()
+    return set(zip(words, words[1:], words[2:]))
+
+
+def containment(a: Set[tuple], b: Set[tuple]) -> float:
+    """Share of the smaller set that is contained in the other one."""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / min(len(a), len(b))
+
+
+class ContextPacker:
+    """
+    Args:
+        count_tokens: Token counter used for items that don't carry their size.
+        item_overhead: Tokens added by the header the caller puts around each item.
+        dedup_threshold: Items whose word trigrams are contained in an already selected
+            item above this ratio are skipped. 1.0 disables deduplication.
+    """
+    def __init__(self, count_tokens: Callable[[str], int], item_overhead: int = 0, dedup_threshold: float = 0.8) -> None:
+        self.count_tokens = count_tokens
+        self.item_overhead = item_overhead
+        self.dedup_threshold = dedup_threshold
+
+    def size(self, item: ContextItem) -> int:
+        if item.nb_tokens is None:
+            item.nb_tokens = self.count_tokens(item.text)
+        return item.nb_tokens + self.item_overhead
+
+    def pack(self, items: List[ContextItem], budget: int, max_items: Optional[int] = None) -> PackedContext:
+        """
+        Selects items by decreasing score while they fit in budget tokens.
+
+        Smaller, less relevant items can still fill the room left by a large item that did not fit.
+        The selected items keep their relevance order.
+        """
+        selected: List[ContextItem] = []
+        selected_grams: List[Set[tuple]] = []
+        dropped: List[ContextItem] = []
+        used = 0
+        for item in sorted(items, key=lambda x: -x.score):
+            if max_items is not None and len(selected) >= max_items:
+                dropped.append(item)
+                continue
+            size = self.size(item)
+            if used + size > budget:
+                dropped.append(item)
+                continue
+            if self.dedup_threshold < 1.0:
+                grams = _trigrams(item.text)
+                if any(containment(grams, other) >= self.dedup_threshold for other in selected_grams):
+                    dropped.append(item)
+                    continue
+                selected_grams.append(grams)
+            selected.append(item)
+            used += size
+        return PackedContext(selected, used, dropped)
+
+
+def available_budget(ctx_size: int, reserved_for_answer: int, *used: int, margin: float = 0.05) -> int:
+    """Tokens left for the documentation once the answer, the other prompt parts and a safety margin are set aside."""
+    return max(0, int(ctx_size * (1 - margin)) - reserved_for_answer - sum(used))
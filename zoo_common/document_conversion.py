@@ -0,0 +1,170 @@
+"""
+Shared docling document conversion.
+
+Building a docling DocumentConverter loads its models, which costs far more than
+converting a single page. This module keeps one converter per process, created
+on first use, and can spread conversions over a process pool whose workers each
+build their converter once. Converted markdown is stored in a content-addressed
+cache: local files are keyed by the hash of their bytes and urls by the hash of
+the url and of a version given by the caller. A page can change behind the same
+url, the caller passes a version that changes with it (the hash of a feed entry
+for instance) so that a changed page is converted again.
+"""
+import hashlib
+import threading
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Union
+
+_converter = None
+_converter_lock = threading.Lock()
+
+_services: Dict[tuple, "DocumentConversionService"] = {}
+_services_lock = threading.Lock()
+
+
+def get_converter():
+    """Returns the DocumentConverter of this process, building it on first call."""
+    global _converter
+    if _converter is None:
+        with _converter_lock:
+            if _converter is None:
+                from docling.document_converter import DocumentConverter
+                _converter = DocumentConverter()
+    return _converter
+
+
+def convert_to_markdown(source: str) -> str:
+    """Converts a file path or url to markdown with the process-wide converter."""
+    result = get_converter().convert(source)
+    return result.document.export_to_markdown()
+
+
+def _is_url(source: str) -> bool:
+    return source.startswith(("http://", "https://"))
+
+
+def source_key(source: Union[str, Path], version: Optional[str] = None) -> str:
+    """
+    Content-addressed cache key of a document.
+
+    Args:
+        version: For urls, identifies the version of the page. Ignored for files, whose bytes are hashed.
+    """
+    source = str(source)
+    if _is_url(source):
+        return hashlib.sha256(source.encode("utf8") if version is None else f"{source}\0{version}".encode("utf8")).hexdigest()
+    hasher = hashlib.sha256()
+    with open(source, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+class DocumentConversionService:
+    """
+    Converts documents to markdown with caching and optional process parallelism.
+
+    Args:
+        cache_folder: Where converted markdown is stored. None disables the cache.
+        max_workers: Number of conversion processes. 0 converts in the calling process.
+    """
+    def __init__(self, cache_folder: Optional[Path] = None, max_workers: int = 0) -> None:
+        self.cache_folder = Path(cache_folder) if cache_folder else None
+        if self.cache_folder:
+            self.cache_folder.mkdir(parents=True, exist_ok=True)
+        self.max_workers = max(0, max_workers)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def _cache_path(self, key: str) -> Optional[Path]:
+        if not self.cache_folder:
+            return None
+        return self.cache_folder / key[:2] / f"{key}.md"
+
+    def get_cached(self, source: Union[str, Path], version: Optional[str] = None) -> Optional[str]:
+        path = self._cache_path(source_key(source, version))
+        if path is not None and path.exists():
+            return path.read_text(encoding="utf8")
+        return None
+
+    def _store(self, key: str, markdown: str) -> None:
+        path = self._cache_path(key)
+        if path is None:
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(markdown, encoding="utf8")
+        tmp.replace(path)
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+            return self._pool
+
+    def convert(self, source: Union[str, Path], version: Optional[str] = None) -> str:
+        """Converts a single document, using the cache when possible."""
+        return self.convert_many([source], versions=[version])[0]
+
+    def convert_many(self, sources: List[Union[str, Path]], raise_errors: bool = True, versions: Optional[List[Optional[str]]] = None) -> List[Optional[str]]:
+        """
+        Converts several documents, in parallel when the service has workers.
+
+        Args:
+            sources: File paths or urls.
+            raise_errors: When False, documents that fail to convert are returned as None.
+            versions: The version of each url (see source_key), None when the url never changes.
+        Returns:
+            The markdown of each document, in the order of sources.
+        """
+        keys = [source_key(s, v) for s, v in zip(sources, versions or [None] * len(sources))]
+        results: List[Optional[str]] = [None] * len(sources)
+        missing = []
+        for i, key in enumerate(keys):
+            path = self._cache_path(key)
+            if path is not None and path.exists():
+                results[i] = path.read_text(encoding="utf8")
+            else:
+                missing.append(i)
+
+        if self.max_workers > 0 and len(missing) > 1:
+            pool = self._get_pool()
+            futures = {i: pool.submit(convert_to_markdown, str(sources[i])) for i in missing}
+            outcomes = {}
+            for i, future in futures.items():
+                try:
+                    outcomes[i] = future.result()
+                except Exception as ex:
+                    outcomes[i] = ex
+        else:
+            outcomes = {}
+            for i in missing:
+                try:
+                    outcomes[i] = convert_to_markdown(str(sources[i]))
+                except Exception as ex:
+                    outcomes[i] = ex
+
+        for i, outcome in outcomes.items():
+            if isinstance(outcome, Exception):
+                if raise_errors:
+                    raise outcome
+                continue
+            self._store(keys[i], outcome)
+            results[i] = outcome
+        return results
+
+    def shutdown(self) -> None:
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
+
+def get_document_conversion_service(cache_folder: Optional[Path] = None, max_workers: int = 0) -> DocumentConversionService:
+    """Returns the process-wide service for this cache folder and pool size, creating it once."""
+    key = (str(cache_folder) if cache_folder else "", max(0, max_workers))
+    with _services_lock:
+        if key not in _services:
+            _services[key] = DocumentConversionService(cache_folder, max_workers)
+        return _services[key]
@@ -0,0 +1,32 @@
+"""
+Embedding helpers that need no model.
+"""
+import re
+import zlib
+import numpy as np
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+class HashingEmbedder:
+    """
+    Stateless bag of words embedding using feature hashing.
+
+    Unlike a fitted tf-idf vectorizer its vocabulary never changes, so documents
+    can be added one by one without re-embedding the previous ones.
+    """
+    def __init__(self, dim: int = 4096) -> None:
+        self.dim = dim
+
+    def __call__(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in _WORD_RE.findall(text.lower()):
+            vector[zlib.crc32(word.encode("utf8")) % self.dim] += 1
+        return np.log1p(vector)
+
+
+def normalize(vector) -> np.ndarray:
+    """Returns the L2 normalized float32 copy of a vector."""
+    vector = np.asarray(vector, dtype=np.float32).ravel()
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
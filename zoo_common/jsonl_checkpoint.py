@@ -0,0 +1,64 @@
+"""
+Append-only JSONL checkpoints.
+
+Long runs (dataset synthesis, model evaluation) append every record to a JSONL
+file as soon as it exists, so an interrupted run resumes from the last written
+record. A run killed during a write leaves a torn last line; loading drops it
+and truncates the file to the last complete record, so the next record starts
+on its own line instead of being glued to the torn one.
+"""
+import json
+import threading
+from pathlib import Path
+from typing import List
+
+
+class JsonlCheckpoint:
+    """Append-only JSONL file, each record is flushed as soon as it is written."""
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self.file = None
+
+    def load(self) -> List[dict]:
+        """The records written so far. A record torn by an interrupted run is dropped."""
+        if not self.path.exists():
+            return []
+        records = []
+        valid = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    break
+                valid += len(line)
+        if valid != self.path.stat().st_size:
+            with open(self.path, "r+b") as f:
+                f.truncate(valid)
+        return records
+
+    def append(self, record: dict) -> None:
+        with self.lock:
+            if self.file is None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self.file = open(self.path, "a", encoding="utf-8")
+            self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self.file.flush()
+
+    def clear(self) -> None:
+        """Deletes the records written so far."""
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+            if self.path.exists():
+                self.path.unlink()
+
+    def close(self) -> None:
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
@@ -0,0 +1,203 @@
+"""
+Embedding index of the mounted personalities.
+
+Routing personalities (queen of the borg, project manager, debate manager) pick
+the personalities able to handle a request. Pasting the description of every
+mounted personality in a prompt grows with the number of mounted personalities,
+so the descriptions are embedded once, the vectors are kept on disk next to the
+hash of the SOUL.md they come from, and a request only needs one embedding and
+one matrix product to shortlist the best candidates. The model then confirms
+the choice among the shortlist.
+
+The embeddings of the mounted model are used when its binding provides them, a
+bag of words only matches requests that share words with the descriptions and
+is kept as the fallback.
+"""
+import re
+import json
+import hashlib
+import threading
+import numpy as np
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from zoo_common.embeddings import HashingEmbedder, normalize
+
+_indexes: Dict[tuple, "RoutingIndex"] = {}
+_indexes_lock = threading.Lock()
+_model_embedders: Dict[int, tuple] = {}
+
+
+def personality_key(personality) -> str:
+    return str(getattr(personality, "personality_package_path", "") or personality.name)
+
+
+def personality_text(personality) -> str:
+    return f"{personality.name}\n{personality.personality_description}"
+
+
+def soul_path(personality) -> Optional[Path]:
+    package_path = getattr(personality, "personality_package_path", None)
+    if package_path is None:
+        return None
+    soul = Path(package_path) / "SOUL.md"
+    return soul if soul.exists() else None
+
+
+def personality_digest(personality) -> str:
+    """Hash of the SOUL.md of a personality, or of its description when it has none."""
+    soul = soul_path(personality)
+    if soul is not None:
+        return hashlib.sha256(soul.read_bytes()).hexdigest()
+    return hashlib.sha256(personality_text(personality).encode("utf8")).hexdigest()
+
+
+def embedder_file_name(embedder_name: str) -> str:
+    """A file name part identifying an embedder, readable and without path separators."""
+    if re.fullmatch(r"[\w.-]+", embedder_name):
+        return embedder_name
+    slug = re.sub(r"[^\w.-]+", "_", embedder_name).strip("_")[:48]
+    return f"{slug}_{hashlib.sha256(embedder_name.encode('utf8')).hexdigest()[:8]}"
+
+
+class RoutingIndex:
+    """
+    Args:
+        folder: Where the index is stored.
+        embed: Text embedding function. Defaults to a hashing embedder that needs no model.
+        embedder_name: Identifies embed, the index is rebuilt when it changes.
+    """
+    def __init__(self, folder: Path, embed: Optional[Callable[[str], np.ndarray]] = None, embedder_name: str = "hashing") -> None:
+        self.folder = Path(folder)
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.embed = embed or HashingEmbedder(1024)
+        self.embedder_name = embedder_name
+        # Each embedder has its own files, switching between embedders doesn't embed everything again
+        stem = f"routing_{embedder_file_name(embedder_name)}"
+        self.manifest_path = self.folder / f"{stem}.json"
+        self.vectors_path = self.folder / f"{stem}.npy"
+        self.entries: Dict[str, dict] = {}
+        self.vectors: Dict[str, np.ndarray] = {}
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self) -> None:
+        if not self.manifest_path.exists() or not self.vectors_path.exists():
+            return
+        try:
+            manifest = json.loads(self.manifest_path.read_text(encoding="utf8"))
+            matrix = np.load(self.vectors_path)
+        except Exception:
+            return
+        if manifest.get("embedder") != self.embedder_name:
+            return
+        self.entries = manifest["entries"]
+        self.vectors = {key: matrix[entry["row"]] for key, entry in self.entries.items()}
+
+    def save(self) -> None:
+        keys = list(self.vectors)
+        for row, key in enumerate(keys):
+            self.entries[key]["row"] = row
+        matrix = np.stack([self.vectors[key] for key in keys]) if keys else np.zeros((0, 1), dtype=np.float32)
+        with open(self.vectors_path.with_suffix(".tmp"), "wb") as f:
+            np.save(f, matrix)
+        self.vectors_path.with_suffix(".tmp").replace(self.vectors_path)
+        tmp = self.manifest_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"embedder": self.embedder_name, "entries": self.entries}, indent=4), encoding="utf8")
+        tmp.replace(self.manifest_path)
+
+    def sync(self, personalities: list) -> int:
+        """
+        Embeds the personalities that are new or whose SOUL.md changed.
+
+        Returns:
+            The number of entries updated.
+        """
+        with self.lock:
+            changed = 0
+            for personality in personalities:
+                key = personality_key(personality)
+                soul = soul_path(personality)
+                # Files whose size and modification time did not change are not hashed again
+                stamp = [soul.stat().st_mtime_ns, soul.stat().st_size] if soul is not None else None
+                entry = self.entries.get(key)
+                if entry is not None and key in self.vectors and stamp is not None and entry.get("stamp") == stamp:
+                    continue
+                digest = personality_digest(personality)
+                if entry is not None and entry["hash"] == digest and key in self.vectors:
+                    if entry.get("stamp") != stamp:
+                        entry["stamp"] = stamp
+                        changed += 1
+                    continue
+                self.vectors[key] = normalize(self.embed(personality_text(personality)))
+                self.entries[key] = {"hash": digest, "stamp": stamp, "name": personality.name}
+                changed += 1
+            if changed:
+                self.save()
+            return changed
+
+    def shortlist(self, query: str, personalities: list, top_k: int = 5) -> List[Tuple[int, float]]:
+        """
+        Ranks personalities by similarity of their description to the query.
+
+        Returns:
+            Up to top_k (index in personalities, similarity) pairs, best first.
+        """
+        if not personalities:
+            return []
+        self.sync(personalities)
+        matrix = np.stack([self.vectors[personality_key(p)] for p in personalities])
+        query_vector = normalize(self.embed(query))
+        if isinstance(self.embed, HashingEmbedder):
+            # Words shared by many descriptions say little about who should answer
+            idf = np.log((1 + len(matrix)) / (1 + (matrix > 0).sum(axis=0))).astype(np.float32)
+            matrix = matrix * idf
+            matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+            query_vector = normalize(query_vector * idf)
+        scores = matrix @ query_vector
+        order = np.argsort(-scores)[:top_k]
+        return [(int(i), float(scores[i])) for i in order]
+
+
+def get_routing_index(folder: Path, embed: Optional[Callable[[str], np.ndarray]] = None, embedder_name: str = "hashing") -> RoutingIndex:
+    """Returns the process-wide index stored in folder, creating it once."""
+    key = (str(folder), embedder_name)
+    with _indexes_lock:
+        if key not in _indexes:
+            _indexes[key] = RoutingIndex(folder, embed, embedder_name)
+        return _indexes[key]
+
+
+def model_embedder(personality) -> Tuple[Optional[Callable[[str], np.ndarray]], str]:
+    """
+    The embedding function of the model mounted by a personality and a name identifying it.
+
+    Returns:
+        (None, "hashing") when the binding can't embed texts.
+    """
+    model = getattr(personality, "model", None)
+    with _indexes_lock:
+        cached = _model_embedders.get(id(model))
+        if cached is not None and cached[0] is model:
+            return cached[1]
+    embedder = (None, "hashing")
+    if callable(getattr(model, "embed", None)):
+        try:
+            vector = model.embed("routing")
+            if vector is not None and np.asarray(vector).size > 0:
+                config = personality.config
+                embedder = (
+                    lambda text: np.asarray(model.embed(text), dtype=np.float32).ravel(),
+                    f"model:{config.binding_name}::{config.model_name}"
+                )
+        except Exception:
+            pass
+    with _indexes_lock:
+        _model_embedders[id(model)] = (model, embedder)
+    return embedder
+
+
+def get_personality_routing_index(personality, folder: Path) -> RoutingIndex:
+    """Returns the index of folder built with the embeddings of the model mounted by personality, or with hashing when it has none."""
+    embed, embedder_name = model_embedder(personality)
+    return get_routing_index(folder, embed, embedder_name)
@@ -0,0 +1,125 @@
+"""
+Persistent SQLite access for personality databases.
+
+Opening a connection parses the schema and discards the statement cache, which
+costs more than the small queries personalities run on every turn. A
+SQLiteDatabase keeps one connection per thread for the life of the thread, so the
+sqlite3 statement cache acts as a set of prepared statements, and puts the file
+in WAL mode so readers don't wait for writers. Schema changes are listed in
+the migrations attribute and applied once, tracked by PRAGMA user_version.
+"""
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, Optional, Tuple, Union
+
+Migration = Union[str, Callable[[sqlite3.Connection], None]]
+
+
+class SQLiteDatabase:
+    """
+    Base class of the personality databases.
+
+    Subclasses set migrations to the ordered list of their schema changes, each one
+    an sql script or a function receiving the connection. Appending an entry is
+    enough to upgrade existing databases; entries must never be edited or removed.
+
+    Args:
+        db_path: Path of the database file.
+        cached_statements: Size of the prepared statement cache of each connection.
+        timeout: Seconds a writer waits for the lock held by another writer.
+    """
+    migrations: List[Migration] = []
+
+    def __init__(self, db_path, cached_statements: int = 128, timeout: float = 10.0) -> None:
+        self.db_path = str(db_path)
+        self.cached_statements = cached_statements
+        self.timeout = timeout
+        self._local = threading.local()
+        self._connections: List[Tuple[threading.Thread, sqlite3.Connection]] = []
+        self._connections_lock = threading.Lock()
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.migrate()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """The connection of the calling thread, opened on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Each connection is only used by the thread that opened it, check_same_thread
+            # is lifted so that the connections of other threads can be closed from any thread
+            conn = sqlite3.connect(self.db_path, timeout=self.timeout, cached_statements=self.cached_statements, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._connections_lock:
+                # lollms runs every message on a new thread, the connections of finished threads are released here
+                alive = []
+                for thread, thread_conn in self._connections:
+                    if thread.is_alive():
+                        alive.append((thread, thread_conn))
+                    else:
+                        thread_conn.close()
+                alive.append((threading.current_thread(), conn))
+                self._connections = alive
+        return conn
+
+    @property
+    def schema_version(self) -> int:
+        return self.connection.execute("PRAGMA user_version").fetchone()[0]
+
+    def migrate(self) -> None:
+        """Applies the migrations the database has not seen yet."""
+        conn = self.connection
+        version = self.schema_version
+        for number, migration in enumerate(self.migrations[version:], start=version + 1):
+            if isinstance(migration, str):
+                conn.executescript(migration)
+            else:
+                migration(conn)
+            conn.execute(f"PRAGMA user_version = {number}")
+            conn.commit()
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Cursor]:
+        """Yields a cursor whose statements are committed together, or rolled back on error."""
+        conn = self.connection
+        cursor = conn.cursor()
+        try:
+            yield cursor
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+    def write(self, sql: str, params: tuple = ()) -> Optional[int]:
+        """Runs a single statement in its own transaction and returns the id of the inserted row."""
+        with self.transaction() as cursor:
+            cursor.execute(sql, params)
+            return cursor.lastrowid
+
+    def fetchone(self, sql: str, params: tuple = ()) -> Optional[tuple]:
+        return self.connection.execute(sql, params).fetchone()
+
+    def fetchall(self, sql: str, params: tuple = ()) -> List[tuple]:
+        return self.connection.execute(sql, params).fetchall()
+
+    def iter_rows(self, sql: str, params: tuple = (), batch_size: int = 100) -> Iterator[tuple]:
+        """Streams the rows of a query, holding at most batch_size of them in memory."""
+        cursor = self.connection.execute(sql, params)
+        try:
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            cursor.close()
+
+    def close(self) -> None:
+        with self._connections_lock:
+            for _, conn in self._connections:
+                conn.close()
+            self._connections = []
+        self._local = threading.local()